@@ -0,0 +1,4 @@
+import sys
+from resorganizer.cli import main
+
+sys.exit(main())
@@ -1,10 +1,19 @@
 import inspect
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import os
 import os.path
 import shutil
 import re
-import numpy as np
+import hashlib
+import mmap
+import warnings
+
+RESEARCH_DIR_PATTERN = re.compile('^(?P<year>\d+)-(?P<month>\d+)-(?P<day>\d+)_(?P<research_name>\S+)')
+TASK_DIR_PATTERN = re.compile('^(?P<task_number>\d+)-(?P<task_name>\S+)')
+
+class InconsistentColumns(Exception):
+    pass
 
 def create_file_mkdir(filepath):
     """Opens a filepath in a write mode (i.e., creates/overwrites it). If the path does not exists,
@@ -74,6 +83,48 @@ def rm(target):
     else:
         shutil.rmtree(target)
 
+def file_sha256(path, bufsize=2**20):
+    """Returns the sha256 hex digest of the file given by path. The file is read by blocks of bufsize bytes.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(partial(f.read, bufsize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def list_files(targets):
+    """Returns the list of paths to all files in targets which are files or dirs (searched recursively,
+    symlinks to dirs are not followed). Non-existing targets are skipped.
+    """
+    paths = []
+    for target in targets:
+        if os.path.isfile(target):
+            paths.append(target)
+        else:
+            for dirpath, _, filenames in os.walk(target):
+                paths += [os.path.join(dirpath, filename) for filename in filenames]
+    return paths
+
+def hash_files(targets, workers=8, bufsize=2**22):
+    """Returns the dictionary mapping the path to each file in targets (see list_files()) to its sha256 hex digest.
+    Files are hashed by workers threads in parallel (hashlib releases the GIL while hashing large blocks).
+    """
+    paths = list_files(targets)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(partial(file_sha256, bufsize=bufsize), paths)))
+
+def get_dir_size(path):
+    """Returns the total size of all files in the dir given by path (symlinks are not followed).
+    """
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                size += get_dir_size(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
 def merge_dicts(*dict_args):
     """Given any number of dicts, shallow copy and merge into a new dict,
     precedence goes to key value pairs in latter dicts.
@@ -88,17 +139,37 @@ def find_dir_by_named_regexp(regexp, where):
     """Search for dir in where which satisfies regexp. If successful, parses the dir according to named regexp.
     Returns a tuple (found_dir, params_from_named_regexp) or None if not found.
     """
-    dirnames = next(os.walk(where))[1]
-    for dir_ in dirnames:
-        parsing_params = parse_by_named_regexp(regexp, dir_)
-        if parsing_params is not None:
-            return dir_, parsing_params
-    return None
+    return next(iter_dirs_by_named_regexp(regexp, where), None)
+
+def iter_dirs_by_named_regexp(regexp, where):
+    """Iterates over all dirs in where which satisfy regexp (a string or a compiled pattern). 
+    Yields tuples (found_dir, params_from_named_regexp).
+    """
+    pattern = re.compile(regexp)
+    for dir_ in iter_dirnames(where):
+        matching = pattern.search(dir_)
+        if matching is not None:
+            yield dir_, matching.groupdict()
+
+def map_dirs_by_named_regexp(regexp, where):
+    """Parses all dirs in where according to named regexp in a single pass. Returns a dictionary where a key is
+    a dir satisfying regexp and a value is a dictionary of params from named regexp.
+    """
+    return dict(iter_dirs_by_named_regexp(regexp, where))
+
+def iter_dirnames(where):
+    """Iterates over the names of dirs in where. Unlike os.walk(), it does not stat entries if the filesystem
+    provides their types while listing.
+    """
+    with os.scandir(where) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield entry.name
 
 def parse_by_named_regexp(regexp, val):
-    """Parses val according to named regexp. Return a dictionary of params.
+    """Parses val according to named regexp (a string or a compiled pattern). Return a dictionary of params.
     """
-    matching = re.search(regexp, val)
+    matching = re.compile(regexp).search(val)
     if matching is None:
         return None
     return matching.groupdict()
@@ -117,39 +188,158 @@ def parse_datafile(path, data_names, transform_funcs, cols_to_parse=[]):
         cols_to_parse = range(len(data_names))
     if len(data_names) != len(transform_funcs) or len(data_names) != len(cols_to_parse):
         raise Exception('Number of data names, transform functions and columns to be parsed is inconsistent')
+
+    with open(path, 'r') as f: # if not found, expection will be raised anyway
+        f.readline() # skip the first line
+        rows = [line.split() for line in f]
+    if len(rows) != 0 and min(len(row) for row in rows) < len(data_names):
+        raise Exception('Number of given data names is larger than number of columns we have in the data file.')
     data = {}
-    for data_name in data_names:
-        data[data_name] = []
-
-    f = open(path, 'r') # if not found, expection will be raised anyway
-    lines = f.readlines()
-    for line in lines[1:]: # skip the first line
-        tmp = line.split()
-        if len(tmp) < len(data_names):
-            raise Exception('Number of given data names is larger than number of columns we have in the data file.')
-        for i, data_name in enumerate(data_names):
-            val = tmp[cols_to_parse[i]]
-            data[data_name].append(transform_funcs[i](val))
+    for data_name, transform_func, col in zip(data_names, transform_funcs, cols_to_parse):
+        data[data_name] = [transform_func(row[col]) for row in rows]
     return data
 
-def parse_timed_numdatafile(path):
+def parse_numdatafile(path, usecols=None, skip_rows=1):
+    """Parses a numerical data file given by path and structured as a table where rows are separated by \n
+    and columns are separated by any of whitespaces. The first skip_rows lines are ignored. Only columns 
+    with indices from usecols are taken if usecols is not None.
+
+    Returns a contiguous 2D numpy array where rows and columns correspond to those in the file.
+    """
+    import numpy as np
+    chunks = list(iter_numdatafile_chunks(path, chunk_rows=None, usecols=usecols, skip_rows=skip_rows))
+    if len(chunks) == 0:
+        return np.zeros((0, len(usecols) if usecols is not None else 0))
+    return np.ascontiguousarray(np.concatenate(chunks)) if len(chunks) > 1 else np.ascontiguousarray(chunks[0])
+
+def iter_numdatafile_chunks(path, chunk_rows=65536, usecols=None, skip_rows=1, block_size=2**24):
+    """Iterates over a numerical data file (see parse_numdatafile()) by blocks of rows. Yields 2D numpy arrays
+    containing chunk_rows rows (the last one may contain less). If chunk_rows is None, the arrays of any size 
+    are yielded as they are parsed. Only columns with indices from usecols are taken if usecols is not None.
+
+    path can also be a file-like object opened in a binary mode. Otherwise, the file is memory-mapped and 
+    parsed by blocks of block_size bytes so that the memory consumption does not depend on the size of the file.
+    """
+    import numpy as np
+    if isinstance(path, str):
+        f = open(path, 'rb') # if not found, expection will be raised anyway
+        try:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file cannot be mmapped
+            source = f
+    else:
+        f = None
+        source = path
+    try:
+        for _ in range(skip_rows):
+            source.readline()
+        leftover_rows = None
+        for rows in _iter_numdata_blocks(source, block_size):
+            if usecols is not None:
+                rows = rows[:, usecols]
+            if chunk_rows is None:
+                yield rows
+                continue
+            if leftover_rows is not None:
+                rows = np.concatenate((leftover_rows, rows))
+            full_rows_num = (len(rows) // chunk_rows) * chunk_rows
+            for i in range(0, full_rows_num, chunk_rows):
+                yield rows[i:i + chunk_rows]
+            leftover_rows = rows[full_rows_num:] if full_rows_num != len(rows) else None
+        if leftover_rows is not None:
+            yield leftover_rows
+    finally:
+        if source is not f:
+            source.close()
+        if f is not None:
+            f.close()
+
+def _iter_numdata_blocks(source, block_size):
+    """Reads source by blocks of block_size bytes cut at the end of a line and yields them parsed as 2D arrays.
+    """
+    import numpy as np
+    cols_num = None
+    remainder = b''
+    while True:
+        block = source.read(block_size)
+        data = remainder + block
+        if len(block) != 0:
+            cut = data.rfind(b'\n')
+            if cut == -1:
+                remainder = data
+                continue
+            data, remainder = data[:cut + 1], data[cut + 1:]
+        if cols_num is None:
+            first_line = next((line for line in data.splitlines() if line.strip() != b''), None)
+            if first_line is not None:
+                cols_num = len(first_line.split())
+        if cols_num is not None and data.strip() != b'':
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', DeprecationWarning) # numpy warns if it cannot parse a value
+                try:
+                    values = np.fromstring(data, dtype=float, sep=' ')
+                except (DeprecationWarning, ValueError):
+                    raise Exception('Data file contains non-numerical values')
+            if values.size % cols_num != 0 or not _has_fields_per_line(data, cols_num, values.size):
+                raise InconsistentColumns('Number of columns in the data file is inconsistent')
+            yield values.reshape((-1, cols_num))
+        if len(block) == 0:
+            break
+
+def _has_fields_per_line(data, cols_num, fields_num):
+    """Checks that each non-empty line of data (bytes) contains cols_num whitespace-separated fields where
+    fields_num is the total number of fields in data.
+    """
+    import numpy as np
+    chars = np.frombuffer(data, dtype=np.uint8)
+    is_space = chars <= ord(' ') # whitespaces and control chars which cannot appear in numbers anyway
+    is_field_start = ~is_space
+    is_field_start[1:] &= is_space[:-1]
+    field_starts = np.flatnonzero(is_field_start)
+    if len(field_starts) != fields_num:
+        return False
+    # the line index of each field is the number of newlines preceding it
+    fields_per_line = np.bincount(np.searchsorted(np.flatnonzero(chars == ord('\n')), field_starts))
+    return bool(np.all(fields_per_line[fields_per_line != 0] == cols_num))
+
+def parse_timed_numdatafile(path, as_array=False):
     """Parses a data file given by path and structured as a table where rows are separated by \n
     and columns are separated by any of whitespaces. The table here has an interpretation of a matrix whose 
     rows axis corresponds to time axis and columns axis corresponds to data axis. Moreover, the first column
     contains the time values so the data is contained in columns starting from the second one.
 
     Returns time_list (a list of times from the first column) and data_matrix (a list of numpy arrays of data where
-    list's index corresponds to the time index). 
+    list's index corresponds to the time index). If as_array is True, time vector and data matrix are returned
+    as numpy arrays instead (both are views of the same contiguous array). Unless as_array is True, rows may
+    contain different numbers of values.
+    """
+    import numpy as np
+    try:
+        table = parse_numdatafile(path)
+    except InconsistentColumns:
+        if as_array:
+            raise
+        return _parse_ragged_timed_numdatafile(path)
+    if table.shape[1] == 0:
+        time, data = np.zeros((0,)), np.zeros((0, 0))
+    else:
+        time, data = table[:, 0], table[:, 1:]
+    if as_array:
+        return time, data
+    return time.tolist(), list(data)
+
+def _parse_ragged_timed_numdatafile(path):
+    """Parses the data file for parse_timed_numdatafile() line by line so that rows may have different lengths.
     """
+    import numpy as np
     time = []
     data = []
-    f = open(path, 'r') # if not found, expection will be raised anyway
-    lines = f.readlines()
-    for line in lines[1:]: # skip the first line
-        tmp = line.split()
-        time.append(float(tmp[0]))
-        timed_data = np.zeros((len(tmp) - 1, ))
-        for i, val in enumerate(tmp[1:]):
-            timed_data[i] = float(val)
-        data.append(timed_data)
+    with open(path, 'r') as f:
+        f.readline() # skip the first line
+        for line in f:
+            values = line.split()
+            if len(values) == 0:
+                continue
+            time.append(float(values[0]))
+            data.append(np.array([float(val) for val in values[1:]]))
     return time, data
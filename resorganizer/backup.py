@@ -0,0 +1,315 @@
+import os
+import os.path
+import io
+import gzip
+import json
+import hashlib
+import shlex
+import sqlite3
+import stat
+import threading
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from resorganizer.tracing import tracer, in_current_context
+
+BACKUP_DIR = '.backup'
+CHUNKS_DIR = 'chunks'
+SNAPSHOTS_DIR = 'snapshots'
+
+MIN_CHUNK_SIZE = 2**18
+AVG_CHUNK_SIZE = 2**20
+MAX_CHUNK_SIZE = 2**22
+READ_BLOCK_SIZE = 2**23
+CUT_SEARCH_BLOCK_SIZE = 2**20
+HASH_WINDOW_SIZE = 48
+
+class BackupRepository(object):
+    """BackupRepository implements an incremental deduplicated backup of local dirs to a remote accessed via
+    SshCommunication. The remote repository (by default, located in the dir .backup in the research path of
+    the remote) consists of chunks and snapshots:
+    (1) files are split into chunks by content-defined chunking so that a local change of a file changes only
+    a few chunks, and each chunk is stored once under the name given by its sha256
+    (2) a snapshot is a gzipped json manifest listing files together with their chunks
+
+    A local index (SQLite database located at index_path) stores the chunks already uploaded into the repository
+    and the chunks of the files backed up before. Files whose size and modification time are not changed are
+    not read at all, so that the backup of an unchanged dir costs only listing it and uploading a new manifest.
+    New chunks are uploaded in parallel by workers threads each using its own SFTP session.
+    """
+    def __init__(self, comm, index_path, repo_path=None, workers=4):
+        self.comm = comm
+        self.repo_path = repo_path if repo_path is not None else '/'.join((comm.host.research_abs_path, BACKUP_DIR))
+        self.workers = workers
+        self._repo_id = '{}:{}'.format(comm.machine_name, self.repo_path)
+        self._index = sqlite3.connect(index_path)
+        with self._index:
+            self._index.execute('CREATE TABLE IF NOT EXISTS chunks (repo TEXT NOT NULL, hash TEXT NOT NULL, '
+                                'PRIMARY KEY (repo, hash))')
+            self._index.execute('CREATE TABLE IF NOT EXISTS files (repo TEXT NOT NULL, path TEXT NOT NULL, '
+                                'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, chunks TEXT NOT NULL, '
+                                'PRIMARY KEY (repo, path))')
+        self._sessions = threading.local()
+        self._all_sessions = []
+        self._created_dirs = set()
+        self._dirs_lock = threading.Lock()
+
+    def backup(self, name, local_dirs, exclude=()):
+        """Backs up the content of local_dirs into the snapshot named name. The content of the dirs is merged
+        (if the same relative path is met in several dirs, the first dir takes precedence). Top-level entries
+        whose names are in exclude are skipped. Returns the id of the created snapshot.
+        """
+        self._mkdirp('/'.join((self.repo_path, CHUNKS_DIR)))
+        self._mkdirp('/'.join((self.repo_path, SNAPSHOTS_DIR)))
+        if self._index.execute('SELECT COUNT(*) FROM chunks WHERE repo = ?', (self._repo_id,)).fetchone()[0] == 0:
+            self.sync_index()
+        known_chunks = set(row[0] for row in self._index.execute('SELECT hash FROM chunks WHERE repo = ?', (self._repo_id,)))
+        files = _collect_files(local_dirs, exclude)
+        manifest_files = []
+        uploaded_bytes = 0
+        in_flight = threading.BoundedSemaphore(2 * self.workers) # bounds memory occupied by chunks waiting for upload
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = []
+        try:
+            for rel_path, abs_path, st in files:
+                entry = {'path': rel_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'mode': stat.S_IMODE(st.st_mode)}
+                if stat.S_ISLNK(st.st_mode):
+                    entry['link'] = os.readlink(abs_path)
+                    manifest_files.append(entry)
+                    continue
+                row = self._index.execute('SELECT size, mtime_ns, chunks FROM files WHERE repo = ? AND path = ?',
+                                          (self._repo_id, abs_path)).fetchone()
+                if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                    entry['chunks'] = json.loads(row[2])
+                    if all(chunk_hash in known_chunks for chunk_hash in entry['chunks']):
+                        manifest_files.append(entry)
+                        continue
+                entry['chunks'] = []
+                with open(abs_path, 'rb') as f:
+                    for chunk in iter_chunks(f):
+                        chunk_hash = hashlib.sha256(chunk).hexdigest()
+                        entry['chunks'].append(chunk_hash)
+                        if chunk_hash not in known_chunks:
+                            known_chunks.add(chunk_hash)
+                            in_flight.acquire()
+                            futures.append(executor.submit(in_current_context(self._upload_chunk), chunk_hash, chunk, in_flight))
+                            uploaded_bytes += len(chunk)
+                manifest_files.append(entry)
+                futures = self._commit_uploaded_chunks(futures)
+                with self._index:
+                    self._index.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                        (self._repo_id, abs_path, st.st_size, st.st_mtime_ns, json.dumps(entry['chunks'])))
+            executor.shutdown(wait=True)
+            self._commit_uploaded_chunks(futures, wait=True)
+        finally:
+            executor.shutdown(wait=True)
+            self._close_sessions()
+
+        # the random suffix keeps ids of snapshots created within the same second (e.g., from several machines) unique
+        snapshot_id = '{}_{}_{}'.format(name, datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), uuid.uuid4().hex[:8])
+        manifest = {'name': name, 'created': time.time(), 'files': manifest_files}
+        manifest_data = gzip.compress(json.dumps(manifest).encode())
+        try:
+            self._get_session().putfo(io.BytesIO(manifest_data), '/'.join((self.repo_path, SNAPSHOTS_DIR, snapshot_id + '.json.gz')))
+        finally:
+            self._close_sessions()
+        print('Backed up {} files into snapshot {} ({} bytes uploaded)'.format(len(manifest_files), snapshot_id, uploaded_bytes))
+        return snapshot_id
+
+    def restore(self, snapshot_id, to_dir):
+        """Restores the snapshot snapshot_id into the local dir to_dir.
+        """
+        def restore_file(entry):
+            path = os.path.join(to_dir, entry['path'])
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            if 'link' in entry:
+                os.symlink(entry['link'], path)
+                return
+            sftp = self._get_session()
+            with open(path, 'wb') as f:
+                for chunk_hash in entry['chunks']:
+                    with sftp.open(self._get_chunk_path(chunk_hash), 'rb') as chunk_f:
+                        chunk = chunk_f.read()
+                    tracer.count('bytes_received', len(chunk))
+                    if hashlib.sha256(chunk).hexdigest() != chunk_hash:
+                        raise Exception("Chunk '{}' is corrupted".format(chunk_hash))
+                    f.write(chunk)
+            os.chmod(path, entry['mode'])
+            os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        try:
+            manifest = self._read_manifest(snapshot_id)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(in_current_context(restore_file), manifest['files']))
+        finally:
+            self._close_sessions()
+
+    def list_snapshots(self):
+        """Returns the sorted list of ids of snapshots stored in the repository.
+        """
+        filenames = self.comm.listdir('/'.join((self.repo_path, SNAPSHOTS_DIR)))
+        return sorted(filename[:-len('.json.gz')] for filename in filenames if filename.endswith('.json.gz'))
+
+    def sync_index(self):
+        """Fills the local index of chunks by the chunks present in the repository. It is called automatically
+        when the local index contains no chunks of the repository (e.g., it has been lost).
+        """
+        exit_status, stdout_data, stderr_data = self.comm.execute_and_read("find {} -type f -name '*[0-9a-f]' -printf '%f\\n'".format(
+            shlex.quote('/'.join((self.repo_path, CHUNKS_DIR)))))
+        if exit_status != 0:
+            raise Exception('Listing chunks of the backup repository failed: %s' % stderr_data.decode(errors='replace'))
+        hashes = [line for line in stdout_data.decode().split('\n') if len(line) == 64]
+        with self._index:
+            self._index.executemany('INSERT OR IGNORE INTO chunks VALUES (?, ?)', [(self._repo_id, h) for h in hashes])
+
+    def _commit_uploaded_chunks(self, futures, wait=False):
+        """Records the chunks whose uploads are finished in the local index. Returns the list of unfinished futures.
+        """
+        finished = []
+        unfinished = []
+        for future in futures:
+            (finished if wait or future.done() else unfinished).append(future)
+        if len(finished) != 0:
+            with self._index:
+                self._index.executemany('INSERT OR IGNORE INTO chunks VALUES (?, ?)',
+                                        [(self._repo_id, future.result()) for future in finished])
+        return unfinished
+
+    def _upload_chunk(self, chunk_hash, chunk, in_flight):
+        try:
+            sftp = self._get_session()
+            chunk_path = self._get_chunk_path(chunk_hash)
+            chunk_dir = chunk_path.rsplit('/', 1)[0]
+            with self._dirs_lock:
+                if chunk_dir not in self._created_dirs:
+                    try:
+                        sftp.mkdir(chunk_dir)
+                    except IOError: # already exists
+                        pass
+                    self._created_dirs.add(chunk_dir)
+            tmp_chunk_path = chunk_path + '.tmp'
+            sftp.putfo(io.BytesIO(chunk), tmp_chunk_path)
+            tracer.count('bytes_sent', len(chunk))
+            try:
+                sftp.posix_rename(tmp_chunk_path, chunk_path)
+            except IOError:
+                sftp.rename(tmp_chunk_path, chunk_path)
+            return chunk_hash
+        finally:
+            in_flight.release()
+
+    def _read_manifest(self, snapshot_id):
+        sftp = self._get_session()
+        with sftp.open('/'.join((self.repo_path, SNAPSHOTS_DIR, snapshot_id + '.json.gz')), 'rb') as f:
+            return json.loads(gzip.decompress(f.read()).decode())
+
+    def _get_chunk_path(self, chunk_hash):
+        return '/'.join((self.repo_path, CHUNKS_DIR, chunk_hash[:2], chunk_hash))
+
+    def _get_session(self):
+        sftp = getattr(self._sessions, 'sftp', None)
+        if sftp is None:
+            sftp = self.comm.open_sftp_session()
+            self._sessions.sftp = sftp
+            self._all_sessions.append(sftp)
+        return sftp
+
+    def _close_sessions(self):
+        for sftp in self._all_sessions:
+            sftp.close()
+        self._all_sessions = []
+        self._sessions = threading.local()
+
+    def _mkdirp(self, path):
+        exit_status, _, stderr_data = self.comm.execute_and_read('mkdir -p {}'.format(shlex.quote(path)))
+        if exit_status != 0:
+            raise Exception("Creating dir '{}' failed: {}".format(path, stderr_data.decode(errors='replace')))
+
+def iter_chunks(f, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """Splits the content of binary file-like object f into chunks by content-defined chunking. Yields chunks (bytes).
+    The boundaries of chunks are determined by the rolling hash of the last HASH_WINDOW_SIZE bytes so that
+    they do not move if data is inserted or removed elsewhere. Sizes of chunks lie between min_size and max_size
+    and are close to avg_size (which must be a power of two) on average.
+    """
+    mask = np.uint64(avg_size - 1)
+    pending = b'' # the data read after the last boundary, it precedes block
+    start = 0 # the offset of the last boundary
+    position = 0 # the offset of block
+    cut_candidates = np.zeros((0,), dtype=np.int64)
+    tail = b'' # the last bytes read so that the windows crossing blocks are hashed
+    while True:
+        block = f.read(READ_BLOCK_SIZE)
+        if len(block) == 0:
+            break
+        cut_candidates = np.concatenate([cut_candidates[cut_candidates > start], 
+                                         _find_block_cut_candidates(tail, block, mask) + (position - len(tail))])
+        tail = (tail + block[-HASH_WINDOW_SIZE:])[-HASH_WINDOW_SIZE:]
+        data_end = position + len(block)
+        while True:
+            i = np.searchsorted(cut_candidates, start + min_size)
+            end = int(cut_candidates[i]) if i < len(cut_candidates) else data_end + 1
+            end = min(end, start + max_size)
+            if end > data_end:
+                break
+            if start < position:
+                yield pending + block[:end - position]
+                pending = b''
+            else:
+                yield block[start - position:end - position]
+            start = end
+        pending = pending + block if start < position else block[start - position:]
+        position = data_end
+    if len(pending) != 0:
+        yield pending
+
+def _find_block_cut_candidates(tail, block, mask):
+    """Returns the sorted positions p (relative to the beginning of tail) such that tail + block can be cut before 
+    the byte at p. The block is processed by CUT_SEARCH_BLOCK_SIZE bytes to bound the size of temporary arrays.
+    """
+    candidates = []
+    for offset in range(0, len(block), CUT_SEARCH_BLOCK_SIZE):
+        # each part starts with the last HASH_WINDOW_SIZE bytes of the previous one, so the window ending
+        # at the boundary of parts is hashed once as the last window of the previous part
+        head = tail if offset == 0 else block[offset - HASH_WINDOW_SIZE:offset]
+        part = head + block[offset:offset + CUT_SEARCH_BLOCK_SIZE]
+        candidates.append(_find_cut_candidates(part, mask) + (offset + len(tail) - len(head)))
+    return np.concatenate(candidates) if candidates else np.zeros((0,), dtype=np.int64)
+
+def _find_cut_candidates(data, mask):
+    """Returns the sorted positions p such that data can be cut before data[p] according to the rolling hash.
+    """
+    with np.errstate(over='ignore'):
+        gear = _GEAR_TABLE[np.frombuffer(data, dtype=np.uint8)]
+        cumsum = np.cumsum(gear, dtype=np.uint64, out=gear)
+        window_sum = cumsum[HASH_WINDOW_SIZE:] - cumsum[:-HASH_WINDOW_SIZE]
+        window_sum *= np.uint64(0x9E3779B97F4A7C15)
+        window_sum >>= np.uint64(24)
+        window_sum &= mask
+    # window_sum[k] covers bytes k + 1, ..., k + HASH_WINDOW_SIZE, so the cut is placed after the last one
+    return np.flatnonzero(window_sum == 0) + HASH_WINDOW_SIZE + 1
+
+def _make_gear_table():
+    return np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'little') for i in range(256)], dtype=np.uint64)
+
+_GEAR_TABLE = _make_gear_table()
+
+def _collect_files(local_dirs, exclude):
+    """Returns the list of tuples (relative_path, absolute_path, stat_result) for all files and symlinks in local_dirs.
+    """
+    files = {}
+    for local_dir in local_dirs:
+        if not os.path.isdir(local_dir):
+            continue
+        for dirpath, dirnames, filenames in os.walk(local_dir):
+            rel_dirpath = os.path.relpath(dirpath, local_dir)
+            if rel_dirpath == '.':
+                dirnames[:] = [d for d in dirnames if d not in exclude]
+                filenames = [f for f in filenames if f not in exclude]
+            for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+                rel_path = os.path.normpath(os.path.join(rel_dirpath, name)).replace(os.sep, '/')
+                if rel_path not in files:
+                    abs_path = os.path.join(dirpath, name)
+                    files[rel_path] = (rel_path, abs_path, os.lstat(abs_path))
+    return [files[rel_path] for rel_path in sorted(files)]
@@ -0,0 +1,146 @@
+"""Command-line interface of research-organizer. Run it as
+
+    python -m resorganizer <command> [arguments]
+
+where command is one of the following:
+(1) researches -- lists the ids of all researches
+(2) tasks RESEARCH -- lists the tasks of research (task number, task name and path)
+(3) path RESEARCH TASK_NUMBER [--host HOST_ID] -- prints the path to the task dir (on the remote if host is given)
+(4) grab RESEARCH TASK_NUMBER... --host HOST_ID [--path PATH...] [--verify] -- grabs the results of tasks from the remote
+(5) status RESEARCH [TASK_NUMBER...] [--host HOST_ID] [--wait] [--grab] -- prints the states of tasks
+
+RESEARCH is either the full research id or the research name without the date. Hosts are taken from
+resorganizer.settings.REMOTE_HOSTS. Only the result is printed into stdout whereas messages of the library go
+to stderr so that the output can be used in shell scripts.
+
+The commands researches, tasks and path only look through the distributed storage and thus do not import
+heavy dependencies (paramiko, mako, numpy) so that they start quickly.
+"""
+import os
+import re
+import sys
+import argparse
+import contextlib
+import resorganizer.settings as rset
+from resorganizer.aux import RESEARCH_DIR_PATTERN, TASK_DIR_PATTERN
+from resorganizer.distributed_storage import DistributedStorage
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='resorganizer', description='Command-line interface of research-organizer')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser('researches', help='list the ids of all researches')
+    subparser.set_defaults(func=cmd_researches)
+
+    subparser = subparsers.add_parser('tasks', help='list the tasks of research')
+    subparser.add_argument('research')
+    subparser.set_defaults(func=cmd_tasks)
+
+    subparser = subparsers.add_parser('path', help='print the path to the task dir')
+    subparser.add_argument('research')
+    subparser.add_argument('task_number', type=int)
+    subparser.add_argument('--host', default=None, help='print the path on this remote host')
+    subparser.set_defaults(func=cmd_path)
+
+    subparser = subparsers.add_parser('grab', help='grab the results of tasks from the remote')
+    subparser.add_argument('research')
+    subparser.add_argument('task_numbers', type=int, nargs='+')
+    subparser.add_argument('--host', required=True)
+    subparser.add_argument('--path', nargs='*', default=[], help='paths relative to the task dir to be grabbed (all by default)')
+    subparser.add_argument('--verify', action='store_true', help='verify grabbed files by comparing their hashes')
+    subparser.set_defaults(func=cmd_grab)
+
+    subparser = subparsers.add_parser('status', help='print the states of tasks')
+    subparser.add_argument('research')
+    subparser.add_argument('task_numbers', type=int, nargs='*')
+    subparser.add_argument('--host', default=None, help='remote host where the tasks are executed')
+    subparser.add_argument('--wait', action='store_true', help='wait until the tasks are finished')
+    subparser.add_argument('--grab', action='store_true', help='grab the results of finished tasks (implies --wait)')
+    subparser.add_argument('--timeout', type=float, default=None, help='timeout of waiting in seconds')
+    subparser.set_defaults(func=cmd_status)
+
+    args = parser.parse_args(argv)
+    out = sys.stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr): # messages of the library
+            return args.func(args, out)
+    except Exception as e:
+        print('Error: {}'.format(e), file=sys.stderr)
+        return 1
+
+def cmd_researches(args, out):
+    distr_storage = _make_distr_storage()
+    for research_id in sorted(distr_storage.map_dirs_by_named_regexp('', RESEARCH_DIR_PATTERN)):
+        print(research_id, file=out)
+    return 0
+
+def cmd_tasks(args, out):
+    distr_storage = _make_distr_storage()
+    research_id = _resolve_research_id(distr_storage, args.research)
+    found_dirs = distr_storage.map_dirs_by_named_regexp(research_id, TASK_DIR_PATTERN)
+    for task_number, task_name, task_path in sorted((int(params['task_number']), params['task_name'], path)
+                                                    for path, params in found_dirs.values()):
+        print('{}\t{}\t{}'.format(task_number, task_name, task_path), file=out)
+    return 0
+
+def cmd_path(args, out):
+    distr_storage = _make_distr_storage()
+    research_id = _resolve_research_id(distr_storage, args.research)
+    found_data = distr_storage.find_dir_by_named_regexp(research_id, '^{}-'.format(args.task_number))
+    if found_data is None:
+        raise Exception("No task with number '{}' is found".format(args.task_number))
+    if args.host is None:
+        print(found_data[0], file=out)
+    else:
+        print('/'.join((_get_remote_host_settings(args.host)['research_path'], research_id, os.path.basename(found_data[0]))), file=out)
+    return 0
+
+def cmd_grab(args, out):
+    research = _continue_research(args.research, args.host)
+    for task_number in args.task_numbers:
+        research.grab_task_results(task_number, [{'path': path} for path in args.path], verify=args.verify)
+    for task_number in args.task_numbers:
+        print(research.get_task_path(task_number), file=out)
+    return 0
+
+def cmd_status(args, out):
+    research = _continue_research(args.research, args.host)
+    task_numbers = args.task_numbers if len(args.task_numbers) != 0 else None
+    if args.wait or args.grab:
+        states = research.wait_for_tasks(task_numbers, timeout=args.timeout, grab=args.grab)
+    else:
+        states = research.get_task_states(task_numbers)
+    for task_number, state in sorted(states.items()):
+        units = ' '.join('{}:{}'.format(unit, unit_state) for unit, unit_state in sorted(state['units'].items()))
+        print('{}\t{}\t{}'.format(task_number, state['state'], units), file=out)
+    return 0 if all(state['state'] == 'done' for state in states.values()) else 2
+
+def _make_distr_storage():
+    return DistributedStorage((rset.LOCAL_HOST['main_research_path'], rset.LOCAL_HOST['storage_research_path']),
+                              prior_storage_index=1, source_timeout=rset.LOCAL_HOST.get('source_timeout'))
+
+def _resolve_research_id(distr_storage, research):
+    """Returns the full research id corresponding to research which may be given without the date.
+    """
+    if distr_storage.get_dir_path(research) is not None:
+        return research
+    found_data = distr_storage.find_dir_by_named_regexp('', '^\\d+-\\d+-\\d+_{}$'.format(re.escape(research)))
+    if found_data is None:
+        raise Exception("Research '{}' does not exist".format(research))
+    return os.path.basename(found_data[0])
+
+def _get_remote_host_settings(host_id):
+    if host_id not in rset.REMOTE_HOSTS:
+        raise Exception("Host '{}' is not found in settings".format(host_id))
+    return rset.REMOTE_HOSTS[host_id]
+
+def _continue_research(research, host_id):
+    from resorganizer.research import Research
+    from resorganizer.communication import SshCommunication, RemoteHost
+    comm = None
+    if host_id is not None:
+        host = _get_remote_host_settings(host_id)
+        remote_host = RemoteHost(host['ssh_host'], host['cores'], host['host_relative_data_path'], host['research_path'])
+        comm = SshCommunication(remote_host, host['username'], host['password'])
+    return Research.continue_research(_resolve_research_id(_make_distr_storage(), research), comm)
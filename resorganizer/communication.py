@@ -1,14 +1,70 @@
 import os
 import os.path
+import io
 import shutil
-import paramiko
 import subprocess
 import shlex
+import re
+import glob
+import queue
+import threading
 from stat import S_ISDIR
+from concurrent.futures import ThreadPoolExecutor
 import resorganizer.settings as rser
 from resorganizer.aux import *
-
-paramiko.util.log_to_file("paramiko.log")
+from resorganizer.tracing import tracer, traced, in_current_context
+
+READ_AHEAD_SIZE = 2**22
+
+# Reads null-delimited dirs from stdin and expands glob patterns passed as arguments inside each of them. Prints
+# the total size of matched targets and removes them. Patterns are expanded after entering the dir so that the dir
+# itself is never expanded (since IFS is empty, unquoted $pattern undergoes pathname expansion only). Targets nested
+# in other targets are dropped (sorting with '/' replaced by \001 puts them right after their ancestors).
+RM_MANY_SCRIPT = r'''shopt -s nullglob
+IFS=
+start_dir=$PWD
+targets=()
+while read -r -d '' dir; do
+    cd -- "$start_dir" && cd -- "$dir" 2>/dev/null || continue
+    for pattern in "$@"; do
+        for target in $pattern; do
+            # before bash 5.2 (globskipdots), patterns like .* match . and ..
+            case "${target##*/}" in .|..) continue;; esac
+            if [ -e "$target" ] || [ -L "$target" ]; then targets+=("$dir/$target"); fi
+        done
+    done
+done
+cd -- "$start_dir"
+if [ ${#targets[@]} -eq 0 ]; then echo 0; exit 0; fi
+kept=()
+last=
+while read -r -d '' target; do
+    if [ -n "$last" ] && [[ "$target" == "${last%/}"/* ]]; then continue; fi
+    kept+=("$target")
+    last=$target
+done < <(printf '%s\0' "${targets[@]}" | tr '/' '\001' | LC_ALL=C sort -z -u | tr '\001' '/')
+printf '%s\0' "${kept[@]}" | xargs -0 du -sb -- 2>/dev/null | awk '{s += $1} END {print s + 0}'
+printf '%s\0' "${kept[@]}" | xargs -0 rm -rf --
+'''
+
+# Reads null-delimited paths to files or dirs from stdin and prints sha256 of all files in them as sha256sum does.
+# Non-existing paths are skipped.
+HASH_MANY_SCRIPT = r'''targets=()
+while read -r -d '' target; do targets+=("$target"); done
+if [ ${#targets[@]} -eq 0 ]; then exit 0; fi
+find "${targets[@]}" -type f -print0 2>/dev/null | xargs -0 -r sha256sum --
+'''
+
+# Reads null-delimited paths from stdin and prints the total size of files in each of them (the size of the file itself
+# if it is not a dir, -1 if it does not exist), one line per path. Symlinks are not followed.
+SIZES_SCRIPT = r'''while read -r -d '' target; do
+    if [ -e "$target" ] || [ -L "$target" ]; then
+        find "$target" ! -type d -printf '%s\n' 2>/dev/null | awk '{s += $1} END {print s + 0}'
+    else
+        echo -1
+    fi
+done
+'''
 
 class Host(object):
     """Host is the structure storing all necessary information about the host of execution, namely:
@@ -36,6 +92,7 @@ class RemoteHost(Host):
 def enable_sftp(func):
     def wrapped_func(self, *args, **kwds):
         self._init_sftp()
+        tracer.count('round_trips')
         return func(self, *args, **kwds)
     return wrapped_func
 
@@ -59,9 +116,20 @@ class BaseCommunication(object):
         self.host = host
         self._machine_name = machine_name
 
+    @property
+    def machine_name(self):
+        return self._machine_name
+
     def execute(self, command):
         raise NotImplementedError('This function is not implemented')
 
+    def execute_and_read(self, command, stdin_data=None, printing=True):
+        """Executes command feeding stdin_data (bytes) into its stdin and waits for it to finish. 
+        Returns a tuple (exit_status, stdout_data, stderr_data) where the data are bytes. If printing is False, 
+        the command is not printed.
+        """
+        raise NotImplementedError('This function is not implemented')
+
     def copy(self, from_, to_, mode='from_local'):
         """Copies from_ to to_ which are interpreted according to mode:
         (1) from_local (default) -> from_ is local path, to_ is a path on a communicated machine
@@ -80,9 +148,46 @@ class BaseCommunication(object):
         """
         raise NotImplementedError('This function is not implemented')
 
+    def rm_many(self, dirs, patterns, workers=8):
+        """Removes all files and dirs matching patterns (paths or glob patterns relative to each of dirs, hidden files 
+        are matched only explicitly) in each of dirs. dirs are taken literally, i.e. are not expanded. Patterns must 
+        not be empty, absolute or contain '..'. Targets matched several times or located inside other targets 
+        are removed once. Returns the number of bytes reclaimed.
+        """
+        raise NotImplementedError('This function is not implemented')
+
+    def write_file(self, data, to_, filename):
+        """Writes data (a string) into the file filename located in dir to_ on a communicated machine.
+        filename may contain subdirs. Dir to_ (and subdirs) is created if it does not exist.
+        """
+        raise NotImplementedError('This function is not implemented')
+
+    def hash_files(self, targets, workers=8):
+        """Returns the dictionary mapping the path to each file in targets (files or dirs searched recursively) on
+        a communicated machine to its sha256 hex digest. Non-existing targets are skipped.
+        """
+        raise NotImplementedError('This function is not implemented')
+
+    def get_sizes(self, targets):
+        """Returns the dictionary mapping each path in targets on a communicated machine to the total size of files 
+        in it (or its own size if it is a file). Symlinks are not followed. Non-existing targets are skipped.
+        """
+        raise NotImplementedError('This function is not implemented')
+
+    def open_file(self, path, read_ahead=READ_AHEAD_SIZE):
+        """Opens the file path on a communicated machine for reading in a binary mode. Returns a file-like object
+        supporting read() and readline() which must be closed by the caller (it can be used as a context manager).
+        Data is read ahead by blocks of read_ahead bytes where applicable so that the memory consumption does not
+        depend on the size of the file.
+        """
+        raise NotImplementedError('This function is not implemented')
+
     def _print_copy_msg(self, from_, to_):
         print('\tCopying %s to %s' % (from_, to_))
 
+    def _print_write_msg(self, to_):
+        print('\tWriting %s' % to_)
+
     def _print_exec_msg(self, cmd, is_remote):
         where = '@' + self._machine_name if is_remote else ''
         print('\tExecuting %s: %s' % (where, cmd))
@@ -91,6 +196,7 @@ class LocalCommunication(BaseCommunication):
     def __init__(self, local_host, machine_name='laptop'):
         super(LocalCommunication, self).__init__(local_host, machine_name)
 
+    @traced()
     def execute(self, command):
         # use PIPEs to avoid breaking the child process when the parent process finishes
         # (works on Linux, solution for Windows is to add creationflags=0x00000010 instead of stdout, stderr, stdin)
@@ -99,39 +205,144 @@ class LocalCommunication(BaseCommunication):
         #print(pid)
         subprocess.call([command], shell=True)
 
+    @traced()
+    def execute_and_read(self, command, stdin_data=None, printing=True):
+        if printing:
+            self._print_exec_msg(command, is_remote=False)
+        p = subprocess.run(command, shell=True, input=stdin_data if stdin_data is not None else b'', 
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return p.returncode, p.stdout, p.stderr
+
+    @traced()
     def copy(self, from_, to_, mode='from_local'):
         """Any mode is ignored since the copying shall be within a local machine anyway
         """
         cp(from_, to_)
         self._print_copy_msg(from_, to_)
 
+    @traced()
     def rm(self, target):
         rm(target)
 
+    @traced()
+    def rm_many(self, dirs, patterns, workers=8):
+        """Targets are removed by workers threads in parallel. Targets vanished meanwhile are skipped.
+        """
+        _check_rm_patterns(patterns)
+        paths = set(path for dir_ in dirs for pattern in patterns 
+                    for path in glob.glob(os.path.join(glob.escape(dir_), pattern)))
+        paths = _drop_nested_paths(paths)
+        def remove(path):
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    size = get_dir_size(path)
+                    shutil.rmtree(path)
+                else:
+                    size = os.lstat(path).st_size
+                    os.remove(path)
+            except FileNotFoundError:
+                return 0
+            return size
+        print('\tRemoving %d targets' % len(paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(in_current_context(remove), paths))
+
+    @traced()
+    def write_file(self, data, to_, filename):
+        path = os.path.join(to_, filename)
+        f = create_file_mkdir(path)
+        f.write(data)
+        f.close()
+        self._print_write_msg(path)
+
+    @traced()
+    def hash_files(self, targets, workers=8):
+        """Files are hashed by workers threads in parallel.
+        """
+        return hash_files(targets, workers)
+
+    def get_sizes(self, targets):
+        sizes = {}
+        for target in targets:
+            if os.path.isdir(target) and not os.path.islink(target):
+                sizes[target] = get_dir_size(target)
+            elif os.path.lexists(target):
+                sizes[target] = os.lstat(target).st_size
+        return sizes
+
+    @traced()
+    def open_file(self, path, read_ahead=READ_AHEAD_SIZE):
+        """read_ahead is ignored since the OS reads ahead itself.
+        """
+        return open(path, 'rb')
+
 class SshCommunication(BaseCommunication):
-    def __init__(self, remote_host, username, password):
+    def __init__(self, remote_host, username, password, port=22):
         if not isinstance(remote_host, RemoteHost):
             Exception('Only RemoteHost can be used to build SshCommunication')
+        import paramiko # imported here since it is slow to import and not needed for local work
+        _init_paramiko_logging(paramiko)
         self.host = remote_host
         self.ssh_client = paramiko.SSHClient()
         self.sftp_client = None
         #self.main_dir = '/nobackup/mmap/research'
         self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh_client.connect(self.host.ssh_host, username=username, password=password)
+        self.ssh_client.connect(self.host.ssh_host, port=port, username=username, password=password)
         super(SshCommunication, self).__init__(self.host, self.host.ssh_host)
 
+    @traced()
     def execute(self, command, printing=True):
         if self.ssh_client is None:
             raise Exception('Remote host is not set')
 
         self._print_exec_msg(command, is_remote=True)
         stdin, stdout, stderr = self.ssh_client.exec_command(command)
+        tracer.count('round_trips')
         if printing:
-            for line in stdout:
-                print('\t\t' + line.strip('\n'))
-            for line in stderr:
-                print('\t\t' + line.strip('\n'))
+            # stderr is drained concurrently, otherwise the command may block on writing into the full stderr window
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                stderr_future = executor.submit(stderr.read)
+                for line in stdout:
+                    print('\t\t' + line.strip('\n'))
+                for line in stderr_future.result().decode(errors='replace').splitlines():
+                    print('\t\t' + line)
+
+    @traced()
+    def execute_and_read(self, command, stdin_data=None, printing=True):
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
 
+        if printing:
+            self._print_exec_msg(command, is_remote=True)
+        stdin, stdout, stderr = self.ssh_client.exec_command(command)
+        # both streams are drained concurrently with feeding stdin, otherwise the command may block on writing 
+        # into a full window while we are waiting for another stream
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            stdout_future = executor.submit(stdout.read)
+            stderr_future = executor.submit(stderr.read)
+            try:
+                if stdin_data is not None:
+                    stdin.write(stdin_data)
+                stdin.channel.shutdown_write()
+            except Exception:
+                stdin.channel.close()
+                raise
+            stdout_data = stdout_future.result()
+            stderr_data = stderr_future.result()
+        tracer.count('round_trips')
+        tracer.count('bytes_sent', len(stdin_data) if stdin_data is not None else 0)
+        tracer.count('bytes_received', len(stdout_data) + len(stderr_data))
+        return stdout.channel.recv_exit_status(), stdout_data, stderr_data
+
+    def open_sftp_session(self):
+        """Opens an additional SFTP session over the same ssh connection. It is useful for parallel transfers.
+        The session must be closed by the caller.
+        """
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
+        return self.ssh_client.open_sftp()
+
+    @traced()
     def copy(self, from_, to_, mode='from_local'):
         if self.ssh_client is None:
             raise Exception('Remote host is not set')
@@ -148,12 +359,85 @@ class SshCommunication(BaseCommunication):
         else:
             raise Exception("Incorrect mode '%s'" % mode)
 
+    @traced()
     def rm(self, target):
         if self.ssh_client is None:
             raise Exception('Remote host is not set')
         self._init_sftp()
         self.execute('rm -r %s' % target)
 
+    @traced()
+    def rm_many(self, dirs, patterns, workers=8):
+        """All targets are removed by a single remote command. dirs are passed null-delimited via stdin so that 
+        no quoting is needed, and glob patterns are expanded remotely. workers is ignored.
+        """
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
+        _check_rm_patterns(patterns)
+        if len(dirs) == 0 or len(patterns) == 0:
+            return 0
+        print('\tRemoving %s in %d dirs @%s' % (', '.join(patterns), len(dirs), self._machine_name))
+        exit_status, stdout_data, stderr_data = self.execute_and_read('bash -c %s bash %s' % (shlex.quote(RM_MANY_SCRIPT), 
+            ' '.join(shlex.quote(pattern) for pattern in patterns)),
+            stdin_data=b''.join(dir_.encode() + b'\0' for dir_ in dirs), printing=False)
+        if exit_status != 0:
+            raise Exception('Remote removal failed: %s' % stderr_data.decode(errors='replace'))
+        return int(stdout_data.decode().split()[-1])
+
+    @traced()
+    def write_file(self, data, to_, filename):
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
+        self._init_sftp()
+        path = to_ + '/' + filename
+        self._mkdirp(path.rsplit('/', 1)[0])
+        self._print_write_msg(self._machine_name + ':' + path)
+        self._putfo(io.BytesIO(data.encode()), path)
+
+    @traced()
+    def hash_files(self, targets, workers=8):
+        """All files are hashed by a single remote command (sha256sum) so that only one round trip is needed.
+        Targets are passed null-delimited via stdin. workers is ignored.
+        """
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
+        if len(targets) == 0:
+            return {}
+        print('\tHashing %d targets @%s' % (len(targets), self._machine_name))
+        exit_status, stdout_data, stderr_data = self.execute_and_read('bash -c %s' % shlex.quote(HASH_MANY_SCRIPT), 
+            stdin_data=b''.join(target.encode() + b'\0' for target in targets), printing=False)
+        if exit_status != 0:
+            raise Exception('Remote hashing failed: %s' % stderr_data.decode(errors='replace'))
+        return _parse_sha256sum_output(stdout_data.decode(errors='surrogateescape'))
+
+    @traced()
+    def get_sizes(self, targets):
+        """All sizes are computed by a single remote command.
+        """
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
+        if len(targets) == 0:
+            return {}
+        exit_status, stdout_data, stderr_data = self.execute_and_read('bash -c %s' % shlex.quote(SIZES_SCRIPT), 
+            stdin_data=b''.join(target.encode() + b'\0' for target in targets), printing=False)
+        if exit_status != 0:
+            raise Exception('Remote size computation failed: %s' % stderr_data.decode(errors='replace'))
+        sizes = [int(line) for line in stdout_data.decode().split()]
+        return dict((target, size) for target, size in zip(targets, sizes) if size >= 0)
+
+    @traced()
+    def open_file(self, path, read_ahead=READ_AHEAD_SIZE):
+        """The file is read by a background thread via pipelined SFTP requests covering read_ahead bytes, so
+        reading is limited by the bandwidth rather than by the round trip time. At most three blocks (consumed,
+        queued and being fetched) are kept in memory. Only the data present when the file is opened is read.
+        """
+        if self.ssh_client is None:
+            raise Exception('Remote host is not set')
+        self._init_sftp()
+        print('\tStreaming %s' % (self._machine_name + ':' + path))
+        return io.BufferedReader(_SftpReadAheadStream(self._open(path, 'rb'), read_ahead))
+
+    @traced()
     @enable_sftp
     def listdir(self, path_on_remote):
         return self.sftp_client.listdir(path_on_remote)
@@ -166,6 +450,7 @@ class SshCommunication(BaseCommunication):
     def _mkdir(self, path):
         self.sftp_client.mkdir(path)
 
+    @traced()
     def _mkdirp(self, path):
         path_list = path.split('/')
         cur_dir = ''
@@ -189,13 +474,23 @@ class SshCommunication(BaseCommunication):
 
     @enable_sftp
     def _get(self, remote_path, local_path):
-        return self.sftp_client.get(remote_path, local_path)
+        res = self.sftp_client.get(remote_path, local_path)
+        tracer.count('bytes_received', os.path.getsize(local_path))
+        return res
 
     @enable_sftp
     def _put(self, local_path, remote_path):
+        tracer.count('bytes_sent', os.path.getsize(local_path))
         return self.sftp_client.put(local_path, remote_path)
 
+    @enable_sftp
+    def _putfo(self, file_obj, remote_path):
+        res = self.sftp_client.putfo(file_obj, remote_path)
+        tracer.count('bytes_sent', res.st_size)
+        return res
+
     def _is_remote_dir(self, path):
+        tracer.count('round_trips')
         try:
             return S_ISDIR(self.sftp_client.stat(path).st_mode)
         except IOError:
@@ -220,7 +515,7 @@ class SshCommunication(BaseCommunication):
             self._get(from_, to_ + '/' + os.path.basename(from_))
         else:
             new_path_on_local = to_ + '/' + os.path.basename(from_)
-            os.mkdir(new_path_on_local)
+            os.makedirs(new_path_on_local, exist_ok=True)
             for dir_or_file in self.sftp_client.listdir(from_):
                 self._copy_from_remote(from_ + '/' + dir_or_file, new_path_on_local)
 
@@ -232,3 +527,114 @@ class SshCommunication(BaseCommunication):
     def _init_sftp(self):
         if self.sftp_client is None:
             self.sftp_client = self.ssh_client.open_sftp()
+
+def _check_rm_patterns(patterns):
+    """Raises an exception if any of patterns (see BaseCommunication.rm_many()) could match the dir itself 
+    or something outside it.
+    """
+    for pattern in patterns:
+        if pattern == '' or pattern.startswith('/') or '..' in pattern.split('/') or os.path.normpath(pattern) == '.':
+            raise Exception("Pattern '{}' must be a non-empty relative path without '..'".format(pattern))
+
+def _drop_nested_paths(paths):
+    """Returns the sorted list of paths excluding those located inside other ones.
+    """
+    kept = []
+    for path in sorted(paths, key=lambda path: path.split(os.sep)): # descendants follow their ancestors
+        if len(kept) == 0 or not path.startswith(kept[-1].rstrip(os.sep) + os.sep):
+            kept.append(path)
+    return kept
+
+def _parse_sha256sum_output(output):
+    """Parses the output of sha256sum. Returns the dictionary mapping paths to hashes. sha256sum escapes
+    backslashes and newlines in paths and marks such lines by a leading backslash.
+    """
+    hashes = {}
+    for line in output.split('\n'):
+        if line == '':
+            continue
+        escaped = line.startswith('\\')
+        if escaped:
+            line = line[1:]
+        sha256, path = line[:64], line[66:]
+        if escaped:
+            path = re.sub(r'\\(.)', lambda m: {'n': '\n', 'r': '\r'}.get(m.group(1), m.group(1)), path)
+        hashes[path] = sha256
+    return hashes
+
+class _SftpReadAheadStream(io.RawIOBase):
+    """Raw stream reading the remote file sftp_file by blocks of read_ahead bytes. The next block is fetched
+    in the background while the current one is being consumed.
+    """
+    def __init__(self, sftp_file, read_ahead):
+        super(_SftpReadAheadStream, self).__init__()
+        self._file = sftp_file
+        self._read_ahead = read_ahead
+        self._blocks = queue.Queue(maxsize=1)
+        self._block = memoryview(b'')
+        self._eof = False
+        self._stopped = threading.Event()
+        self._fetcher = threading.Thread(target=self._fetch, daemon=True)
+        self._fetcher.start()
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if len(self._block) == 0 and not self._eof:
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                self._eof = True
+                raise block
+            if block is None:
+                self._eof = True
+            else:
+                tracer.count('bytes_received', len(block))
+                self._block = memoryview(block)
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            try: # unblocks the fetcher waiting for the free space in the queue
+                self._blocks.get_nowait()
+            except queue.Empty:
+                pass
+            self._fetcher.join()
+            self._file.close()
+        super(_SftpReadAheadStream, self).close()
+
+    def _fetch(self):
+        try:
+            size = self._file.stat().st_size
+            offset = 0
+            while offset < size and not self._stopped.is_set():
+                length = min(self._read_ahead, size - offset)
+                # readv() pipelines the requests covering the whole block
+                block = b''.join(self._file.readv([(offset, length)]))
+                offset += len(block)
+                self._put(block)
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+_paramiko_logging_initialized = False
+
+def _init_paramiko_logging(paramiko):
+    global _paramiko_logging_initialized
+    if not _paramiko_logging_initialized:
+        log_file = rser.LOCAL_HOST.get('paramiko_log_file')
+        if log_file is not None:
+            paramiko.util.log_to_file(log_file)
+        _paramiko_logging_initialized = True
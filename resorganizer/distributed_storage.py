@@ -1,6 +1,14 @@
-from resorganizer.aux import find_dir_by_named_regexp
 from functools import partial
 import os
+import re
+import time
+import struct
+import ctypes
+import ctypes.util
+import threading
+import queue
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from resorganizer.tracing import in_current_context
 
 class DistributedStorage:
     """
@@ -9,17 +17,41 @@ class DistributedStorage:
     However, this implementation does not guarantee the uniqueness of data: instead, it uses a priority to prefer 
     one source over another while looking up. Even though duplicates are acceptable, the found ones will be printed
     out for the sake of user's attention. 
+
+    Listings of the directories of the sources are cached and revalidated by the modification time of a directory
+    so that repeated lookups cost at most one stat() per directory. If use_inotify is True (Linux only), the cached
+    directories are also watched via inotify and the listings are trusted without any syscalls against the sources
+    until a change is reported. Note that inotify does not report the changes made by other machines (e.g., on NFS).
+
+    If source_timeout (in seconds) is set, sources are queried concurrently, each one by its own worker thread,
+    and a source not responding within source_timeout is marked degraded, reported and skipped by subsequent queries
+    until its pending query finishes. Thus, a sleepy external drive or a stale NFS mount does not block lookups
+    in other sources. Since the content of degraded sources is unknown, looking up a dir which is not found 
+    in other sources raises StorageSourceUnavailable instead of reporting that the dir is absent.
+    Otherwise, sources are queried one after another in the calling thread.
     """
-    def __init__(self, abs_storage_paths, prior_storage_index=0):
+    def __init__(self, abs_storage_paths, prior_storage_index=0, use_inotify=False, source_timeout=None):
         self.storage_paths = abs_storage_paths
         self.prior_storage_index = prior_storage_index
+        self.source_timeout = source_timeout
+        self._listing_cache = {}
+        self._mapping_cache = {}
+        self._watcher = _InotifyWatcher() if use_inotify else None
+        self._watcher_lock = threading.Lock()
+        self._workers = [_SourceWorker() for _ in abs_storage_paths]
+        self._degraded_futures = {}
+
+    def get_degraded_sources(self):
+        """
+        Returns the list of paths of the sources which are currently considered degraded.
+        """
+        return [self.storage_paths[path_i] for path_i in list(self._degraded_futures) if self._is_degraded(path_i)]
 
     def get_dir_path(self, dir_):
         """
-        Returns the full path to dir_ or None if dir_ is absent.
+        Returns the full path to dir_ or None if dir_ is absent (see lookup_through_dir() for degraded sources).
         """
-        dir_path_tuple = self.lookup_through_dir(dir_, \
-            lambda dir_path: (dir_path, dir_path) if os.path.exists(dir_path) else None)
+        dir_path_tuple = self.lookup_through_dir(dir_, lambda dir_path: (dir_path, dir_path))
         return dir_path_tuple[0] if dir_path_tuple is not None else None
 
     def make_dir(self, dir_):
@@ -28,34 +60,78 @@ class DistributedStorage:
         """
         path_ = os.path.join(self.storage_paths[self.prior_storage_index], dir_)
         os.makedirs(path_)
+        self.invalidate(os.path.dirname(path_))
         return path_
 
+    def invalidate(self, path=None):
+        """
+        Drops the cached listing of the dir given by the full path (or all cached listings if path is None).
+        """
+        if path is None:
+            self._listing_cache.clear()
+            self._mapping_cache.clear()
+        else:
+            self._listing_cache.pop(os.path.normpath(path), None)
+
     def find_dir_by_named_regexp(self, parent_dir, regexp):
         """
         Finds a directory in parent_dir fulfulling regexp. Returns a tuple (full_path_to_found_dir, named_params_from_regexp).
         """
-        return self.lookup_through_dir(parent_dir, partial(find_dir_by_named_regexp, regexp))
+        return self.lookup_through_dir(parent_dir, partial(self._find_dir_in_listing, re.compile(regexp)))
+
+    def map_dirs_by_named_regexp(self, parent_dir, regexp):
+        """
+        Finds all directories in parent_dir fulfilling regexp in all sources. Returns a dictionary where a key is the name 
+        of a found dir and a value is a tuple (full_path_to_found_dir, named_params_from_regexp). If the same dir is
+        found in several sources, the prior one is taken. Dirs in degraded sources are missing in the result 
+        (see get_degraded_sources()).
+
+        The result is cached until any of the listings of parent_dir changes, so the returned dictionary is shared
+        and must not be modified.
+        """
+        pattern = re.compile(regexp)
+        possible_paths = [os.path.join(source, parent_dir) if parent_dir != '' else source for source in self.storage_paths]
+        listings, _ = self._query_sources(lambda path_i: self._list_source_dir(possible_paths[path_i]))
+        # cached listings are reused as the same objects, so the mapping is valid while all of them are the same
+        cached_data = self._mapping_cache.get((parent_dir, pattern.pattern))
+        if cached_data is not None and all(listing is cached_listing for listing, cached_listing in zip(listings, cached_data[0])):
+            return cached_data[1]
+        found_dirs = {}
+        for path_i, (path_, listing) in enumerate(zip(possible_paths, listings)):
+            if listing is None:
+                continue
+            for dir_ in listing[0]:
+                matching = pattern.search(dir_)
+                if matching is not None and (dir_ not in found_dirs or path_i == self.prior_storage_index):
+                    found_dirs[dir_] = (os.path.join(path_, dir_), matching.groupdict())
+        self._mapping_cache[(parent_dir, pattern.pattern)] = (listings, found_dirs)
+        return found_dirs
 
     def lookup_through_dir(self, dir_, lookup_func):
         """
         Looks up the data in dir_ by executing lookup_func on dir_. Returns a tuple (full_path_to_dir, some_data_regarding_dir) 
         which must, in turn, be returned by lookup_func. lookup_func must take a single argument -- full path to the dir. 
+        Returns None if nothing is found. If nothing is found, but some sources are degraded (so the data may be 
+        located there), StorageSourceUnavailable is raised.
         """
         possible_paths = [os.path.join(source, dir_) if dir_ != '' else source for source in self.storage_paths]
+        lookup_results, unavailable_sources = self._query_sources(lambda path_i: lookup_func(possible_paths[path_i]) \
+                                                                  if self._exists(possible_paths[path_i]) else None)
         found_data = None
         prior_found = False
         for path_i in range(len(possible_paths)):
-            path_ = possible_paths[path_i]
-            if os.path.exists(possible_paths[path_i]):
-                tmp_found_data = lookup_func(possible_paths[path_i])
-                if tmp_found_data is not None:
-                    tmp_found_path = os.path.join(possible_paths[path_i], tmp_found_data[0])
-                    if found_data is not None:
-                        print("Duplicate distributed dir is found: '{}' and '{}'".format(tmp_found_path, found_data[0]))
-                    if not prior_found:
-                        found_data = (tmp_found_path, tmp_found_data[1])
-                    if path_i == self.prior_storage_index:
-                        prior_found = True
+            tmp_found_data = lookup_results[path_i]
+            if tmp_found_data is not None:
+                tmp_found_path = os.path.join(possible_paths[path_i], tmp_found_data[0])
+                if found_data is not None:
+                    print("Duplicate distributed dir is found: '{}' and '{}'".format(tmp_found_path, found_data[0]))
+                if not prior_found:
+                    found_data = (tmp_found_path, tmp_found_data[1])
+                if path_i == self.prior_storage_index:
+                    prior_found = True
+        if found_data is None and len(unavailable_sources) != 0:
+            raise StorageSourceUnavailable("Cannot look up '{}' since storage sources {} are degraded" \
+                                           .format(dir_, ', '.join(unavailable_sources)))
         return found_data
 
     def listdir(self, dir_):
@@ -65,9 +141,214 @@ class DistributedStorage:
         """
         dirnames = []
         filenames = []
-        for storage_path in self.storage_paths:
-            if os.path.exists(os.path.join(storage_path, dir_)):
-                _, dirnames_, filenames_ = next(os.walk(os.path.join(storage_path, dir_)))
-                dirnames += dirnames_
-                filenames += filenames_
+        for listing in self._query_sources(lambda path_i: self._list_source_dir(os.path.join(self.storage_paths[path_i], dir_)))[0]:
+            if listing is not None:
+                dirnames += listing[0]
+                filenames += listing[1]
         return dirnames, filenames
+
+    def _query_sources(self, func):
+        """
+        Calls func(source_index) for all sources (concurrently if source_timeout is set). Returns a tuple 
+        (results, unavailable_sources) where results is the list of results where None stands for degraded sources 
+        and sources which have not responded within source_timeout and unavailable_sources is the list of their paths.
+        """
+        self._sync_watcher()
+        if self.source_timeout is None: # nothing to wait for, so avoid passing the calls to worker threads
+            return [func(path_i) for path_i in range(len(self.storage_paths))], []
+        futures = []
+        deadlines = []
+        func = in_current_context(func)
+        for path_i in range(len(self.storage_paths)):
+            futures.append(self._workers[path_i].submit(func, path_i) if not self._is_degraded(path_i) else None)
+            deadlines.append(time.time() + self.source_timeout)
+        results = []
+        unavailable_sources = []
+        for path_i, (future, deadline) in enumerate(zip(futures, deadlines)):
+            if future is not None:
+                try:
+                    results.append(future.result(timeout=max(0., deadline - time.time())))
+                    continue
+                except FutureTimeoutError:
+                    print("Storage source '{}' has not responded within {} sec and is considered degraded" \
+                          .format(self.storage_paths[path_i], self.source_timeout))
+                    self._degraded_futures[path_i] = future
+            results.append(None)
+            unavailable_sources.append(self.storage_paths[path_i])
+        return results, unavailable_sources
+
+    def _is_degraded(self, path_i):
+        future = self._degraded_futures.get(path_i)
+        if future is None:
+            return False
+        if not future.done():
+            return True
+        del self._degraded_futures[path_i]
+        print("Storage source '{}' has recovered".format(self.storage_paths[path_i]))
+        return False
+
+    def _sync_watcher(self):
+        if self._watcher is None:
+            return
+        with self._watcher_lock:
+            for changed_path in self._watcher.pop_changed_paths():
+                if changed_path is None: # events queue overflowed, nothing can be trusted
+                    self._listing_cache.clear()
+                else:
+                    self._listing_cache.pop(changed_path, None)
+
+    def _exists(self, path):
+        """
+        Checks whether path exists using the cached listing of its parent dir.
+        """
+        path = os.path.normpath(path)
+        parent_path, name = os.path.split(path)
+        if name == '': # root dir
+            return os.path.exists(path)
+        listing = self._list_source_dir(parent_path)
+        return listing is not None and (name in listing[0] or name in listing[1])
+
+    def _find_dir_in_listing(self, pattern, path):
+        listing = self._list_source_dir(path)
+        if listing is not None:
+            for dir_ in listing[0]:
+                matching = pattern.search(dir_)
+                if matching is not None:
+                    return dir_, matching.groupdict()
+        return None
+
+    def _list_source_dir(self, path):
+        """
+        Returns a tuple (dirnames, filenames) for the dir given by the full path or None if the dir does not exist.
+        The cached listing is returned if the dir has not been changed since the listing was made.
+        """
+        path = os.path.normpath(path)
+        if self._watcher is not None:
+            cached_data = self._listing_cache.get(path)
+            if cached_data is not None and self._watcher.is_watched(path):
+                return cached_data[1]
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._listing_cache.pop(path, None)
+            return None
+        cached_data = self._listing_cache.get(path)
+        if cached_data is not None and cached_data[0] == mtime:
+            return cached_data[1]
+        dirnames = []
+        filenames = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        dirnames.append(entry.name)
+                    else:
+                        filenames.append(entry.name)
+        except NotADirectoryError:
+            return None
+        # if the dir has been changed just before listing, the change may be not reflected by mtime 
+        # due to its coarse resolution on some filesystems, so such a listing is not trusted
+        if time.time() - mtime / 1e9 > MTIME_RESOLUTION_SEC:
+            self._listing_cache[path] = (mtime, (dirnames, filenames))
+            if self._watcher is not None:
+                with self._watcher_lock:
+                    self._watcher.watch(path)
+        return dirnames, filenames
+
+MTIME_RESOLUTION_SEC = 2.
+
+class StorageSourceUnavailable(Exception):
+    pass
+
+class _SourceWorker(object):
+    """
+    Executes functions in a separate daemon thread (so that a hung source does not prevent the interpreter from exiting).
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def submit(self, func, *args):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        future = Future()
+        self._queue.put((future, func, args))
+        return future
+
+    def _run(self):
+        while True:
+            future, func, args = self._queue.get()
+            try:
+                future.set_result(func(*args))
+            except BaseException as err:
+                future.set_exception(err)
+
+class _InotifyWatcher(object):
+    """
+    Watches the changes of the contents of dirs via Linux inotify API. 
+    """
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Cannot initialize inotify')
+        self._wd_to_path = {}
+        self._path_to_wd = {}
+
+    def watch(self, path):
+        if path in self._path_to_wd:
+            return
+        mask = self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE | self.IN_DELETE_SELF \
+             | self.IN_MOVE_SELF | self.IN_ONLYDIR
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd >= 0:
+            self._wd_to_path[wd] = path
+            self._path_to_wd[path] = wd
+
+    def is_watched(self, path):
+        return path in self._path_to_wd
+
+    def pop_changed_paths(self):
+        """
+        Returns the list of dirs whose contents have been changed since the previous call. None in the list means
+        that some events have been lost.
+        """
+        changed_paths = []
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(buf, offset)
+                offset += self.EVENT_HEADER.size + name_len
+                if mask & self.IN_Q_OVERFLOW:
+                    changed_paths.append(None)
+                elif wd in self._wd_to_path:
+                    changed_paths.append(self._wd_to_path[wd])
+                    if mask & (self.IN_IGNORED | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                        self._unwatch(wd)
+        return changed_paths
+
+    def _unwatch(self, wd):
+        path = self._wd_to_path.pop(wd)
+        del self._path_to_wd[path]
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def __del__(self):
+        if getattr(self, '_fd', -1) >= 0:
+            os.close(self._fd)
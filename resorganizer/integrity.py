@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+from resorganizer.aux import list_files, hash_files
+
+class HashCache(object):
+    """HashCache stores sha256 hashes of local files in a local SQLite database so that a file is hashed only once
+    while it is not modified (a file is considered modified if its size or modification time has changed).
+    It makes verification of transfers cheap when the same files are transferred repeatedly (e.g., input files
+    staged into many tasks or task results grabbed again).
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                               'path TEXT PRIMARY KEY, '
+                               'size INTEGER NOT NULL, '
+                               'mtime_ns INTEGER NOT NULL, '
+                               'sha256 TEXT NOT NULL)')
+
+    def hash_files(self, targets, workers=8):
+        """Returns the dictionary mapping the path to each file in targets (files or dirs searched recursively)
+        to its sha256 hex digest. Only files which are not cached or modified since caching are hashed
+        (by workers threads in parallel).
+        """
+        stats = {}
+        for path in list_files(targets):
+            st = os.stat(path)
+            stats[path] = (st.st_size, st.st_mtime_ns)
+        hashes = {}
+        with self._lock:
+            for path, (size, mtime_ns) in stats.items():
+                row = self._conn.execute('SELECT size, mtime_ns, sha256 FROM hashes WHERE path = ?', (path,)).fetchone()
+                if row is not None and (row[0], row[1]) == (size, mtime_ns):
+                    hashes[path] = row[2]
+        new_hashes = hash_files([path for path in stats if path not in hashes], workers)
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)',
+                                   [(path, stats[path][0], stats[path][1], sha256) for path, sha256 in new_hashes.items()])
+        hashes.update(new_hashes)
+        return hashes
+
+    def forget(self, path):
+        """Removes the hash of the file path or the hashes of all files in the dir path. It must be called when 
+        files are removed or moved so that the cache does not grow with dead entries.
+        """
+        dir_prefix = path.rstrip('/') + '/'
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM hashes WHERE path = ? OR substr(path, 1, ?) = ?", 
+                               (path, len(dir_prefix), dir_prefix))
+
+    def close(self):
+        self._conn.close()
+
+def rebase_hashes(hashes, from_target, to_target):
+    """Takes the hashes of files located in from_target (a file or dir) and returns them keyed by the paths
+    which these files have once from_target is copied to to_target.
+    """
+    from_target = from_target.rstrip('/')
+    return dict((to_target + path[len(from_target):], sha256) for path, sha256 in hashes.items()
+                if path == from_target or path.startswith(from_target + '/'))
+
+def find_mismatches(expected_hashes, actual_hashes):
+    """Returns the sorted list of paths from expected_hashes which are missing in actual_hashes or have other hashes.
+    """
+    return sorted(path for path, sha256 in expected_hashes.items() if actual_hashes.get(path) != sha256)
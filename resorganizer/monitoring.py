@@ -0,0 +1,108 @@
+import shlex
+from resorganizer.task_execution import MARKERS_DIR
+
+# Prints the list of SGE jobs of the user if qstat is available, then reads null-delimited task dirs from stdin 
+# and prints the content of their marker files (one line per file, newlines replaced by spaces). The queue is
+# queried first so that a job which has left the queue is guaranteed to have its markers read afterwards.
+TASK_STATES_SCRIPT = r'''shopt -s nullglob
+if command -v qstat > /dev/null 2>&1; then
+    printf 'Q\n'
+    qstat -u "$(id -un)" 2> /dev/null | awk '{print "J\t" $0}'
+fi
+while IFS= read -r -d '' task_dir; do
+    printf 'T\t%s\n' "$task_dir"
+    # processes are checked before reading markers, so a process which has finished has written its exit marker
+    for f in "$task_dir"/''' + MARKERS_DIR + r'''/*.pid; do
+        if kill -0 "$(cat "$f")" 2> /dev/null; then state=alive; else state=gone; fi
+        printf 'F\t%s\t%s\n' "${f##*/}" "$state"
+    done
+    for f in "$task_dir"/''' + MARKERS_DIR + r'''/*; do
+        if [ -f "$f" ] && [ "${f%.pid}" = "$f" ]; then printf 'F\t%s\t%s\n' "${f##*/}" "$(tr '\n' ' ' < "$f")"; fi
+    done
+done
+'''
+
+FINAL_STATES = ('done', 'failed', 'lost')
+# the task cannot be monitored, so it is neither finished nor unfinished
+UNMONITORED_STATES = ('unknown',)
+
+def query_task_states(comm, task_paths):
+    """Returns the states of tasks located at task_paths on the machine accessed via comm. All tasks are checked
+    by a single command. The result is a dictionary where a key is a task path and a value is a dictionary
+    containing state (the state of the task) and units (a dictionary where a key is a unit and a value is its state).
+    The state of a unit is one of the following:
+    (1) pending -- not submitted yet
+    (2) queued -- submitted and waiting in the queue
+    (3) running -- started but not finished
+    (4) done -- finished successfully
+    (5) failed -- finished with non-zero exit code (or SGE job is in the error state)
+    (6) lost -- submitted, but neither started nor present in the queue, or started, but its process has gone
+    without finishing
+    (7) skipped -- not executed since some unit it depends on has failed or has been skipped
+    The state of a task is done if all units are done and failed if all units are finished and some of them 
+    failed or have been skipped.
+    Otherwise it is running or queued if some unit is so, lost if some unit is lost (the task cannot be finished
+    then) and pending otherwise.
+    If the task has no information about units (e.g., it is a python task), its state is unknown.
+    """
+    if len(task_paths) == 0:
+        return {}
+    exit_status, stdout_data, stderr_data = comm.execute_and_read('bash -c %s' % shlex.quote(TASK_STATES_SCRIPT),
+        stdin_data=b''.join(task_path.encode() + b'\0' for task_path in task_paths), printing=False)
+    if exit_status != 0:
+        raise Exception('Querying task states failed: %s' % stderr_data.decode(errors='replace'))
+    markers, queue = _parse_query_output(stdout_data.decode(errors='replace'))
+    return dict((task_path, _get_task_state(markers.get(task_path, {}), queue)) for task_path in task_paths)
+
+def _parse_query_output(output):
+    """Returns a tuple (markers, queue) where markers is a dictionary mapping a task path into a dictionary
+    {marker filename: content} and queue is a dictionary mapping a job id into SGE job state (None if qstat
+    is not available).
+    """
+    markers = {}
+    queue = None
+    cur_markers = None
+    for line in output.split('\n'):
+        if line.startswith('J\t'):
+            cols = line.split()
+            if len(cols) >= 6 and cols[1].isdigit():
+                queue[cols[1]] = cols[5]
+        elif line.startswith('T\t'):
+            cur_markers = markers.setdefault(line[2:], {})
+        elif line.startswith('F\t'):
+            _, filename, content = line.split('\t', 2)
+            cur_markers[filename] = content
+        elif line == 'Q':
+            queue = {}
+    return markers, queue
+
+def _get_task_state(markers, queue):
+    if 'units' not in markers:
+        return {'state': 'unknown', 'units': {}}
+    job_ids = {}
+    jobs_data = markers.get('jobs', '').split()
+    for unit, job_id in zip(jobs_data[::2], jobs_data[1::2]):
+        job_ids[unit] = job_id
+    units = {}
+    for unit in markers['units'].split():
+        if unit + '.exit' in markers:
+            exit_code = markers[unit + '.exit'].strip()
+            units[unit] = 'done' if exit_code == '0' else ('skipped' if exit_code == 'skipped' else 'failed')
+        elif unit + '.started' in markers:
+            units[unit] = 'lost' if markers.get(unit + '.pid', '').strip() == 'gone' else 'running'
+        elif unit not in job_ids:
+            units[unit] = 'pending'
+        elif queue is None: # cannot check the queue, so assume the job waits in it
+            units[unit] = 'queued'
+        elif job_ids[unit] in queue:
+            units[unit] = 'failed' if 'E' in queue[job_ids[unit]] else 'queued'
+        else:
+            units[unit] = 'lost'
+    unit_states = set(units.values())
+    if unit_states <= set(('done',)):
+        state = 'done'
+    elif unit_states <= set(('done', 'failed', 'skipped')):
+        state = 'failed'
+    else:
+        state = next(s for s in ('running', 'queued', 'lost', 'pending') if s in unit_states)
+    return {'state': state, 'units': units}
@@ -0,0 +1,232 @@
+import os
+import os.path
+import shutil
+import hashlib
+import json
+import uuid
+import types
+from functools import partial
+import numpy as np
+
+META_FILENAME = 'meta.json'
+
+class ParseCache(object):
+    """ParseCache stores the results of parsing data files in a binary form (.npy files) located in cache_dir.
+    A cached result is identified by the parser, its arguments and the paths, sizes and modification times
+    of the parsed files so that it becomes outdated as soon as any of the files is changed. Functions (parsers
+    and function arguments) are identified by their code, defaults, closure values and the values of the module
+    globals they refer to (functions called by them are described in the same way), so different lambdas or 
+    closures never share results and changing a global used by a parser invalidates its results. If some function
+    or argument cannot be described independently of the session, the result is not cached. On hit, the arrays are loaded via memory mapping. Since they 
+    are read-only then, the arrays are made read-only on miss too. The total size of the cache is bounded by size_budget (in bytes): the least
+    recently used results are evicted when the budget is exceeded.
+
+    The result of parsing can be a numpy array, a list of floats, a list of numpy arrays of the same shape
+    or a tuple/dict of them (for instance, the results of parse_datafile(), parse_numdatafile() and
+    parse_timed_numdatafile() are supported).
+    """
+    def __init__(self, cache_dir, size_budget=2**30):
+        self.cache_dir = cache_dir
+        self.size_budget = size_budget
+
+    def parse(self, parser, path, *args, **kwds):
+        """Returns the result of parser(path, *args, **kwds) taking it from the cache if possible.
+        """
+        return self.call(parser, (path,), path, *args, **kwds)
+
+    def wrap(self, parser):
+        """Returns a cached version of parser which must take a path as the first argument.
+        """
+        return partial(self.parse, parser)
+
+    def call(self, func, paths, *args, ignored_kwds=(), **kwds):
+        """Returns the result of func(*args, **kwds) taking it from the cache if possible. paths are the files
+        which the result depends on. ignored_kwds are the names of kwds which do not affect the result 
+        (e.g., the number of processes) and are thus not taken into account when looking up the result.
+        """
+        try:
+            key = self._make_key(func, paths, args, dict((key, arg) for key, arg in kwds.items() if key not in ignored_kwds))
+        except _Undescribable:
+            return func(*args, **kwds)
+        entry_path = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_path):
+            try:
+                res = _load_entry(entry_path)
+                os.utime(os.path.join(entry_path, META_FILENAME), None)
+                return res
+            except (IOError, OSError, ValueError):
+                shutil.rmtree(entry_path, ignore_errors=True) # corrupted entry, reparse
+        res = func(*args, **kwds)
+        self._store(entry_path, res)
+        _make_read_only(res)
+        return res
+
+    def clear(self):
+        """Removes all cached results.
+        """
+        if os.path.exists(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+
+    def _make_key(self, func, paths, args, kwds):
+        files_info = []
+        for path in paths:
+            st = os.stat(path) # if not found, expection will be raised anyway
+            files_info.append((os.path.abspath(path), st.st_size, st.st_mtime_ns))
+        key_data = repr((_describe(func), files_info, [_describe(arg) for arg in args],
+                         sorted((key, _describe(arg)) for key, arg in kwds.items())))
+        return hashlib.sha1(key_data.encode()).hexdigest()
+
+    def _store(self, entry_path, res):
+        tmp_entry_path = os.path.join(self.cache_dir, '.tmp-' + uuid.uuid4().hex)
+        os.makedirs(tmp_entry_path)
+        try:
+            meta = _dump_item(tmp_entry_path, res, [0])
+        except Exception:
+            shutil.rmtree(tmp_entry_path)
+            return # result of unsupported type is simply not cached
+        with open(os.path.join(tmp_entry_path, META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp_entry_path, entry_path)
+        except OSError: # the same result has been already stored concurrently
+            shutil.rmtree(tmp_entry_path)
+        self._evict(keep=os.path.basename(entry_path))
+
+    def _evict(self, keep):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            last_access = os.stat(os.path.join(entry.path, META_FILENAME)).st_mtime
+            entries.append((last_access, size, entry))
+            total_size += size
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total_size <= self.size_budget:
+                break
+            if entry.name != keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                total_size -= size
+
+class _Undescribable(Exception):
+    pass
+
+def _describe(obj, depth=0, functions=()):
+    """Returns a representation of obj which does not depend on the session. Python functions are represented 
+    by their names, code, defaults, closure values and the values of the module globals they refer to, 
+    other callables (builtins and classes) and modules by their names. functions are the ids of the functions 
+    being described (to stop at recursive calls). Raises _Undescribable if obj cannot be represented so 
+    (e.g., its repr contains a memory address).
+    """
+    if depth > 32: # e.g., a recursive closure
+        raise _Undescribable()
+    if isinstance(obj, types.FunctionType):
+        if id(obj) in functions:
+            return ['recursion', obj.__module__, obj.__qualname__]
+        functions = functions + (id(obj),)
+        closure = [_describe_cell(cell, depth + 1, functions) for cell in obj.__closure__ or ()]
+        referenced_globals = [(name, _describe(obj.__globals__[name], depth + 1, functions)) 
+                              for name in _get_names(obj.__code__) if name in obj.__globals__]
+        return ['function', obj.__module__, obj.__qualname__, _describe_code(obj.__code__), 
+                _describe(obj.__defaults__, depth + 1, functions), _describe(obj.__kwdefaults__, depth + 1, functions), 
+                closure, referenced_globals]
+    elif isinstance(obj, partial):
+        return ['partial', _describe(obj.func, depth + 1, functions), _describe(obj.args, depth + 1, functions), 
+                _describe(obj.keywords, depth + 1, functions)]
+    elif isinstance(obj, types.MethodType):
+        return ['method', _describe(obj.__func__, depth + 1, functions), _describe(obj.__self__, depth + 1, functions)]
+    elif isinstance(obj, (type, types.BuiltinFunctionType)) or (callable(obj) and type(obj).__name__ == 'ufunc'):
+        return '{}.{}'.format(getattr(obj, '__module__', ''), getattr(obj, '__qualname__', obj.__name__))
+    elif isinstance(obj, types.ModuleType):
+        return 'module ' + obj.__name__
+    elif isinstance(obj, np.ndarray): # repr of a large array is abbreviated
+        if obj.dtype == object:
+            raise _Undescribable()
+        return ['array', obj.dtype.str, list(obj.shape), hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()]
+    elif isinstance(obj, (list, tuple)):
+        return [_describe(item, depth + 1, functions) for item in obj]
+    elif isinstance(obj, dict):
+        return sorted((repr(key), _describe(value, depth + 1, functions)) for key, value in obj.items())
+    description = repr(obj)
+    if ' at 0x' in description or ' object at ' in description:
+        raise _Undescribable()
+    return description
+
+def _describe_cell(cell, depth, functions):
+    try:
+        contents = cell.cell_contents
+    except ValueError: # the cell is empty
+        return None
+    return _describe(contents, depth, functions)
+
+def _get_names(code):
+    """Returns the sorted list of names (globals and attributes) used by code including nested functions.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(_get_names(const))
+    return sorted(names)
+
+def _describe_code(code):
+    consts = []
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            consts.append(_describe_code(const))
+        elif isinstance(const, frozenset): # the order of items depends on the session
+            consts.append(sorted(repr(item) for item in const))
+        else:
+            consts.append(repr(const))
+    return [code.co_code.hex(), consts, list(code.co_names)]
+
+def _make_read_only(item):
+    if isinstance(item, np.ndarray):
+        item.flags.writeable = False
+    elif isinstance(item, (list, tuple)):
+        for subitem in item:
+            _make_read_only(subitem)
+    elif isinstance(item, dict):
+        for subitem in item.values():
+            _make_read_only(subitem)
+
+def _dump_item(entry_path, item, counter):
+    """Saves item into entry_path. Returns its description which allows to load it back. counter is used
+    to name .npy files.
+    """
+    if isinstance(item, np.ndarray):
+        return {'kind': 'array', 'file': _save_array(entry_path, item, counter)}
+    elif isinstance(item, tuple):
+        return {'kind': 'tuple', 'items': [_dump_item(entry_path, subitem, counter) for subitem in item]}
+    elif isinstance(item, dict):
+        return {'kind': 'dict', 'items': [[key, _dump_item(entry_path, subitem, counter)] for key, subitem in item.items()]}
+    elif isinstance(item, list):
+        kind = 'rows' if len(item) != 0 and isinstance(item[0], np.ndarray) else 'list'
+        array = np.array(item)
+        if array.dtype == object:
+            raise Exception('Unsupported type of data to be cached')
+        return {'kind': kind, 'file': _save_array(entry_path, array, counter)}
+    raise Exception('Unsupported type of data to be cached')
+
+def _save_array(entry_path, array, counter):
+    filename = '{}.npy'.format(counter[0])
+    counter[0] += 1
+    np.save(os.path.join(entry_path, filename), array, allow_pickle=False)
+    return filename
+
+def _load_entry(entry_path):
+    with open(os.path.join(entry_path, META_FILENAME), 'r') as f:
+        meta = json.load(f)
+    return _load_item(entry_path, meta)
+
+def _load_item(entry_path, meta):
+    if meta['kind'] == 'tuple':
+        return tuple(_load_item(entry_path, subitem) for subitem in meta['items'])
+    elif meta['kind'] == 'dict':
+        return dict((key, _load_item(entry_path, subitem)) for key, subitem in meta['items'])
+    array = np.load(os.path.join(entry_path, meta['file']), mmap_mode='r', allow_pickle=False)
+    if meta['kind'] == 'list':
+        return array.tolist()
+    elif meta['kind'] == 'rows':
+        return list(array)
+    return array
@@ -0,0 +1,97 @@
+import os.path
+import sqlite3
+import threading
+import time
+
+class LocationRegistry(object):
+    """LocationRegistry knows all locations of tasks. A location is either a local storage (identified by its
+    path, e.g. main_research_path) or a remote (identified by its machine name). For each task of each research,
+    the registry stores every location holding it together with the full path to the task dir there, its size
+    (if known) and the time of the last synchronization. The registry is kept in a local SQLite database
+    so that tools can decide what to fetch or clean without probing disks or opening ssh connections.
+
+    Research updates the registry on launching, grabbing and cleaning up tasks whereas TieringService
+    updates it on migrating tasks. Local locations must be built by local_location() so that the same storage
+    is always identified by the same key.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS locations ('
+                               'research_id TEXT NOT NULL, '
+                               'task_number INTEGER NOT NULL, '
+                               'location TEXT NOT NULL, '
+                               'is_remote INTEGER NOT NULL, '
+                               'path TEXT NOT NULL, '
+                               'size INTEGER, '
+                               'last_sync REAL NOT NULL, '
+                               'PRIMARY KEY (research_id, task_number, location))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS locations_by_location ON locations (location)')
+
+    def record(self, research_id, task_number, location, path, is_remote=False, size=None):
+        """Records that the task is held by location at path. If the record exists, it is updated and the time of
+        the last synchronization is set to now. If size is None, the previously known size is kept.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO locations VALUES (?, ?, ?, ?, ?, ?, ?) '
+                               'ON CONFLICT (research_id, task_number, location) DO UPDATE SET '
+                               'is_remote = excluded.is_remote, path = excluded.path, '
+                               'size = COALESCE(excluded.size, size), last_sync = excluded.last_sync',
+                               (research_id, task_number, location, int(is_remote), path, size, time.time()))
+
+    def set_size(self, research_id, task_number, location, size):
+        """Sets the size of the task held by location (None if it is unknown, e.g., after the content has changed).
+        """
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE locations SET size = ? WHERE research_id = ? AND task_number = ? AND location = ?',
+                               (size, research_id, task_number, location))
+
+    def forget(self, research_id, task_number, location=None):
+        """Removes the record about the task held by location (or about all its locations if location is None).
+        """
+        with self._lock, self._conn:
+            if location is None:
+                self._conn.execute('DELETE FROM locations WHERE research_id = ? AND task_number = ?',
+                                   (research_id, task_number))
+            else:
+                self._conn.execute('DELETE FROM locations WHERE research_id = ? AND task_number = ? AND location = ?',
+                                   (research_id, task_number, location))
+
+    def get_locations(self, research_id, task_number):
+        """Returns the list of dictionaries describing all locations holding the task.
+        """
+        return self._select('WHERE research_id = ? AND task_number = ? ORDER BY is_remote, location',
+                            (research_id, task_number))
+
+    def get_tasks(self, research_id=None, location=None):
+        """Returns the list of dictionaries describing the locations of all tasks of research_id (all researches if None)
+        held by location (all locations if None).
+        """
+        conditions = []
+        params = []
+        if research_id is not None:
+            conditions.append('research_id = ?')
+            params.append(research_id)
+        if location is not None:
+            conditions.append('location = ?')
+            params.append(location)
+        where_clause = 'WHERE ' + ' AND '.join(conditions) if len(conditions) != 0 else ''
+        return self._select(where_clause + ' ORDER BY research_id, task_number, location', params)
+
+    def close(self):
+        self._conn.close()
+
+    def _select(self, clause, params):
+        with self._lock:
+            cursor = self._conn.execute('SELECT research_id, task_number, location, is_remote, path, size, last_sync '
+                                        'FROM locations ' + clause, params)
+            names = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        return [dict(zip(names, (bool(v) if name == 'is_remote' else v for name, v in zip(names, row)))) for row in rows]
+
+def local_location(storage_path):
+    """Returns the location identifying the local storage located at storage_path.
+    """
+    return os.path.normpath(os.path.abspath(storage_path))
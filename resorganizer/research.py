@@ -1,11 +1,18 @@
 import os
 import pickle
+import hashlib
 import shutil
+import time
 from datetime import datetime, date
 import resorganizer.settings as rset
 from resorganizer.aux import *
 from resorganizer.communication import *
 from resorganizer.distributed_storage import *
+from resorganizer.tiering import TieringService
+from resorganizer.registry import LocationRegistry, local_location
+from resorganizer.monitoring import query_task_states, FINAL_STATES, UNMONITORED_STATES
+from resorganizer.tracing import tracer, traced, MemorySink, JsonlSink, CallbackSink
+from resorganizer.integrity import HashCache, rebase_hashes, find_mismatches
 
 # Create RESEARCH-ID. It is a small research which should link different local directories (with reports and time-integration) and ssh directories (with continuation, for example)
 # What is included in RESEARCH?
@@ -38,12 +45,17 @@ from resorganizer.distributed_storage import *
 #           1.1.1 copy input files from local to remote
 #           1.1.2 copy program from remote to remote
 #           1.1.3 execute program
-#       1.2 wait for finishing (at this moment, we just have to wait and check)
+#       1.2 wait for finishing (see Research.wait_for_tasks())
 #       1.3 COPY-TASK
 #           1.3.1 copy results from remote to local
 #       1.4 as result, we will have results directly in the task directory
 
 LOG_FILE = 'research.log'
+PARSE_CACHE_DIR = '.parse_cache'
+RESULTS_STORE_DIR = '.results'
+REGISTRY_FILE = 'locations.db'
+BACKUP_INDEX_FILE = 'backup_index.db'
+HASH_CACHE_FILE = 'hash_cache.db'
 
 class Research:
     """Research is the main class for interacting with the hierarchy of tasks.
@@ -54,6 +66,9 @@ class Research:
     (3) create new tasks by launching TaskExecution locally or on remotes
     (4) launch TaskExecution in already existing task's directory
     (5) grab task's content from remotes
+    (6) track all locations of tasks (see LocationRegistry)
+    (7) consolidate the results of tasks into a columnar store (see ResultsStore)
+    (8) stream task's files from remotes without grabbing them
 
     The main idea behind Research is that we collect tasks in the research's dir and make 
     them enumerated. Each task is completely identified by its number. Its content, in turn,
@@ -87,7 +102,15 @@ class Research:
         self._local_comm = LocalCommunication(Host(rset.LOCAL_HOST['host_relative_data_path'], \
             rset.LOCAL_HOST['main_research_path']), rset.LOCAL_HOST['machine_name'])
         self._exec_comm = comm if comm != None else self._local_comm
-        self._distr_storage = DistributedStorage((rset.LOCAL_HOST['main_research_path'], rset.LOCAL_HOST['storage_research_path']), prior_storage_index=1)
+        self._parse_cache = None
+        self._results_store = None
+        self._hash_cache = None
+        self._task_names = (None, {}) # (mapping of task dirs it is built from, task names by numbers)
+        self._tiering = None
+        self._trace_sink = None
+        self._registry = None
+        self._distr_storage = DistributedStorage((rset.LOCAL_HOST['main_research_path'], rset.LOCAL_HOST['storage_research_path']), prior_storage_index=1, \
+            use_inotify=rset.LOCAL_HOST.get('use_inotify', False), source_timeout=rset.LOCAL_HOST.get('source_timeout'))
         suitable_name = self._make_suitable_name(name)
         if not continuing:
             # interpret name as name without date
@@ -127,24 +150,24 @@ class Research:
         print('Loaded research at {}'.format(research_path))
 
         # determine maximum task number to set the number for the next possible task
-        dirnames, _ = self._distr_storage.listdir(self._research_id)
         self._tasks_number = 0
-        for dir_ in dirnames:
-            if dir_ != 'report':
-                task_number, _ = self._split_task_dir(dir_)
-                if task_number > self._tasks_number:
-                    self._tasks_number = task_number
+        for task_number, _ in self._get_task_dirs():
+            if task_number > self._tasks_number:
+                self._tasks_number = task_number
         self._tasks_number += 1
         print('Number of tasks in the current research: {}'.format(self._tasks_number))
         return research_path
 
-    def launch_task(self, task_exec, name):
-        """Creates a new task, copies necessary data and executes the command line
+    @traced()
+    def launch_task(self, task_exec, name, verify=False):
+        """Creates a new task, copies necessary data and executes the command line. If verify is True, the copied 
+        and staged files are verified by comparing their hashes before the command line is executed.
         """
         task_number = self._get_next_task_number()
         local_task_dir = self._make_task_path(task_number, name)
         os.mkdir(local_task_dir)
-        self._launch_task_impl(task_exec, task_number, task_exists=False)
+        self._launch_task_impl(task_exec, task_number, task_exists=False, verify=verify)
+        self._update_task_locations(task_number, remote_synced=True, remote_changed=True)
         if task_exec.command is not None:
             log_lines = ['\tNEW TASK: ' + str(task_number), '\n', '\t\tCommand: ' + task_exec.command, '\n']
         else:
@@ -152,12 +175,15 @@ class Research:
         self.write_log(log_lines)
         return task_number
 
-    def launch_task_on_existing(self, task_exec, task_number):
-        """Copies necessary data and executes the command line in already created task
+    @traced()
+    def launch_task_on_existing(self, task_exec, task_number, verify=False):
+        """Copies necessary data and executes the command line in already created task (see launch_task() for verify)
         """
-        self._launch_task_impl(task_exec, task_number, task_exists=True)
+        self._launch_task_impl(task_exec, task_number, task_exists=True, verify=verify)
+        self._update_task_locations(task_number, remote_synced=True, remote_changed=True)
 
-    def _launch_task_impl(self, task_exec, task_number, task_exists=False):
+    @traced()
+    def _launch_task_impl(self, task_exec, task_number, task_exists=False, verify=False):
         is_remote_execution = self._local_comm is not self._exec_comm
         local_task_dir = self.get_task_path(task_number)
         if is_remote_execution:
@@ -168,12 +194,19 @@ class Research:
         def copy_task_data(copies_list_):
             for copy_target in copies_list_:
                 self._exec_comm.copy(copy_target['path'], working_task_dir, copy_target['mode'])
+            for filename, data in task_exec.staged_files.items():
+                self._exec_comm.write_file(data, working_task_dir, filename)
+            if verify:
+                self._verify_staging(copies_list_, task_exec.staged_files, working_task_dir)
         def remove_task_data():
             if not task_exists:
                 self._local_comm.rm(local_task_dir)
+                self._forget_hashes(local_task_dir)
                 if is_remote_execution:
                     self._exec_comm.rm(working_task_dir)
+                self._forget_task_locations(task_number)
 
+        task_exec.bind_host(self._exec_comm.host)
         copies_list = self._build_copies_list_with_modes(task_exec)
         do_atomic(partial(copy_task_data, copies_list), remove_task_data)
         if task_exec.command is None: # execute python function
@@ -195,6 +228,33 @@ class Research:
             print('Cannot execute pyfunc')
             remove_task_data()
 
+    def _verify_staging(self, copies_list, staged_files, working_task_dir):
+        """Compares the hashes of the files from copies_list (see _build_copies_list_with_modes()) and staged_files
+        with the hashes of their copies in working_task_dir. Local files are hashed via HashCache whereas files
+        on the remote are hashed by a single remote command. Raises an exception on mismatch.
+        """
+        is_remote_execution = self._local_comm is not self._exec_comm
+        copies = [(copy_target['path'], '/'.join((working_task_dir, os.path.basename(copy_target['path'].rstrip('/')))),
+                   copy_target['mode'] == 'all_remote') for copy_target in copies_list]
+        staged_targets = ['/'.join((working_task_dir, filename)) for filename in staged_files]
+        local_targets = [source for source, _, on_exec_host in copies if not on_exec_host]
+        exec_targets = [source for source, _, on_exec_host in copies if on_exec_host] + \
+                       [target for _, target, _ in copies] + staged_targets
+        if is_remote_execution:
+            local_hashes = self.get_hash_cache().hash_files(local_targets)
+            exec_hashes = self._exec_comm.hash_files(exec_targets)
+        else:
+            local_hashes = exec_hashes = self.get_hash_cache().hash_files(local_targets + exec_targets)
+        expected_hashes = {}
+        for source, target, on_exec_host in copies:
+            expected_hashes.update(rebase_hashes(exec_hashes if on_exec_host else local_hashes, source, target))
+        for target, data in zip(staged_targets, staged_files.values()):
+            expected_hashes[target] = hashlib.sha256(data.encode()).hexdigest()
+        mismatches = find_mismatches(expected_hashes, exec_hashes)
+        if len(mismatches) != 0:
+            raise Exception('Verification of staged files failed: {}'.format(', '.join(mismatches)))
+        print('\tVerified {} files'.format(len(expected_hashes)))
+
     def _build_copies_list_with_modes(self, task_exec):
         is_remote_execution = self._local_comm is not self._exec_comm
         copies_list = []
@@ -210,24 +270,54 @@ class Research:
                 })
         return copies_list
 
-    def grab_task_results(self, task_number, copies_list=[]):
+    @traced()
+    def grab_task_results(self, task_number, copies_list=[], verify=False):
         """Moves task content from the remote to the local. Locally, the task content will appear in the task
         dir located in the master research location.
+
+        If verify is True, the hashes of the remote files are computed by a single remote command beforehand,
+        copy targets whose local copies already have the same hashes are skipped (only missing or changed files 
+        are copied into dirs existing locally) and the hashes of the copied files are compared with the remote ones
+        afterwards (an exception is raised on mismatch).
         """
         task_results_local_path = self.get_task_path(task_number)
         task_results_remote_path = self.get_task_path(task_number, self._exec_comm.host)
         if len(copies_list) == 0: # copy all data
             pathes = self._exec_comm.listdir(task_results_remote_path)
-            for file_or_dir in pathes:
-                self._exec_comm.copy('/'.join((task_results_remote_path, file_or_dir)), task_results_local_path, 'from_remote')
-        else:
-            for copy_target in copies_list:
-                remote_copy_target_path = '/'.join((task_results_remote_path, copy_target['path'])) # we consider copy targets as relative to task's dir
-                self._exec_comm.copy(remote_copy_target_path, task_results_local_path, 'from_remote')
-                if 'new_name' in copy_target:
-                    os.rename(os.path.join(task_results_local_path, os.path.basename(copy_target['path'])), \
-                              os.path.join(task_results_local_path, copy_target['new_name']))
-
+            copies_list = [{'path': file_or_dir} for file_or_dir in pathes]
+        targets = [] # tuples (remote_path, local_path_after_copying, local_path_after_renaming)
+        for copy_target in copies_list:
+            remote_copy_target_path = '/'.join((task_results_remote_path, copy_target['path'])) # we consider copy targets as relative to task's dir
+            local_copy_path = os.path.join(task_results_local_path, os.path.basename(copy_target['path']))
+            local_path = os.path.join(task_results_local_path, copy_target['new_name']) if 'new_name' in copy_target else local_copy_path
+            targets.append((remote_copy_target_path, local_copy_path, local_path))
+        if verify:
+            remote_hashes = self._exec_comm.hash_files([remote_path for remote_path, _, _ in targets])
+            expected_hashes = dict((local_path, rebase_hashes(remote_hashes, remote_path, local_path)) for remote_path, _, local_path in targets)
+            local_hashes = self.get_hash_cache().hash_files([local_path for _, _, local_path in targets])
+        for remote_path, local_copy_path, local_path in targets:
+            if verify and len(expected_hashes[local_path]) != 0 and os.path.exists(local_path):
+                mismatches = find_mismatches(expected_hashes[local_path], local_hashes)
+                if len(mismatches) == 0:
+                    print('\tSkipping %s (unchanged)' % local_path)
+                    continue
+                if os.path.isdir(local_path):
+                    for path in mismatches:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        self._exec_comm.copy(remote_path.rstrip('/') + path[len(local_path):], os.path.dirname(path), 'from_remote')
+                    continue
+            self._exec_comm.copy(remote_path, task_results_local_path, 'from_remote')
+            if local_path != local_copy_path:
+                os.rename(local_copy_path, local_path)
+                self._forget_hashes(local_copy_path)
+        if verify:
+            local_hashes = self.get_hash_cache().hash_files([local_path for _, _, local_path in targets])
+            mismatches = find_mismatches(merge_dicts(*expected_hashes.values()), local_hashes)
+            if len(mismatches) != 0:
+                raise Exception('Verification of grabbed files failed: {}'.format(', '.join(mismatches)))
+        self._update_task_locations(task_number, remote_synced=True, remote_changed=False)
+
+    @traced()
     def cleanup(self, task_number, removes_list):
         for remove_target in removes_list:
             full_target_path = os.path.join(self.get_task_path(task_number), remove_target)
@@ -236,6 +326,127 @@ class Research:
                 shutil.rmtree(full_target_path)
             else:
                 os.remove(full_target_path)
+            self._forget_hashes(full_target_path)
+        self._update_task_locations(task_number)
+
+    @traced()
+    def bulk_cleanup(self, patterns, task_numbers=None, on_remote=False, workers=8):
+        """Removes files and dirs matching patterns (paths or glob patterns relative to task dirs, e.g. 'snapshots/*.h5') 
+        in the tasks corresponding to task_numbers (all tasks by default). Patterns must not be empty or contain '..'
+        so that task dirs themselves are never removed. If on_remote is True, they are removed on the remote by 
+        a single command. Otherwise, they are removed locally by workers threads. Returns the number of bytes reclaimed.
+        """
+        if task_numbers is None:
+            task_numbers = [task_number for task_number, _ in self._get_task_dirs()]
+        if on_remote:
+            comm = self._exec_comm
+            task_paths = [self.get_task_path(task_number, comm.host) for task_number in task_numbers]
+        else:
+            comm = self._local_comm
+            task_paths = [self.get_task_path(task_number) for task_number in task_numbers]
+        reclaimed_size = comm.rm_many(task_paths, patterns, workers=workers)
+        if comm is self._local_comm:
+            for task_path in task_paths:
+                self._forget_hashes(task_path)
+        print('\tReclaimed {} bytes in {} tasks'.format(reclaimed_size, len(task_numbers)))
+        for task_number in task_numbers:
+            self._update_task_locations(task_number, local_changed=not on_remote, remote_synced=on_remote, remote_changed=on_remote)
+        return reclaimed_size
+
+    @traced()
+    def get_task_states(self, task_numbers=None):
+        """Returns the states of tasks corresponding to task_numbers (all tasks by default) on the machine where 
+        they are executed. All tasks are checked by a single command. The result is a dictionary where a key is 
+        a task number and a value is a dictionary containing state and units (see query_task_states()).
+        """
+        if task_numbers is None:
+            task_numbers = [task_number for task_number, _ in self._get_task_dirs()]
+        is_remote_execution = self._local_comm is not self._exec_comm
+        task_paths = dict((task_number, self.get_task_path(task_number, self._exec_comm.host if is_remote_execution else None)) 
+                          for task_number in task_numbers)
+        states = query_task_states(self._exec_comm, list(task_paths.values()))
+        return dict((task_number, states[task_path]) for task_number, task_path in task_paths.items())
+
+    @traced()
+    def wait_for_tasks(self, task_numbers=None, min_interval=10, max_interval=600, timeout=None, grab=False, copies_list=[]):
+        """Waits until the tasks corresponding to task_numbers (all tasks by default) are finished (i.e., their states 
+        are done, failed or lost) or timeout (in seconds) expires. Tasks whose state is unknown (e.g., python tasks) 
+        cannot be monitored, so they are reported and not waited for, but they are not considered finished either. Unfinished tasks are polled by a single 
+        command each time. The polling interval starts from min_interval and doubles each time nothing changes 
+        up to max_interval. If grab is True, the results of remote tasks are grabbed (see grab_task_results()) 
+        as soon as they are finished. Returns the last known states of tasks (see get_task_states()).
+        """
+        if task_numbers is None:
+            task_numbers = [task_number for task_number, _ in self._get_task_dirs()]
+        is_remote_execution = self._local_comm is not self._exec_comm
+        states = {}
+        interval = min_interval
+        start_time = time.time()
+        while True:
+            unfinished = [task_number for task_number in task_numbers if task_number not in states or \
+                          states[task_number]['state'] not in FINAL_STATES + UNMONITORED_STATES]
+            new_states = self.get_task_states(unfinished)
+            changed = any(new_states[task_number] != states.get(task_number) for task_number in unfinished)
+            states.update(new_states)
+            if grab and is_remote_execution:
+                for task_number in unfinished:
+                    if new_states[task_number]['state'] in ('done', 'failed'):
+                        self.grab_task_results(task_number, copies_list)
+            state_counts = {}
+            for state in states.values():
+                state_counts[state['state']] = state_counts.get(state['state'], 0) + 1
+            print('\tTasks: ' + ', '.join('{} {}'.format(n, state) for state, n in sorted(state_counts.items())))
+            for task_number in unfinished:
+                if new_states[task_number]['state'] in UNMONITORED_STATES:
+                    print('\tTask {} cannot be monitored (its state is unknown), not waiting for it'.format(task_number))
+            if all(state['state'] in FINAL_STATES + UNMONITORED_STATES for state in states.values()):
+                return states
+            interval = min_interval if changed else min(2 * interval, max_interval)
+            if timeout is not None:
+                if time.time() - start_time >= timeout:
+                    return states
+                interval = min(interval, max(0, timeout - (time.time() - start_time)))
+            time.sleep(interval)
+
+    def get_task_locations(self, task_number, remote_sizes=False):
+        """Returns the list of all known locations of the task corresponding to task_number. Each location is described 
+        by a dictionary containing location (the path to the local storage or the machine name of the remote), is_remote, 
+        path (the full path to the task dir), size (in bytes, None if unknown) and last_sync (timestamp).
+
+        Sizes are computed lazily: the size of a location whose content has changed is computed and recorded when it 
+        is requested. Sizes of remote locations are computed (by a single remote command) only if remote_sizes is True.
+        """
+        locations = self.get_registry().get_locations(self._research_id, task_number)
+        for location in locations:
+            if location['size'] is not None:
+                continue
+            if not location['is_remote']:
+                size = self._local_comm.get_sizes([location['path']]).get(location['path'])
+            elif remote_sizes and location['location'] == self._exec_comm.machine_name:
+                size = self._exec_comm.get_sizes([location['path']]).get(location['path'])
+            else:
+                continue
+            self.get_registry().set_size(self._research_id, task_number, location['location'], size)
+            location['size'] = size
+        return locations
+
+    @traced()
+    def _update_task_locations(self, task_number, local_changed=True, remote_synced=False, remote_changed=False):
+        """Records the local location of the task and, if remote_synced is True and the execution is remote, 
+        its remote location in the registry. The sizes of the locations whose content has changed (local_changed, 
+        remote_changed) are reset so that they are recomputed when requested (see get_task_locations()).
+        """
+        local_task_path = self.get_task_path(task_number)
+        location = local_location(os.path.dirname(os.path.dirname(local_task_path)))
+        registry = self.get_registry()
+        registry.record(self._research_id, task_number, location, local_task_path)
+        if local_changed:
+            registry.set_size(self._research_id, task_number, location, None)
+        if remote_synced and self._local_comm is not self._exec_comm:
+            registry.record(self._research_id, task_number, self._exec_comm.machine_name, \
+                                  self.get_task_path(task_number, self._exec_comm.host), is_remote=True)
+            if remote_changed:
+                registry.set_size(self._research_id, task_number, self._exec_comm.machine_name, None)
 
     def call_on_each_gen(self, task_number, copies_list, percopy_func):
         """For each item in copies_list, copies it from the task dir corresponding to task_number on the remote to the local dir, 
@@ -256,9 +467,36 @@ class Research:
         self.cleanup(task_number, (actual_copy,))
         return res
 
+    def open_task_file(self, task_number, path, read_ahead=READ_AHEAD_SIZE):
+        """Opens the file path (relative to the task dir) of the task corresponding to task_number on the remote
+        and returns a binary file-like object streaming its content (see BaseCommunication.open_file()). Nothing is
+        stored on the local disk. The object must be closed by the caller (it can be used as a context manager).
+        """
+        return self._exec_comm.open_file('/'.join((self.get_task_path(task_number, self._exec_comm.host), path)), read_ahead)
+
+    def call_on_remote_file(self, task_number, path, func, read_ahead=READ_AHEAD_SIZE):
+        """Calls func upon the file-like object streaming the file path of the task corresponding to task_number
+        from the remote (see open_task_file()) and returns the result. Unlike call_on_lazy_remote_data(), the file
+        is not copied to the local disk.
+        """
+        with self.open_task_file(task_number, path, read_ahead) as f:
+            return func(f)
+
+    def iter_remote_datafile_chunks(self, task_number, path, chunk_rows=65536, usecols=None, skip_rows=1, 
+                                    read_ahead=READ_AHEAD_SIZE):
+        """Parses the numerical data file path of the task corresponding to task_number while it is streamed from
+        the remote and yields 2D numpy arrays of chunk_rows rows (see iter_numdatafile_chunks()). The memory 
+        consumption is bounded by a few blocks of read_ahead bytes, so reductions over large remote data files 
+        can be computed without grabbing them.
+        """
+        with self.open_task_file(task_number, path, read_ahead) as f:
+            for chunk in iter_numdatafile_chunks(f, chunk_rows, usecols, skip_rows, block_size=read_ahead):
+                yield chunk
+
     def put_into_report(self, report_data):
         pass
 
+    @traced()
     def write_log(self, lines, new_research = False):
         f = open(os.path.join(rset.LOCAL_HOST['main_research_path'], LOG_FILE), 'a')
         dt_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -275,6 +513,7 @@ class Research:
             task_path = os.path.join(execution_host.research_abs_path, rel_task_dir)
         return task_path
 
+    @traced()
     def get_task_path(self, task_number, execution_host=None):
         """Returns the task dir corresponding to task_number. By default, the local dir (from DistrubutedStorage) is returned.
         If execution_host is specified, then the remote dir will be returned.
@@ -288,12 +527,199 @@ class Research:
             task_path = os.path.join(execution_host.research_abs_path, rel_task_dir)
         return task_path
 
+    def _get_task_data_path(self, task_number):
+        """Returns the local task dir corresponding to task_number when the data of the task is going to be read 
+        or written. Unlike get_task_path(), it lets TieringService promote the task.
+        """
+        task_path = self.get_task_path(task_number)
+        if self._tiering is not None:
+            task_path = self._tiering.on_access(task_path)
+        return task_path
+
+    def enable_tracing(self, jsonl_path=None, callback=None):
+        """Enables tracing of operations of the library (see Tracer). Spans are collected in memory so that
+        the summary of the session can be obtained via trace_report(). If jsonl_path is given, they are also 
+        appended to this file. If callback is given, it is called for each span (a dictionary).
+        """
+        self._trace_sink = MemorySink()
+        sinks = [self._trace_sink]
+        if jsonl_path is not None:
+            sinks.append(JsonlSink(jsonl_path))
+        if callback is not None:
+            sinks.append(CallbackSink(callback))
+        tracer.enable(sinks)
+
+    def disable_tracing(self):
+        tracer.disable()
+
+    def trace_report(self):
+        """Returns the text table summarizing durations, bytes transferred and round trips per operation
+        since enable_tracing() has been called.
+        """
+        if self._trace_sink is None:
+            raise Exception('Tracing has not been enabled')
+        return self._trace_sink.report()
+
+    def enable_tiering(self, max_idle_days=30, workers=2, bandwidth_limit=None, promote_on_access=True):
+        """Creates TieringService moving tasks between main_research_path (hot tier) and storage_research_path 
+        (cold tier). If promote_on_access is True, a task located in the cold tier is moved back to the hot one 
+        when its data is accessed via parse_task_datafile(), dump_object() or load_object() (merely looking up
+        the task path never moves the task). Call migrate_idle_tasks() or start() on the returned service to migrate 
+        the tasks untouched for max_idle_days to the cold tier.
+        """
+        self._tiering = TieringService(self._distr_storage, hot_index=0, cold_index=1, max_idle_days=max_idle_days,
+                                       workers=workers, bandwidth_limit=bandwidth_limit, promote_on_access=promote_on_access,
+                                       registry=self.get_registry(), hash_cache=self.get_hash_cache())
+        return self._tiering
+
+    @traced()
+    def backup(self, comm=None, workers=4):
+        """Backs up the research (its dirs in all local storages) into BackupRepository located on the remote
+        accessed via comm (by default, the one passed to the constructor). Only the chunks of files changed since
+        the previous backup are uploaded. The parse cache is not backed up. Returns the id of the created snapshot.
+        """
+        comm = comm if comm is not None else self._exec_comm
+        if not isinstance(comm, SshCommunication):
+            raise Exception('Backup requires SshCommunication')
+        research_paths = [os.path.join(storage_path, self._research_id) for storage_path in self._distr_storage.storage_paths]
+        from resorganizer.backup import BackupRepository # imported here since it requires numpy
+        repo = BackupRepository(comm, os.path.join(rset.LOCAL_HOST['main_research_path'], BACKUP_INDEX_FILE), workers=workers)
+        return repo.backup(self._research_id, research_paths, exclude=(PARSE_CACHE_DIR, RESULTS_STORE_DIR))
+
+    def get_parse_cache(self, size_budget=None):
+        """Returns ParseCache of the research located in the main research path. It can be used to avoid reparsing the same data files.
+        If size_budget is given, it is set as the size budget of the cache (1 GB by default).
+        """
+        if self._parse_cache is None:
+            from resorganizer.parse_cache import ParseCache # imported here since it requires numpy
+            # the cache is located in the fast storage rather than in the research dir which may be in the slow one
+            self._parse_cache = ParseCache(os.path.join(rset.LOCAL_HOST['main_research_path'], PARSE_CACHE_DIR, self._research_id))
+        if size_budget is not None:
+            self._parse_cache.size_budget = size_budget
+        return self._parse_cache
+
+    def parse_task_datafile(self, task_number, filename, parser=parse_numdatafile, *args, **kwds):
+        """Parses the data file filename located in the task dir corresponding to task_number via parser 
+        (e.g., parse_numdatafile or parse_timed_numdatafile) called with additional args and kwds. 
+        The result is cached in the binary form so that the subsequent calls do not parse the file again.
+        Arrays in the result are read-only (see ParseCache).
+        """
+        return self.get_parse_cache().parse(parser, os.path.join(self._get_task_data_path(task_number), filename), *args, **kwds)
+
+    @traced()
+    def aggregate_datafile(self, filename, parser=parse_numdatafile, task_numbers=None, name_regexp=None, 
+                           param_func=None, processes=None, use_cache=True):
+        """Parses the data file filename located in each of the selected tasks via parser and stacks the results 
+        into one numpy array whose first axis corresponds to tasks. Tasks are selected by task_numbers (e.g., range)
+        and/or name_regexp which is searched in the task name. If param_func is given, it is called on the task dir
+        name (e.g., retrieve_trailing_float_from_task_dir) to extract the parameter of the task and the tasks 
+        are sorted by it. Files are parsed in parallel by processes worker processes (all cores by default), 
+        so parser must be picklable. The result is cached in the research's ParseCache if use_cache is True.
+
+        Returns a tuple (task_numbers, params, data) where task_numbers and params are 1D numpy arrays forming
+        the coordinate axis of data (params coincide with task_numbers if param_func is not given).
+        """
+        selected_tasks = []
+        for task_number, task_dir in self._get_task_dirs():
+            if task_numbers is not None and task_number not in task_numbers:
+                continue
+            if name_regexp is not None and re.search(name_regexp, self._split_task_dir(task_dir)[1]) is None:
+                continue
+            params = param_func(task_dir) if param_func is not None else task_number
+            selected_tasks.append((params, task_number, task_dir))
+        if len(selected_tasks) == 0:
+            raise Exception('No tasks are selected')
+        selected_tasks.sort()
+        import numpy as np
+        paths = [os.path.join(self._distr_storage.get_dir_path(os.path.join(self._research_id, task_dir)), filename) \
+                 for _, _, task_dir in selected_tasks]
+        if use_cache:
+            data = self.get_parse_cache().call(_parse_and_stack, paths, parser, paths, processes=processes, 
+                                               ignored_kwds=('processes',))
+        else:
+            data = _parse_and_stack(parser, paths, processes)
+        return np.array([t[1] for t in selected_tasks]), np.array([t[0] for t in selected_tasks]), data
+
+    def get_hash_cache(self):
+        """Returns HashCache shared by all researches. It is used to verify transfers.
+        """
+        if self._hash_cache is None:
+            self._hash_cache = HashCache(os.path.join(rset.LOCAL_HOST['main_research_path'], HASH_CACHE_FILE))
+        return self._hash_cache
+
+    def get_registry(self):
+        """Returns LocationRegistry shared by all researches. It is created when first needed.
+        """
+        if self._registry is None:
+            self._registry = LocationRegistry(os.path.join(rset.LOCAL_HOST['main_research_path'], REGISTRY_FILE))
+        return self._registry
+
+    def _forget_task_locations(self, task_number):
+        """Forgets all locations of the task corresponding to task_number. The registry is not created just for that.
+        """
+        if self._registry is not None or os.path.exists(os.path.join(rset.LOCAL_HOST['main_research_path'], REGISTRY_FILE)):
+            self.get_registry().forget(self._research_id, task_number)
+
+    def _forget_hashes(self, path):
+        """Forgets the hashes of the local file or dir path which has been removed or moved (see HashCache.forget()).
+        The cache is not created just for that.
+        """
+        if self._hash_cache is not None or os.path.exists(os.path.join(rset.LOCAL_HOST['main_research_path'], HASH_CACHE_FILE)):
+            self.get_hash_cache().forget(path)
+
+    def get_results_store(self):
+        """Returns ResultsStore located in the research dir.
+        """
+        if self._results_store is None:
+            from resorganizer.results_store import ResultsStore # imported here since it requires numpy
+            self._results_store = ResultsStore(os.path.join(self.research_path, RESULTS_STORE_DIR))
+        return self._results_store
+
+    @traced()
+    def consolidate_results(self, filename, parser=parse_numdatafile, task_numbers=None, param_func=None,
+                            column_names=None, dataset=None, processes=None):
+        """Ingests the data file filename of the selected tasks into dataset (filename by default) of the research's
+        ResultsStore. Only tasks whose data file exists and has changed since the previous consolidation are parsed,
+        so the method can be called repeatedly as new tasks finish. If param_func is given, it is called on
+        the task dir name (e.g., retrieve_trailing_float_from_task_dir) and its result is stored as the parameter
+        of the task. Returns the list of ingested task numbers.
+
+        Note that the params of a task in the store are only its name (task_name) and the result of param_func (param).
+        The substitution params of the commands are not recorded at launch (a task may consist of many substitutions),
+        so if rows must be selected by them, param_func must retrieve them from the task dir name.
+
+        The consolidated data is read via get_results_store().read(dataset, columns, task_numbers, task_range, where).
+        Rows of re-ingested tasks stay in the store until get_results_store().compact(dataset) is called.
+        """
+        if dataset is None:
+            dataset = filename.replace('/', '_')
+        tasks = []
+        for task_number, task_dir in self._get_task_dirs():
+            if task_numbers is not None and task_number not in task_numbers:
+                continue
+            path = os.path.join(self._distr_storage.get_dir_path(os.path.join(self._research_id, task_dir)), filename)
+            if not os.path.exists(path):
+                continue
+            params = {'task_name': self._split_task_dir(task_dir)[1]}
+            if param_func is not None:
+                params['param'] = param_func(task_dir)
+            tasks.append((task_number, path, params))
+        ingested_task_numbers = self.get_results_store().ingest(dataset, tasks, parser, column_names, processes)
+        print('\tConsolidated {} tasks into dataset {}'.format(len(ingested_task_numbers), dataset))
+        return ingested_task_numbers
+
+    def _get_task_dirs(self):
+        """Returns the list of tuples (task_number, task_dir) for all tasks in the research sorted by task numbers.
+        """
+        found_dirs = self._distr_storage.map_dirs_by_named_regexp(self._research_id, TASK_DIR_PATTERN)
+        return sorted((int(params['task_number']), dir_) for dir_, (_, params) in found_dirs.items())
+
     def dump_object(self, task_number, obj, obj_name):
         """Dumps obj into the file whose name is obj_name + '.pyo' and locates it into the task dir corresponding to
         task_number
         """
         print('Dumping ' + obj_name)
-        f = open(os.path.join(self.get_task_path(task_number), obj_name + '.pyo'),'w')
+        f = open(os.path.join(self._get_task_data_path(task_number), obj_name + '.pyo'),'w')
         pickle.dump(obj, f)
         f.close()
 
@@ -302,7 +728,7 @@ class Research:
         corresponding to task_number
         """
         print('Loading ' + obj_name)
-        f = open(os.path.join(self.get_task_path(task_number), obj_name + '.pyo'),'r')
+        f = open(os.path.join(self._get_task_data_path(task_number), obj_name + '.pyo'),'r')
         obj = pickle.load(f)
         f.close()
         return obj
@@ -324,13 +750,20 @@ class Research:
         return str(task_number) + '-' + self._make_suitable_name(task_name)
 
     def _get_task_name_by_number(self, task_number):
-        find_data = self._distr_storage.find_dir_by_named_regexp(self._research_id, '^{}-(?P<task_name>\S+)'.format(task_number))
-        if find_data is None:
+        found_dirs = self._distr_storage.map_dirs_by_named_regexp(self._research_id, TASK_DIR_PATTERN)
+        if found_dirs is not self._task_names[0]: # the mapping is rebuilt only if the research dir has changed
+            self._task_names = (found_dirs, dict((int(params['task_number']), params['task_name']) 
+                                                 for _, params in found_dirs.values()))
+        if task_number not in self._task_names[1]:
+            degraded_sources = self._distr_storage.get_degraded_sources()
+            if len(degraded_sources) != 0:
+                raise StorageSourceUnavailable("Cannot look up task '{}' since storage sources {} are degraded" \
+                                               .format(task_number, ', '.join(degraded_sources)))
             raise Exception("No task with number '{}' is found".format(task_number))
-        return find_data[1]['task_name']
+        return self._task_names[1][task_number]
 
     def _split_task_dir(self, task_dir):
-        parsing_params = parse_by_named_regexp('^(?P<task_number>\d+)-(?P<task_name>\S+)', task_dir)
+        parsing_params = parse_by_named_regexp(TASK_DIR_PATTERN, task_dir)
         if parsing_params is None:
             raise Exception("No task directory '{}' is found".format(task_dir))
         return int(parsing_params['task_number']), parsing_params['task_name']
@@ -364,6 +797,19 @@ class ResearchDoesNotExist(Exception):
 def get_all_research_ids():
     return os.listdir('.' + rset.LOCAL_HOST['main_research_path'])
 
+def _parse_and_stack(parser, paths, processes=None):
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    if processes == 1:
+        results = [parser(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(parser, paths, chunksize=max(1, len(paths) // (4 * (processes or os.cpu_count() or 1)))))
+    shapes = set(np.shape(res) for res in results)
+    if len(shapes) != 1:
+        raise Exception('Data files have different shapes and cannot be stacked: {}'.format(shapes))
+    return np.stack(results)
+
 def retrieve_trailing_float_from_task_dir(task_dir):
     matching = re.search('^(?P<task_number>\d+)-(?P<task_name>\S+)_(?P<float_left>\d+)\.(?P<float_right>\d+)', task_dir)
     if matching is None:
@@ -0,0 +1,283 @@
+import os
+import os.path
+import json
+import shutil
+import sqlite3
+import uuid
+import numpy as np
+from resorganizer.aux import parse_numdatafile
+
+INDEX_FILENAME = 'index.db'
+
+class ResultsStore(object):
+    """ResultsStore consolidates the results of tasks (data files parsed by the parsers from aux) into a single
+    columnar store located in store_dir. The store consists of datasets each of which is typically built from
+    the data file of the same name in all tasks. A dataset is a table whose rows come from the tasks and
+    whose columns are those of the data files:
+    (1) rows are stored in chunks, each column of a chunk is stored in a separate .npy file so that reading
+    a few columns does not touch the others
+    (2) the index (SQLite database) maps each task number into the chunk and the range of its rows and stores
+    the parameters of the task (any json-serializable object) together with the size and modification time
+    of the source data file
+
+    The store is append-only: ingest() adds new chunks containing all the given tasks. A task whose data file
+    has not changed since its ingestion is skipped, a changed one is ingested again and its old rows are not
+    referenced anymore. Chunks which are not referenced at all are removed after ingestion, but the old rows of 
+    re-ingested tasks stay in partially referenced chunks, so the store grows until compact() is called.
+    Chunks are read via memory mapping, so selecting columns and tasks reads only the necessary data.
+    """
+    def __init__(self, store_dir, chunk_rows=2**20):
+        self.store_dir = store_dir
+        self.chunk_rows = chunk_rows
+        self._indices = {}
+
+    def ingest(self, dataset, tasks, parser=parse_numdatafile, column_names=None, processes=None):
+        """Ingests the data files of tasks into dataset. tasks is a sequence of tuples (task_number, path, params)
+        where path is the path to the data file and params is a json-serializable object describing the task.
+        parser must return a 2D array-like object (rows and columns) and, if processes is not 1, be picklable
+        since files are parsed by processes worker processes (all cores by default). If column_names are not given,
+        they are taken from the header (the first line) of the first data file. Returns the list of ingested task numbers.
+        """
+        index = self._get_index(dataset, create=True)
+        known_files = dict((row[0], (row[1], row[2])) for row in
+                           index.execute('SELECT task_number, source_size, source_mtime_ns FROM tasks'))
+        new_tasks = []
+        for task_number, path, params in tasks:
+            st = os.stat(path)
+            if known_files.get(task_number) != (st.st_size, st.st_mtime_ns):
+                new_tasks.append((task_number, path, params, st))
+        if len(new_tasks) == 0:
+            return []
+        columns = self.get_columns(dataset)
+        if columns is None:
+            columns = column_names if column_names is not None else _read_header(new_tasks[0][1])
+        with index:
+            index.execute("INSERT OR IGNORE INTO meta VALUES ('columns', ?)", (json.dumps(list(columns)),))
+        for batch_start in range(0, len(new_tasks), _get_parsing_batch_size(processes)):
+            batch = new_tasks[batch_start:batch_start + _get_parsing_batch_size(processes)]
+            tables = _parse_all(parser, [path for _, path, _, _ in batch], processes)
+            arrays = [_to_2d_array(table, path, len(columns)) for (_, path, _, _), table in zip(batch, tables)]
+            self._append(dataset, index, [(task_number, json.dumps(params), st.st_size, st.st_mtime_ns) 
+                                          for task_number, _, params, st in batch], arrays, len(columns))
+        self._remove_unreferenced_chunks(dataset, index)
+        return [task_number for task_number, _, _, _ in new_tasks]
+
+    def compact(self, dataset):
+        """Rewrites the rows of dataset referenced by the index into new chunks (ordered by task numbers) and removes
+        the old chunks, so that the rows of re-ingested tasks do not occupy space anymore. Returns the number of
+        dropped rows.
+        """
+        index = self._get_index(dataset)
+        if index is None:
+            raise Exception("Dataset '{}' does not exist".format(dataset))
+        columns_num = len(self.get_columns(dataset))
+        tasks = index.execute('SELECT task_number, params, chunk_dir, row_start, row_count, source_size, source_mtime_ns '
+                              'FROM tasks ORDER BY task_number').fetchall()
+        chunk_dirs = set(chunk_dir for _, _, chunk_dir, _, _, _, _ in tasks)
+        stored_rows = sum(len(self._load_column(dataset, chunk_dir, 0)) for chunk_dir in chunk_dirs)
+        referenced_rows = sum(row_count for _, _, _, _, row_count, _, _ in tasks)
+        if stored_rows == referenced_rows:
+            return 0
+        group_start = 0
+        while group_start < len(tasks):
+            # tasks are rewritten by groups of about chunk_rows rows to bound the memory consumption
+            group_stop = group_start
+            rows_num = 0
+            while group_stop < len(tasks) and (rows_num == 0 or rows_num + tasks[group_stop][4] <= self.chunk_rows):
+                rows_num += tasks[group_stop][4]
+                group_stop += 1
+            group = tasks[group_start:group_stop]
+            arrays = []
+            for _, _, chunk_dir, row_start, row_count, _, _ in group:
+                arrays.append(np.stack([self._load_column(dataset, chunk_dir, column_i)[row_start:row_start + row_count]
+                                        for column_i in range(columns_num)], axis=1))
+            self._append(dataset, index, [(task_number, params, source_size, source_mtime_ns) for 
+                                          task_number, params, _, _, _, source_size, source_mtime_ns in group], arrays, columns_num)
+            group_start = group_stop
+        self._remove_unreferenced_chunks(dataset, index)
+        return stored_rows - referenced_rows
+
+    def read(self, dataset, columns=None, task_numbers=None, task_range=None, where=None):
+        """Reads dataset. Only columns (all by default) of rows belonging to the selected tasks are read. Tasks are
+        selected by task_numbers, task_range (a tuple (start, stop) where stop is excluded) and/or where which
+        is a function taking task_number and params and returning True for the tasks to be selected.
+
+        Returns a dictionary where a key is the column name and a value is 1D numpy array. The additional column
+        task_number contains the task number of each row. If the selected rows are contiguous in one chunk,
+        the arrays are read-only memory-mapped views. Rows are ordered by task numbers.
+        """
+        index = self._get_index(dataset)
+        all_columns = self.get_columns(dataset)
+        if index is None or all_columns is None:
+            raise Exception("Dataset '{}' does not exist".format(dataset))
+        columns = all_columns if columns is None else list(columns)
+        for column in columns:
+            if column not in all_columns:
+                raise Exception("Column '{}' is not found in dataset '{}'".format(column, dataset))
+        pieces = [] # tuples (chunk_dir, row_start, row_stop, task_numbers)
+        for task_number, params, chunk_dir, row_start, row_count in self._select_tasks(index, task_numbers, task_range, where):
+            if len(pieces) != 0 and pieces[-1][0] == chunk_dir and pieces[-1][2] == row_start:
+                pieces[-1] = (chunk_dir, pieces[-1][1], row_start + row_count, pieces[-1][3] + [(task_number, row_count)])
+            else:
+                pieces.append((chunk_dir, row_start, row_start + row_count, [(task_number, row_count)]))
+        res = {}
+        for column in columns:
+            chunk_columns = {} # each column of a chunk is loaded once even if the chunk is split into several pieces
+            for chunk_dir, _, _, _ in pieces:
+                if chunk_dir not in chunk_columns:
+                    chunk_columns[chunk_dir] = self._load_column(dataset, chunk_dir, all_columns.index(column))
+            res[column] = _concatenate([chunk_columns[chunk_dir][row_start:row_stop] for chunk_dir, row_start, row_stop, _ in pieces])
+        res['task_number'] = np.concatenate([np.repeat(np.array([t for t, _ in piece_tasks], dtype=np.int64),
+                                                       [n for _, n in piece_tasks]) for _, _, _, piece_tasks in pieces]) \
+                             if len(pieces) != 0 else np.zeros((0,), dtype=np.int64)
+        return res
+
+    def get_tasks(self, dataset):
+        """Returns the list of dictionaries describing the tasks ingested into dataset (task_number, params, rows).
+        """
+        index = self._get_index(dataset)
+        if index is None:
+            return []
+        return [{'task_number': task_number, 'params': json.loads(params), 'rows': rows} for task_number, params, rows in
+                index.execute('SELECT task_number, params, row_count FROM tasks ORDER BY task_number')]
+
+    def get_columns(self, dataset):
+        """Returns the list of column names of dataset or None if dataset is empty or does not exist.
+        """
+        index = self._get_index(dataset)
+        if index is None:
+            return None
+        row = index.execute("SELECT value FROM meta WHERE key = 'columns'").fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_datasets(self):
+        """Returns the names of all datasets.
+        """
+        if not os.path.exists(self.store_dir):
+            return []
+        return sorted(name for name in os.listdir(self.store_dir) if os.path.exists(os.path.join(self.store_dir, name, INDEX_FILENAME)))
+
+    def close(self):
+        for index in self._indices.values():
+            index.close()
+        self._indices = {}
+
+    def _append(self, dataset, index, tasks, arrays, columns_num):
+        """Writes arrays (2D tables) of tasks into new chunks and records them in the index. tasks is a list of tuples 
+        (task_number, params_json, source_size, source_mtime_ns).
+        """
+        chunk_start = 0
+        while chunk_start < len(tasks):
+            # tasks are never split between chunks
+            chunk_stop = chunk_start + 1
+            rows_num = len(arrays[chunk_start])
+            while chunk_stop < len(tasks) and rows_num + len(arrays[chunk_stop]) <= self.chunk_rows:
+                rows_num += len(arrays[chunk_stop])
+                chunk_stop += 1
+            self._write_chunk(dataset, index, tasks[chunk_start:chunk_stop], arrays[chunk_start:chunk_stop], columns_num)
+            chunk_start = chunk_stop
+
+    def _write_chunk(self, dataset, index, tasks, arrays, columns_num):
+        chunk_dir = 'chunk_' + uuid.uuid4().hex
+        dataset_path = os.path.join(self.store_dir, dataset)
+        tmp_chunk_path = os.path.join(dataset_path, '.tmp-' + chunk_dir)
+        os.makedirs(tmp_chunk_path)
+        table = np.concatenate(arrays) if len(arrays) > 1 else arrays[0]
+        for column_i in range(columns_num):
+            np.save(os.path.join(tmp_chunk_path, '{}.npy'.format(column_i)), np.ascontiguousarray(table[:, column_i]), allow_pickle=False)
+        os.rename(tmp_chunk_path, os.path.join(dataset_path, chunk_dir))
+        rows = []
+        row_start = 0
+        for (task_number, params_json, source_size, source_mtime_ns), array in zip(tasks, arrays):
+            rows.append((task_number, params_json, chunk_dir, row_start, len(array), source_size, source_mtime_ns))
+            row_start += len(array)
+        with index:
+            index.executemany('INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def _select_tasks(self, index, task_numbers, task_range, where):
+        conditions = []
+        query_params = []
+        if task_range is not None:
+            conditions.append('task_number >= ? AND task_number < ?')
+            query_params += list(task_range)
+        clause = ' WHERE ' + ' AND '.join(conditions) if len(conditions) != 0 else ''
+        task_numbers = set(task_numbers) if task_numbers is not None else None
+        selected = []
+        for task_number, params, chunk_dir, row_start, row_count in index.execute(
+                'SELECT task_number, params, chunk_dir, row_start, row_count FROM tasks' + clause + ' ORDER BY task_number', query_params):
+            if task_numbers is not None and task_number not in task_numbers:
+                continue
+            params = json.loads(params)
+            if where is not None and not where(task_number, params):
+                continue
+            selected.append((task_number, params, chunk_dir, row_start, row_count))
+        return selected
+
+    def _load_column(self, dataset, chunk_dir, column_i):
+        return np.load(os.path.join(self.store_dir, dataset, chunk_dir, '{}.npy'.format(column_i)), mmap_mode='r', allow_pickle=False)
+
+    def _remove_unreferenced_chunks(self, dataset, index):
+        """Removes the chunks of dataset which are not referenced by any task and the remains of interrupted writes.
+        """
+        referenced = set(row[0] for row in index.execute('SELECT DISTINCT chunk_dir FROM tasks'))
+        dataset_path = os.path.join(self.store_dir, dataset)
+        for name in os.listdir(dataset_path):
+            if (name.startswith('chunk_') and name not in referenced) or name.startswith('.tmp-chunk_'):
+                shutil.rmtree(os.path.join(dataset_path, name))
+
+    def _get_index(self, dataset, create=False):
+        """Returns the connection to the index of dataset. If the dataset does not exist, it is created if create
+        is True and None is returned otherwise.
+        """
+        if dataset not in self._indices:
+            dataset_path = os.path.join(self.store_dir, dataset)
+            if not os.path.exists(os.path.join(dataset_path, INDEX_FILENAME)):
+                if not create:
+                    return None
+                if not os.path.exists(dataset_path):
+                    os.makedirs(dataset_path)
+            index = sqlite3.connect(os.path.join(dataset_path, INDEX_FILENAME))
+            with index:
+                index.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                index.execute('CREATE TABLE IF NOT EXISTS tasks (task_number INTEGER PRIMARY KEY, params TEXT NOT NULL, '
+                              'chunk_dir TEXT NOT NULL, row_start INTEGER NOT NULL, row_count INTEGER NOT NULL, '
+                              'source_size INTEGER NOT NULL, source_mtime_ns INTEGER NOT NULL)')
+            self._indices[dataset] = index
+        return self._indices[dataset]
+
+def _read_header(path):
+    """Returns the column names from the first line of the data file given by path.
+    """
+    with open(path, 'r') as f:
+        return f.readline().split()
+
+def _to_2d_array(table, path, columns_num):
+    """Returns table parsed from the data file path as a 2D array with columns_num columns. A 1D table is 
+    a single column if columns_num is 1 and a single row otherwise.
+    """
+    array = np.asarray(table)
+    if array.ndim == 1:
+        array = array.reshape((-1, 1) if columns_num == 1 else (1, -1))
+    if array.ndim != 2:
+        raise Exception("Parser must return a 2D table, but got {}D one for '{}'".format(array.ndim, path))
+    if array.shape[1] != columns_num and array.shape[0] != 0:
+        raise Exception("Data file '{}' has {} columns instead of {}".format(path, array.shape[1], columns_num))
+    return array.reshape((-1, columns_num))
+
+def _get_parsing_batch_size(processes):
+    # bounds the memory occupied by parsed but not yet written tables
+    return 256 * (processes or os.cpu_count() or 1)
+
+def _parse_all(parser, paths, processes):
+    if processes == 1 or len(paths) == 1:
+        return [parser(path) for path in paths]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(parser, paths, chunksize=max(1, len(paths) // (4 * (processes or os.cpu_count() or 1)))))
+
+def _concatenate(pieces):
+    if len(pieces) == 1:
+        return pieces[0]
+    elif len(pieces) == 0:
+        return np.zeros((0,))
+    return np.concatenate(pieces)
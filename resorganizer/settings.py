@@ -7,6 +7,13 @@ whereas storage_research_path is better for permanent storing of data. For insta
 can be an external hard drive. You can imagine an analogy with caches -- main_research_path should be quickly 
 accessable whereas storage_research_path
 
+If use_inotify is True, the listings of the directories of the distributed storage are cached and trusted until
+inotify (Linux only) reports a change so that repeated lookups do not touch slow sources at all.
+If source_timeout (in seconds) is set, a source of the distributed storage not responding within it is
+considered degraded and skipped instead of blocking research operations.
+If paramiko_log_file is set, the log of ssh connections (paramiko) is appended to this file. By default, 
+it is not written anywhere.
+
 For remotes, there is no distributed storage so only one research_path should be defined.
 """
 
@@ -15,6 +22,9 @@ LOCAL_HOST = {
     'host_relative_data_path' : None,
     'main_research_path' : None,
     'storage_research_path' : None,
+    'use_inotify' : False,
+    'source_timeout' : None,
+    'paramiko_log_file' : None,
 }
 
 REMOTE_HOSTS = {
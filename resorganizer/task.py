@@ -1,4 +1,5 @@
 from resorganizer.aux import *
+import copy
 
 class Command(object):
     """Command is an abstraction for any command line able to be executed. Command line has the components: 
@@ -75,6 +76,92 @@ class CommandTask(object):
         for sid, params_subst, flags_subst, trailing_args_subst in zip(self.sids, self.params_subst, self.flags_subst, self.trailing_args_subst):
             yield (sid, self.command.substitute(params_subst, flags_subst, trailing_args_subst))
 
+    def restricted_to(self, sids):
+        """Returns a copy of the task containing only the substitutions specified by sids. It is useful for relaunching
+        failed commands.
+        """
+        task = copy.copy(self)
+        indices = [i for i, sid in enumerate(self.sids) if sid in sids]
+        for attr_name, attr in vars(self).items():
+            if attr_name.endswith('_subst') or attr_name == 'sids':
+                setattr(task, attr_name, [attr[i] for i in indices])
+        task.inputs = list(self.inputs)
+        return task
+
+class GraphCommandTask(CommandTask):
+    """GraphCommandTask is a multiple task whose commands form a dependency graph (DAG). Each substitution can 
+    declare the substitutions it depends on explicitly (depends_on) as well as the files it consumes and produces.
+    A substitution consuming a file produced by another substitution implicitly depends on it. Independent
+    substitutions can then be executed simultaneously, and this is a business of TaskExecution.
+    """
+    def __init__(self, cmd, prog=''):
+        super(GraphCommandTask, self).__init__(cmd, prog)
+        self.depends_on_subst = []
+        self.consumes_subst = []
+        self.produces_subst = []
+
+    def set_substitution(self, sid, params={}, flags=(), trailing_args='', depends_on=(), consumes=(), produces=()):
+        """Adds a substitution into task. In addition to CommandTask.set_substitution(), depends_on is a sequence
+        of sids which must be finished before this substitution and consumes/produces are sequences of 
+        the names of files which are read/written by this substitution.
+        """
+        super(GraphCommandTask, self).set_substitution(sid, params, flags, trailing_args)
+        self.depends_on_subst.append(tuple(depends_on))
+        self.consumes_subst.append(tuple(consumes))
+        self.produces_subst.append(tuple(produces))
+
+    def restricted_to(self, sids):
+        """Returns a copy of the task containing only the substitutions specified by sids (see 
+        CommandTask.restricted_to()). Dependencies on the dropped substitutions are dropped too since they are assumed
+        to be finished, and so are the files produced by them.
+        """
+        task = super(GraphCommandTask, self).restricted_to(sids)
+        task.depends_on_subst = [tuple(dep_sid for dep_sid in depends_on if dep_sid in task.sids) 
+                                 for depends_on in task.depends_on_subst]
+        return task
+
+    def dependencies(self):
+        """Returns a dictionary where a key is a sid and a value is a list of sids it depends on.
+        """
+        producers = {}
+        for sid, produces in zip(self.sids, self.produces_subst):
+            for filename in produces:
+                if filename in producers:
+                    raise Exception("File '{}' is produced by both '{}' and '{}'".format(filename, producers[filename], sid))
+                producers[filename] = sid
+        deps = {}
+        for sid, depends_on, consumes in zip(self.sids, self.depends_on_subst, self.consumes_subst):
+            deps[sid] = []
+            for dep_sid in tuple(depends_on) + tuple(producers[f] for f in consumes if f in producers):
+                if dep_sid not in self.sids:
+                    raise Exception("Substitution '{}' depends on unknown substitution '{}'".format(sid, dep_sid))
+                if dep_sid != sid and dep_sid not in deps[sid]:
+                    deps[sid].append(dep_sid)
+        return deps
+
+    def topological_order(self):
+        """Returns the list of sids sorted such that each sid follows all sids it depends on. Raises an exception
+        if the dependency graph contains a cycle.
+        """
+        deps = self.dependencies()
+        in_degrees = dict((sid, len(deps[sid])) for sid in self.sids)
+        dependents = dict((sid, []) for sid in self.sids)
+        for sid in self.sids:
+            for dep_sid in deps[sid]:
+                dependents[dep_sid].append(sid)
+        # Kahn's algorithm, ready sids are taken in the order of substitutions
+        order = [sid for sid in self.sids if in_degrees[sid] == 0]
+        i = 0
+        while i < len(order):
+            for dependent_sid in dependents[order[i]]:
+                in_degrees[dependent_sid] -= 1
+                if in_degrees[dependent_sid] == 0:
+                    order.append(dependent_sid)
+            i += 1
+        if len(order) != len(self.sids):
+            raise Exception('Dependency graph contains a cycle')
+        return order
+
 class PythonTask(object):
     """PythonTask essentially executes a python function and specify data to be copied. It allows to automate some of the routines
     emerging while working with other heavier tasks. Even though the extension to "single function - multiple data" 
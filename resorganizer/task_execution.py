@@ -1,6 +1,17 @@
-from mako.template import Template
-from resorganizer.aux import append_code, get_templates_path, create_file_mkdir
+from resorganizer.aux import append_code, get_templates_path, parse_datafile
+from resorganizer.tracing import tracer, traced
 import os
+import shlex
+
+RUNNER_SCRIPT_FILENAME = 'runner.py'
+RUNNER_STATUS_FILENAME = 'runner_status.txt'
+RUNNER_LOG_FILENAME = 'runner.log'
+GRAPH_SUBMITTER_FILENAME = 'submit_graph.sh'
+GRAPH_JOBS_FILENAME = 'graph_jobs.txt'
+MARKERS_DIR = '.rso'
+UNITS_FILENAME = MARKERS_DIR + '/units'
+JOBS_FILENAME = MARKERS_DIR + '/jobs'
+DIRECT_UNIT = 'main'
 
 class TaskExecution(object):
     """TaskExecution describes how CommandTask (and PythonTask, but it is too trivial, so the case of CommandTask 
@@ -10,25 +21,39 @@ class TaskExecution(object):
     (3) execute the command
 
     The list of paths for (1) is defined by copies_list in TaskExecution. The list of names for (2)
-    is defined by host_relative_copies_list. Note that only one command must be executed whereas Task
+    is defined by host_relative_copies_list. Files generated by TaskExecution itself (e.g., scripts)
+    are not written onto the local disk, but kept in memory in staged_files (a dictionary where a key
+    is a filename and a value is the content of the file) and written directly into the dir of execution 
+    during (1). Note that only one command must be executed whereas Task
     can contain several of them (that is called multiple task). To handle this, TaskExecution offers three
     strategies of execution:
     (1) alone task execution
     (2) plural task execution (i.e. parallel run of the commands of a multiple task)
     (3) chain task execution (i.e. serial run of the commands of a multiple task)
+    (4) graph task execution (i.e. run of the commands of GraphCommandTask respecting their dependencies 
+    such that independent commands run simultaneously)
     and a separate case for python task:
-    (4) python task execution
+    (5) python task execution
 
     It is a deal of a conrete implementation how plural task execution and chain task execution are implemented,
     but in the end, there must be a single command in self.command to be executed.
+
+    To make it possible to monitor the task, the command is split into units (e.g., sge-scripts) whose names are
+    listed in the staged file .rso/units. Each unit creates the marker file .rso/<unit>.started when it starts and 
+    writes its exit code into .rso/<unit>.exit when it finishes. Units submitted to a queue record their job ids
+    in .rso/jobs (one line per unit, unit and job id separated by a space) whereas units executed directly record
+    the pid of their shell in .rso/<unit>.pid so that a unit whose process has gone is not considered running.
     """
     def __init__(self):
         self.pyfunc = None
         self.command = None
         self.copies_list = []
         self.host_relative_copies_list = []
+        self.staged_files = {}
+        self.units = []
         self.is_global_command = False
-        append_code(self, ('set_alone_task', 'set_plural_task', 'set_chain_task'), self._add_program)
+        append_code(self, ('set_alone_task', 'set_plural_task', 'set_chain_task', 'set_graph_task'), self._add_program)
+        append_code(self, ('set_alone_task', 'set_plural_task', 'set_chain_task', 'set_graph_task'), self._stage_units)
 
     def set_python_task(self, pytask):
         self.copies_list = pytask.inputs
@@ -43,19 +68,89 @@ class TaskExecution(object):
     def set_chain_task(self, task):
         raise NotImplementedError()
 
+    def set_graph_task(self, task):
+        raise NotImplementedError()
+
+    def bind_host(self, host):
+        """Is called by Research right before launching with the host where the task is executed. 
+        It allows to adjust the execution to the host.
+        """
+        pass
+
+    def _stage_file(self, filename, data):
+        tracer.count('bytes_staged', len(data))
+        self.staged_files[filename] = data
+
+    def _stage_units(self, task):
+        self._stage_file(UNITS_FILENAME, ''.join(unit + '\n' for unit in self.units))
+
     def _add_program(self, task):
         if task.program != '':
             self.host_relative_copies_list.append(task.program)
 
 class DirectExecution(TaskExecution):
     """DirectExecution implements an execution via OS-native API
+
+    Plural and chain task executions are implemented via a separate python script which is
+    called a runner. It runs the commands in a bounded pool of worker processes (for plural task)
+    or one after another (for chain task) or as soon as their dependencies are finished (for graph task)
+    and records the exit code and the wall time of each command
+    in the status file whereas the output of each command is redirected to the file sid.log.
+    The runner is launched in background (its own output goes to runner.log), so launching does not wait
+    for the commands to finish (see Research.wait_for_tasks()). All these files appear in the task dir.
     """
     def __init__(self):
         super(DirectExecution, self).__init__()
+        self.cores = None
+        self._runner_nodes = None
+
+    def set_properties(self, cores=None):
+        """Sets the number of worker processes used by the runner. If cores is None, RemoteHost.cores of
+        the host where the task is executed is taken or, if the host is local, the number of its cores.
+        """
+        self.cores = cores
+
+    def bind_host(self, host):
+        if self.cores is None and self._runner_nodes is not None and getattr(host, 'cores', None) is not None:
+            self._stage_file(RUNNER_SCRIPT_FILENAME, _render_runner_script(host.cores, self._runner_nodes))
 
+    @traced()
     def set_alone_task(self, task):
-        sid, self.command = next(task.command_gen())
+        sid, cmd = next(task.command_gen())
+        self.units = [DIRECT_UNIT]
+        self.command = _wrap_with_markers('./' + cmd, DIRECT_UNIT)
         self.copies_list = task.inputs
+        self.is_global_command = True
+
+    @traced()
+    def set_plural_task(self, task):
+        nodes = [(sid, './' + cmd, ()) for sid, cmd in task.command_gen()]
+        self._set_runner(task, nodes)
+
+    @traced()
+    def set_chain_task(self, task):
+        nodes = []
+        prev_sid = None
+        for sid, cmd in task.command_gen():
+            nodes.append((sid, './' + cmd, (prev_sid,) if prev_sid is not None else ()))
+            prev_sid = sid
+        self._set_runner(task, nodes)
+
+    @traced()
+    def set_graph_task(self, task):
+        deps = task.dependencies()
+        cmds = dict(task.command_gen())
+        nodes = [(sid, './' + cmds[sid], deps[sid]) for sid in task.topological_order()]
+        self._set_runner(task, nodes)
+
+    def _set_runner(self, task, nodes):
+        self._runner_nodes = nodes
+        self._stage_file(RUNNER_SCRIPT_FILENAME, _render_runner_script(self.cores, nodes))
+        self.copies_list += task.inputs
+        self.units = [DIRECT_UNIT]
+        self.command = 'nohup sh -c {} > {} 2>&1 < /dev/null &'.format(
+            shlex.quote(_wrap_with_markers('python {}'.format(RUNNER_SCRIPT_FILENAME), DIRECT_UNIT)), RUNNER_LOG_FILENAME)
+        self.is_global_command = True
 
 class SgeExecution(TaskExecution):
     """SgeExecution implements an execution via SGE.
@@ -65,52 +160,84 @@ class SgeExecution(TaskExecution):
 
     Plural task execution is implemented via a separate python script which is called
     a handler. It controls the SGE queue and qsubs sge-scripts such that the queue 
-    never overflows with tasks.
+    never overflows with tasks. If packing is set (see set_packing()), the commands are grouped 
+    into batches and each sge-script runs a batch via the runner (see DirectExecution) using
+    a pool of self.cores worker processes. The status of each command of the i-th batch is then 
+    recorded in batch_i_status.txt so that failed commands can be relaunched individually.
 
     Chain task execution is implemented via a sequence of sge-scripts each of which qsubs
     the next sge-script in the sequence making, therefore, a chain.
+
+    Graph task execution is implemented via a shell script qsubbing all sge-scripts at once
+    such that each of them is held (-hold_jid) until the jobs it depends on are finished.
+    Since SGE releases held jobs even if the jobs they depend on have failed, each sge-script checks 
+    the exit markers of its dependencies first and, unless all of them are successful, exits without 
+    running the command writing 'skipped' into its exit marker (as DirectExecution skips such commands).
+    Submitted job ids are written into graph_jobs.txt.
     """
     def __init__(self):
         super(SgeExecution, self).__init__()
+        self.commands_per_job = None
+        self.command_time = None
 
     def set_properties(self, cores, time):
         self.cores = cores
         self.time = time
 
+    def set_packing(self, commands_per_job=None, command_time=None):
+        """Enables packing of commands of plural task into batches each of which is executed as a single SGE job.
+        The size of a batch is defined by commands_per_job and/or by command_time which is the expected wall time
+        of one command in seconds. In the latter case, the batch is sized such that it fits into the wall time
+        of the job given in set_properties(). If both are given, the smallest size is taken.
+        """
+        self.commands_per_job = commands_per_job
+        self.command_time = command_time
+
+    @traced()
     def set_alone_task(self, task):
         sid, cmd = next(task.command_gen())
         cmd = './' + cmd
         print(cmd)
         sge_script_filename = '{}.sh'.format(sid)
-        sge_script_path = os.path.join('tmp', sge_script_filename)
-        sge_data = _render_sge_template(sge_script_path, self.cores, self.time, [cmd])
-        self.copies_list.append(sge_script_path)
+        self._stage_file(sge_script_filename, _render_sge_template(self.cores, self.time, [cmd], sid))
+        self.units = [sid]
         self.copies_list += task.inputs
-        self.command = 'qsub {}'.format(sge_script_filename)
+        self.command = _make_qsub_command(sge_script_filename, sid)
         self.is_global_command = True
 
+    @traced()
     def set_plural_task(self, task):
         # prepare sge scripts and add them into the list of copies
         sges = []
-        for sid, cmd in task.command_gen():
-            sge_script_filename = '{}.sh'.format(sid)
-            sge_script_path = os.path.join('tmp', sge_script_filename)
-            sge_data = _render_sge_template(sge_script_path, self.cores, self.time, ['./' + cmd])
-            self.copies_list.append(sge_script_path)
-            sges.append(sge_script_filename)
+        if self.commands_per_job is None and self.command_time is None:
+            for sid, cmd in task.command_gen():
+                sge_script_filename = '{}.sh'.format(sid)
+                self._stage_file(sge_script_filename, _render_sge_template(self.cores, self.time, ['./' + cmd], sid))
+                sges.append(sge_script_filename)
+                self.units.append(sid)
+        else:
+            nodes = [(sid, './' + cmd, ()) for sid, cmd in task.command_gen()]
+            batch_size = self._get_batch_size()
+            for batch_i, batch_start in enumerate(range(0, len(nodes), batch_size)):
+                batch_name = 'batch_{}'.format(batch_i)
+                runner_script_filename = '{}.py'.format(batch_name)
+                self._stage_file(runner_script_filename, _render_runner_script(self.cores, 
+                    nodes[batch_start:batch_start + batch_size], status_filename='{}_status.txt'.format(batch_name)))
+                sge_script_filename = '{}.sh'.format(batch_name)
+                self._stage_file(sge_script_filename, _render_sge_template(self.cores, self.time, 
+                    ['python ' + runner_script_filename], batch_name))
+                sges.append(sge_script_filename)
+                self.units.append(batch_name)
 
         # prepare py-handler
-        handler_templ_file = open(os.path.join(get_templates_path(), 'plural_task_handler.py'), 'r')
-        rendered_data = Template(handler_templ_file.read()).render(max_sge_tasks_in_queue=40, sleeping_time_sec=600, sges=sges)
         handler_script_filename = 'handler.py'
-        handler_script_path = os.path.join('tmp', handler_script_filename)
-        handler_script_file = create_file_mkdir(handler_script_path)
-        handler_script_file.write(rendered_data)
-        self.copies_list.append(handler_script_path)
+        self._stage_file(handler_script_filename, _render_template('plural_task_handler.py', 
+            max_sge_tasks_in_queue=40, sleeping_time_sec=600, sges=sges, units=self.units, jobs_filename=JOBS_FILENAME))
         self.copies_list += task.inputs
         self.command = 'nohup python {} > handler.err 2>&1 &'.format(handler_script_filename)
         self.is_global_command = True
 
+    @traced()
     def set_chain_task(self, task):
         cmds = []
         sids = []
@@ -119,18 +246,83 @@ class SgeExecution(TaskExecution):
             sids.append(sid)
         for i in range(len(sids)):
             sge_script_filename = '{}.sh'.format(sids[i])
-            sge_script_path = os.path.join('tmp', sge_script_filename)
-            sge_cmds = [cmds[i]]
+            after_cmds = []
             if i != len(sids) - 1:
-                sge_cmds.append('qsub {}.sh'.format(sids[i + 1]))
-            sge_data = _render_sge_template(sge_script_path, self.cores, self.time, sge_cmds)
-            self.copies_list.append(sge_script_path)
+                after_cmds.append(_make_qsub_command('{}.sh'.format(sids[i + 1]), sids[i + 1]))
+            self._stage_file(sge_script_filename, _render_sge_template(self.cores, self.time, [cmds[i]], sids[i], after_cmds))
+        self.units = sids
         self.copies_list += task.inputs
-        self.command = 'qsub {}.sh'.format(sids[0])
+        self.command = _make_qsub_command('{}.sh'.format(sids[0]), sids[0])
         self.is_global_command = True
 
-def _render_sge_template(sge_script_path, cores, time, commands):
-        sge_templ_file = open(os.path.join(get_templates_path(), 'sge_script.sh'), 'r')
-        rendered_data = Template(sge_templ_file.read()).render(cores=cores, time=time, commands=commands)
-        sge_script_file = create_file_mkdir(sge_script_path)
-        sge_script_file.write(rendered_data)
+    @traced()
+    def set_graph_task(self, task):
+        deps = task.dependencies()
+        cmds = dict(task.command_gen())
+        job_vars = {}
+        jobs = []
+        for i, sid in enumerate(task.topological_order()):
+            sge_script_filename = '{}.sh'.format(sid)
+            self._stage_file(sge_script_filename, _render_sge_template(self.cores, self.time, ['./' + cmds[sid]], sid, 
+                dep_units=deps[sid]))
+            job_vars[sid] = 'JID_{}'.format(i)
+            jobs.append((job_vars[sid], [job_vars[dep_sid] for dep_sid in deps[sid]], sge_script_filename, sid))
+            self.units.append(sid)
+        self._stage_file(GRAPH_SUBMITTER_FILENAME, _render_template('sge_graph_submitter.sh', jobs=jobs, 
+            markers_dir=MARKERS_DIR, jobs_filename=JOBS_FILENAME))
+        self.copies_list += task.inputs
+        self.command = 'sh {} > {}'.format(GRAPH_SUBMITTER_FILENAME, GRAPH_JOBS_FILENAME)
+        self.is_global_command = True
+
+    def _get_batch_size(self):
+        batch_sizes = []
+        if self.commands_per_job is not None:
+            batch_sizes.append(self.commands_per_job)
+        if self.command_time is not None:
+            commands_per_core = int(_time_to_seconds(self.time) // self.command_time)
+            batch_sizes.append(commands_per_core * (self.cores if self.cores is not None else 1))
+        return max(1, min(batch_sizes))
+
+def read_runner_status(status_path):
+    """Parses the status file written by the runner. Returns a dictionary where a key is a sid and a value is
+    a tuple (status, exit_code, wall_time) where status is 'done', 'failed' or 'skipped' and exit_code is None
+    for skipped commands.
+    """
+    data = parse_datafile(status_path, ('sid', 'status', 'exit_code', 'wall_time'), (str, str, str, float))
+    statuses = {}
+    for sid, status, exit_code, wall_time in zip(data['sid'], data['status'], data['exit_code'], data['wall_time']):
+        statuses[sid] = (status, None if exit_code == 'None' else int(exit_code), wall_time)
+    return statuses
+
+def _time_to_seconds(time):
+    """Converts SGE time limit (seconds or [[hours:]minutes:]seconds) into seconds.
+    """
+    seconds = 0
+    for component in str(time).split(':'):
+        seconds = 60 * seconds + int(component)
+    return seconds
+
+@traced()
+def _render_template(templ_filename, **kwds):
+        from mako.template import Template # imported here since it is slow to import
+        templ_file = open(os.path.join(get_templates_path(), templ_filename), 'r')
+        rendered_data = Template(templ_file.read()).render(**kwds)
+        templ_file.close()
+        return rendered_data
+
+def _render_sge_template(cores, time, commands, unit, after_commands=(), dep_units=()):
+        return _render_template('sge_script.sh', cores=cores, time=time, commands=commands, after_commands=after_commands,
+                                markers_dir=MARKERS_DIR, unit=unit, dep_units=dep_units)
+
+def _wrap_with_markers(command, unit):
+    """Returns the shell command executing command and creating the marker files of unit (including the pid file).
+    """
+    return 'mkdir -p {0} && echo $$ > {0}/{1}.pid && touch {0}/{1}.started; {2}; echo $? > {0}/{1}.exit'.format(MARKERS_DIR, unit, command)
+
+def _make_qsub_command(sge_script_filename, unit):
+    """Returns the shell command submitting sge_script_filename and recording the job id of unit.
+    """
+    return 'mkdir -p {0} && echo "{1} $(qsub -terse {2} | cut -d. -f1)" >> {3}'.format(MARKERS_DIR, unit, sge_script_filename, JOBS_FILENAME)
+
+def _render_runner_script(cores, nodes, status_filename=RUNNER_STATUS_FILENAME):
+        return _render_template('direct_task_runner.py', max_workers=cores, nodes=nodes, status_filename=status_filename)
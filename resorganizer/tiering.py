@@ -0,0 +1,220 @@
+import os
+import os.path
+import shutil
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from resorganizer.aux import file_sha256
+from resorganizer.registry import local_location
+from resorganizer.tracing import in_current_context
+
+SECONDS_IN_DAY = 24 * 60 * 60
+COPY_BLOCK_SIZE = 2**20
+
+class TieringService(object):
+    """TieringService moves tasks between two sources of DistributedStorage: a fast one (hot tier, e.g.
+    main_research_path) and a slow one (cold tier, e.g. storage_research_path). Tasks which have not been
+    touched for max_idle_days are migrated from the hot tier to the cold one, and tasks can be promoted back
+    when they are accessed.
+
+    A task is moved as follows:
+    (1) its dir is copied into a hidden temporary dir next to the destination while computing checksums
+    (2) checksums of the copied files are verified against the original ones
+    (3) the temporary dir is atomically renamed into the task dir
+    (4) the original task dir is removed
+
+    Moves of the same task are serialized by a per-task lock, so a task being demoted in background is promoted
+    only after the demotion is finished (and vice versa). A promoted task is touched so that it is not considered
+    idle right away. Several tasks are moved in parallel by workers threads. If bandwidth_limit (in bytes per 
+    second) is set, the total copying speed of all threads is capped by it. Migration can be run periodically in background
+    via start(). If LocationRegistry is passed, the new locations of moved tasks are recorded in it. If HashCache
+    is passed, the hashes of the files of moved tasks are forgotten.
+    """
+    def __init__(self, distr_storage, hot_index=0, cold_index=1, max_idle_days=30, workers=2, bandwidth_limit=None,
+                 promote_on_access=False, registry=None, hash_cache=None):
+        self.distr_storage = distr_storage
+        self.registry = registry
+        self.hash_cache = hash_cache
+        self.hot_index = hot_index
+        self.cold_index = cold_index
+        self.max_idle_days = max_idle_days
+        self.workers = workers
+        self.promote_on_access = promote_on_access
+        self._limiter = _BandwidthLimiter(bandwidth_limit) if bandwidth_limit is not None else None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._task_locks = {}
+        self._task_locks_lock = threading.Lock()
+
+    def migrate_idle_tasks(self, research_id):
+        """Moves all tasks of research_id which have not been touched for max_idle_days from the hot tier to the cold one.
+        Returns the list of moved task dirs.
+        """
+        hot_research_path = os.path.join(self.distr_storage.storage_paths[self.hot_index], research_id)
+        if not os.path.exists(hot_research_path):
+            return []
+        idle_task_dirs = []
+        for entry in os.scandir(hot_research_path):
+            if entry.is_dir() and entry.name[0].isdigit() and self._is_idle(entry.path):
+                idle_task_dirs.append(entry.name)
+        def demote_if_still_idle(task_dir):
+            # the task may have been accessed or moved since scanning
+            hot_task_path = os.path.join(hot_research_path, task_dir)
+            with self._get_task_lock(research_id, task_dir):
+                if os.path.exists(hot_task_path) and self._is_idle(hot_task_path):
+                    self.demote(research_id, task_dir)
+                    return task_dir
+            return None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return [task_dir for task_dir in executor.map(in_current_context(demote_if_still_idle), idle_task_dirs) if task_dir is not None]
+
+    def demote(self, research_id, task_dir):
+        """Moves task_dir of research_id from the hot tier to the cold one. Returns the new full path to the task dir.
+        """
+        return self._move_task(research_id, task_dir, self.hot_index, self.cold_index)
+
+    def promote(self, research_id, task_dir):
+        """Moves task_dir of research_id from the cold tier to the hot one. Returns the new full path to the task dir.
+        """
+        return self._move_task(research_id, task_dir, self.cold_index, self.hot_index)
+
+    def on_access(self, task_path):
+        """Called when the data of the task located at task_path is accessed. Promotes it if it is located in 
+        the cold tier and promote_on_access is True. Returns the actual full path to the task dir.
+        """
+        cold_path = os.path.normpath(self.distr_storage.storage_paths[self.cold_index])
+        research_path, task_dir = os.path.split(os.path.normpath(task_path))
+        storage_path, research_id = os.path.split(research_path)
+        if not self.promote_on_access or storage_path != cold_path:
+            return task_path
+        return self.promote(research_id, task_dir)
+
+    def start(self, research_ids, interval_sec=SECONDS_IN_DAY):
+        """Starts a background thread calling migrate_idle_tasks() for each of research_ids every interval_sec seconds.
+        """
+        if self._thread is not None:
+            raise Exception('Tiering service is already started')
+        def run():
+            while not self._stop_event.is_set():
+                for research_id in research_ids:
+                    self.migrate_idle_tasks(research_id)
+                self._stop_event.wait(interval_sec)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread started by start() after the current migration is finished.
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def _is_idle(self, task_path):
+        last_touch_time = os.stat(task_path).st_mtime
+        for dirpath, _, filenames in os.walk(task_path):
+            for filename in filenames:
+                st = os.stat(os.path.join(dirpath, filename))
+                last_touch_time = max(last_touch_time, st.st_mtime, st.st_atime)
+        return time.time() - last_touch_time > self.max_idle_days * SECONDS_IN_DAY
+
+    def _get_task_lock(self, research_id, task_dir):
+        with self._task_locks_lock:
+            return self._task_locks.setdefault((research_id, task_dir), threading.RLock())
+
+    def _move_task(self, research_id, task_dir, from_index, to_index):
+        with self._get_task_lock(research_id, task_dir):
+            return self._move_task_locked(research_id, task_dir, from_index, to_index)
+
+    def _move_task_locked(self, research_id, task_dir, from_index, to_index):
+        from_path = os.path.join(self.distr_storage.storage_paths[from_index], research_id, task_dir)
+        to_research_path = os.path.join(self.distr_storage.storage_paths[to_index], research_id)
+        to_path = os.path.join(to_research_path, task_dir)
+        tmp_path = os.path.join(to_research_path, '.{}.tiering'.format(task_dir))
+        if not os.path.exists(from_path) and os.path.exists(to_path): # moved by a concurrent call
+            return to_path
+        if not os.path.exists(from_path):
+            raise Exception("Task dir '{}' does not exist".format(from_path))
+        if os.path.exists(to_path):
+            raise Exception("Task dir '{}' already exists".format(to_path))
+        print('\tMoving {} to {}'.format(from_path, to_path))
+        if os.path.exists(tmp_path): # remains of interrupted move
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        try:
+            size = self._copy_verified_tree(from_path, tmp_path)
+            os.rename(tmp_path, to_path)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        shutil.rmtree(from_path)
+        if self.hash_cache is not None:
+            self.hash_cache.forget(from_path)
+        if to_index == self.hot_index:
+            os.utime(to_path)
+        self.distr_storage.invalidate(os.path.dirname(from_path))
+        self.distr_storage.invalidate(to_research_path)
+        if self.registry is not None:
+            task_number = int(task_dir.split('-')[0])
+            self.registry.forget(research_id, task_number, local_location(self.distr_storage.storage_paths[from_index]))
+            self.registry.record(research_id, task_number, local_location(self.distr_storage.storage_paths[to_index]), to_path, size=size)
+        return to_path
+
+    def _copy_verified_tree(self, from_path, to_path):
+        """Copies the content of from_path into to_path verifying checksums. Returns the total size of copied files.
+        """
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(from_path):
+            rel_dirpath = os.path.relpath(dirpath, from_path)
+            for dirname in list(dirnames):
+                if os.path.islink(os.path.join(dirpath, dirname)):
+                    os.symlink(os.readlink(os.path.join(dirpath, dirname)), os.path.join(to_path, rel_dirpath, dirname))
+                    dirnames.remove(dirname)
+                else:
+                    os.mkdir(os.path.join(to_path, rel_dirpath, dirname))
+            for filename in filenames:
+                from_file = os.path.join(dirpath, filename)
+                to_file = os.path.join(to_path, rel_dirpath, filename)
+                if os.path.islink(from_file):
+                    os.symlink(os.readlink(from_file), to_file)
+                    continue
+                from_hash = self._copy_file(from_file, to_file)
+                if file_sha256(to_file, COPY_BLOCK_SIZE) != from_hash:
+                    raise Exception("Checksum mismatch after copying '{}' to '{}'".format(from_file, to_file))
+                size += os.path.getsize(to_file)
+            shutil.copystat(dirpath, os.path.join(to_path, rel_dirpath))
+        return size
+
+    def _copy_file(self, from_file, to_file):
+        """Copies from_file to to_file respecting the bandwidth limit. Returns sha256 of the copied data.
+        """
+        h = hashlib.sha256()
+        with open(from_file, 'rb') as from_f, open(to_file, 'wb') as to_f:
+            while True:
+                block = from_f.read(COPY_BLOCK_SIZE)
+                if len(block) == 0:
+                    break
+                if self._limiter is not None:
+                    self._limiter.consume(len(block))
+                h.update(block)
+                to_f.write(block)
+        shutil.copystat(from_file, to_file)
+        return h.hexdigest()
+
+class _BandwidthLimiter(object):
+    """Limits the total speed of data transfer in several threads by bytes_per_sec.
+    """
+    def __init__(self, bytes_per_sec):
+        self.bytes_per_sec = bytes_per_sec
+        self._available_at = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, bytes_num):
+        with self._lock:
+            start_time = max(time.time(), self._available_at)
+            self._available_at = start_time + bytes_num / float(self.bytes_per_sec)
+            sleeping_time = self._available_at - time.time()
+        if sleeping_time > 0:
+            time.sleep(sleeping_time)
@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+import contextvars
+from functools import wraps
+
+class Tracer(object):
+    """Tracer measures operations of the library. An operation is represented by a span which has a name,
+    a duration, attributes (e.g., paths) and counters (e.g., bytes transferred and round trips to a remote).
+    Spans can be nested: counters of a finished span are added to the counters of its parent so that,
+    for instance, the span of launch_task contains all bytes transferred while launching the task.
+
+    The stack of active spans is kept in a context variable, so functions run in worker threads via 
+    in_current_context() count into the span active in the submitting thread.
+
+    Finished spans are passed to sinks (see MemorySink, JsonlSink and CallbackSink). Tracing is disabled
+    by default, in this case span() returns a shared no-op object and count() returns immediately so that
+    the overhead is negligible.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.sinks = []
+        self._stack = contextvars.ContextVar('resorganizer_span_stack', default=())
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+        self._counters_lock = threading.Lock() # counters of a span may be updated by several threads
+
+    def enable(self, sinks):
+        """Enables tracing. Finished spans are passed to each of sinks. The sinks of the previous enable() 
+        are closed.
+        """
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = list(sinks)
+        self.enabled = True
+
+    def disable(self):
+        """Disables tracing and closes the sinks.
+        """
+        self.enabled = False
+        for sink in self.sinks:
+            sink.close()
+        self.sinks = []
+
+    def span(self, name, **attrs):
+        """Returns the context manager measuring the operation called name. attrs are stored in the span as is.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, attrs)
+
+    def count(self, counter, value=1):
+        """Adds value to counter of the innermost active span of the current thread.
+        """
+        if not self.enabled:
+            return
+        stack = self._stack.get()
+        if stack:
+            stack[-1].count(counter, value)
+
+    def _push(self, span):
+        stack = self._stack.get()
+        with self._id_lock:
+            self._next_id += 1
+            span.id = self._next_id
+        span.parent_id = stack[-1].id if stack else None
+        self._stack.set(stack + (span,))
+
+    def _pop(self, span):
+        stack = tuple(s for s in self._stack.get() if s is not span)
+        self._stack.set(stack)
+        if stack:
+            with self._counters_lock:
+                counters = dict(span.counters)
+            for counter, value in counters.items():
+                stack[-1].count(counter, value)
+        record = span.to_record()
+        for sink in self.sinks:
+            sink.emit(record)
+
+class Span(object):
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.counters = {}
+        self.id = None
+        self.parent_id = None
+        self.start_time = None
+        self.duration = None
+        self.error = None
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start_time = time.time()
+        self._start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._start_counter
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer._pop(self)
+        return False
+
+    def count(self, counter, value=1):
+        with self.tracer._counters_lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_record(self):
+        return {
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration': self.duration,
+            'thread': threading.current_thread().name,
+            'attrs': dict((key, value if isinstance(value, (int, float, bool, type(None))) else str(value))
+                          for key, value in self.attrs.items()),
+            'counters': self._copy_counters(),
+            'error': self.error,
+        }
+
+    def _copy_counters(self):
+        with self.tracer._counters_lock:
+            return dict(self.counters)
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def count(self, counter, value=1):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class MemorySink(object):
+    """MemorySink keeps finished spans (as dictionaries) in records and can summarize them.
+    """
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def close(self):
+        pass
+
+    def summary(self):
+        """Returns a dictionary where a key is the name of operation and a value is a dictionary containing
+        calls (the number of spans), total_time, mean_time, max_time (in seconds), errors and the sums of counters.
+        """
+        summary = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            op = summary.setdefault(record['name'], {'calls': 0, 'total_time': 0., 'max_time': 0., 'errors': 0})
+            op['calls'] += 1
+            op['total_time'] += record['duration']
+            op['max_time'] = max(op['max_time'], record['duration'])
+            op['errors'] += record['error'] is not None
+            for counter, value in record['counters'].items():
+                op[counter] = op.get(counter, 0) + value
+        for op in summary.values():
+            op['mean_time'] = op['total_time'] / op['calls']
+        return summary
+
+    def report(self):
+        """Returns the summary (see summary()) as a text table sorted by total time.
+        """
+        summary = self.summary()
+        counters = sorted(set(key for op in summary.values() for key in op) -
+                          set(('calls', 'total_time', 'mean_time', 'max_time', 'errors')))
+        header = ['operation', 'calls', 'total_s', 'mean_s', 'max_s', 'errors'] + counters
+        rows = [header]
+        for name, op in sorted(summary.items(), key=lambda item: -item[1]['total_time']):
+            rows.append([name, str(op['calls']), '{:.4f}'.format(op['total_time']), '{:.4f}'.format(op['mean_time']),
+                         '{:.4f}'.format(op['max_time']), str(op['errors'])] + [str(op.get(c, 0)) for c in counters])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+class JsonlSink(object):
+    """JsonlSink appends finished spans to the file path, one json object per line.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class CallbackSink(object):
+    """CallbackSink calls func(record) for each finished span.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def emit(self, record):
+        self.func(record)
+
+    def close(self):
+        pass
+
+tracer = Tracer()
+
+def in_current_context(func):
+    """Returns the function calling func in a copy of the current context so that spans opened and counters 
+    updated by func in another thread (e.g., in a worker of an executor) are attributed to the span active here.
+    func is returned as is if tracing is disabled.
+    """
+    if not tracer.enabled:
+        return func
+    context = contextvars.copy_context()
+    @wraps(func)
+    def wrapped_func(*args, **kwds):
+        return context.copy().run(func, *args, **kwds) # a context cannot be entered by several threads at once
+    return wrapped_func
+
+def traced(name=None):
+    """Decorator wrapping a function (or a method) into the span called name (the qualified name of
+    the function by default).
+    """
+    def decorator(func):
+        span_name = name if name is not None else func.__qualname__
+        @wraps(func)
+        def wrapped_func(*args, **kwds):
+            if not tracer.enabled:
+                return func(*args, **kwds)
+            with Span(tracer, span_name, {}):
+                return func(*args, **kwds)
+        return wrapped_func
+    return decorator
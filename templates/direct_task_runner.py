@@ -0,0 +1,68 @@
+import subprocess
+import sys
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# each node is (sid, command, sids of nodes which must be successfully finished beforehand)
+nodes = [
+% for sid, cmd, deps in nodes:
+    (${repr(sid)}, ${repr(cmd)}, ${repr(list(deps))}),
+% endfor
+]
+max_workers = ${repr(max_workers)}
+status_filename = ${repr(status_filename)}
+
+def run_command(sid, cmd):
+    start_time = time.time()
+    log = open('{}.log'.format(sid), 'w')
+    exit_code = subprocess.call(cmd, shell=True, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    return exit_code, time.time() - start_time
+
+def record_status(sid, status, exit_code, wall_time):
+    status_file.write('{} {} {} {:.3f}\n'.format(sid, status, exit_code, wall_time))
+    status_file.flush()
+
+if max_workers is None:
+    max_workers = os.cpu_count() or 1
+cmds = dict((sid, cmd) for sid, cmd, _ in nodes)
+deps = dict((sid, set(deps_)) for sid, _, deps_ in nodes)
+pending = [sid for sid, _, _ in nodes]
+finished = set()
+failed = set()
+running = {}
+
+status_file = open(status_filename, 'w')
+status_file.write('sid status exit_code wall_time_sec\n')
+status_file.flush()
+pool = ThreadPoolExecutor(max_workers=max_workers)
+while len(pending) != 0 or len(running) != 0:
+    # nodes depending on failed ones will never be launched
+    for sid in [sid for sid in pending if len(deps[sid] & failed) != 0]:
+        pending.remove(sid)
+        failed.add(sid)
+        record_status(sid, 'skipped', None, 0.)
+    # submit all ready nodes at once, the pool bounds the number of simultaneously running commands
+    for sid in [sid for sid in pending if deps[sid] <= finished]:
+        pending.remove(sid)
+        running[pool.submit(run_command, sid, cmds[sid])] = sid
+    if len(running) == 0:
+        # remaining nodes depend on something we do not have
+        for sid in pending:
+            failed.add(sid)
+            record_status(sid, 'skipped', None, 0.)
+        break
+    done_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+    for future in done_futures:
+        sid = running.pop(future)
+        exit_code, wall_time = future.result()
+        if exit_code == 0:
+            finished.add(sid)
+            record_status(sid, 'done', exit_code, wall_time)
+        else:
+            failed.add(sid)
+            record_status(sid, 'failed', exit_code, wall_time)
+pool.shutdown()
+status_file.close()
+sys.exit(0 if len(failed) == 0 else 1)
@@ -7,6 +7,13 @@ sge_filenames = [
     '${sge}',
 % endfor
 ]
+# units corresponding to sge_filenames, their job ids are recorded in jobs_filename
+units = [
+% for unit in units:
+    '${unit}',
+% endfor
+]
+jobs_filename = '${jobs_filename}'
 
 log = open('handler.log', 'a')
 log.write(16 * '-' + '\n')
@@ -26,9 +33,16 @@ while len(sge_filenames) != 0:
             avail_sge_tasks = len(sge_filenames)
         log.write('can launch ' + str(avail_sge_tasks) + ' tasks\n')
         for i in range(avail_sge_tasks):
-            subprocess.call(['qsub', sge_filenames[i]])
+            p = subprocess.Popen(['qsub', '-terse', sge_filenames[i]], stdout=subprocess.PIPE)
+            job_id = p.communicate()[0].decode().strip().split('.')[0]
+            if not os.path.exists(os.path.dirname(jobs_filename)):
+                os.makedirs(os.path.dirname(jobs_filename))
+            jobs_file = open(jobs_filename, 'a')
+            jobs_file.write('{} {}\n'.format(units[i], job_id))
+            jobs_file.close()
         log.write('delete tasks ' + str(sge_filenames[:avail_sge_tasks]) + '\n')
         del sge_filenames[:avail_sge_tasks]
+        del units[:avail_sge_tasks]
     log.close()
     time.sleep(${sleeping_time_sec})
 log = open('handler.log', 'a')
@@ -0,0 +1,11 @@
+#!/bin/sh
+mkdir -p ${markers_dir}
+% for var, hold_vars, sge, unit in jobs:
+% if len(hold_vars) != 0:
+${var}=$(qsub -terse -hold_jid ${','.join('$' + v for v in hold_vars)} ${sge} | cut -d. -f1)
+% else:
+${var}=$(qsub -terse ${sge} | cut -d. -f1)
+% endif
+echo "${unit} $${var}" >> ${jobs_filename}
+echo "${sge} $${var}"
+% endfor
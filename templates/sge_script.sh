@@ -1,6 +1,15 @@
 #$ -cwd -V
 #$ -l h_rt=${time}
 #$ -pe smp ${cores}
+mkdir -p ${markers_dir} && touch ${markers_dir}/${unit}.started
+% for dep_unit in dep_units:
+if [ "$(cat ${markers_dir}/${dep_unit}.exit 2> /dev/null)" != "0" ]; then echo skipped > ${markers_dir}/${unit}.exit; exit 0; fi
+% endfor
+exit_code=0
 % for cmd in commands:
+${cmd} || exit_code=$?
+% endfor
+echo $exit_code > ${markers_dir}/${unit}.exit
+% for cmd in after_commands:
 ${cmd}
-% endfor
\ No newline at end of file
+% endfor
@@ -0,0 +1,244 @@
+"""Loopback ssh server used as a local stand-in for a remote in benchmarks.
+
+The server is an in-process paramiko server accepting any password. It supports exec requests (commands
+are run by the local shell) and the sftp subsystem (paths are mapped onto the local filesystem as is).
+Clients connect through a proxy injecting one-way latency and limiting bandwidth so that the costs of
+round trips and data transfers can be emulated.
+"""
+import os
+import socket
+import subprocess
+import threading
+import time
+import collections
+import paramiko
+
+class LoopbackSshServer(object):
+    """Starts the ssh server and the proxy in background threads. Clients must connect to port.
+    latency is one-way latency in seconds, bandwidth is in bytes per second (None means unlimited).
+    """
+    def __init__(self, latency=0., bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._server_sock = _listen()
+        self._proxy_sock = _listen()
+        self.port = self._proxy_sock.getsockname()[1]
+        self._transports = []
+        self._closed = False
+        for target in (self._accept_ssh, self._accept_proxy):
+            threading.Thread(target=target, daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        for transport in self._transports:
+            transport.close()
+        self._server_sock.close()
+        self._proxy_sock.close()
+
+    def _accept_ssh(self):
+        while not self._closed:
+            try:
+                client_sock, _ = self._server_sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client_sock)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _LocalSftpInterface)
+            transport.start_server(server=_ServerInterface())
+            self._transports.append(transport)
+
+    def _accept_proxy(self):
+        while not self._closed:
+            try:
+                client_sock, _ = self._proxy_sock.accept()
+            except OSError:
+                return
+            server_sock = socket.create_connection(self._server_sock.getsockname())
+            for from_sock, to_sock in ((client_sock, server_sock), (server_sock, client_sock)):
+                _DelayedPipe(from_sock, to_sock, self.latency, self.bandwidth)
+
+def _listen():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    return sock
+
+class _DelayedPipe(object):
+    """Forwards data from from_sock to to_sock delivering each piece of data latency seconds after it is
+    received plus the time needed to transfer it with bandwidth.
+    """
+    def __init__(self, from_sock, to_sock, latency, bandwidth):
+        self.from_sock = from_sock
+        self.to_sock = to_sock
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._link_free_at = 0.
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                data = self.from_sock.recv(2**16)
+            except OSError:
+                data = b''
+            now = time.time()
+            if self.bandwidth is not None and len(data) != 0:
+                self._link_free_at = max(now, self._link_free_at) + len(data) / float(self.bandwidth)
+                deliver_at = self._link_free_at + self.latency
+            else:
+                deliver_at = now + self.latency
+            with self._cond:
+                self._queue.append((deliver_at, data))
+                self._cond.notify()
+            if len(data) == 0:
+                return
+
+    def _write(self):
+        while True:
+            with self._cond:
+                while len(self._queue) == 0:
+                    self._cond.wait()
+                deliver_at, data = self._queue.popleft()
+            delay = deliver_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                if len(data) == 0:
+                    self.to_sock.shutdown(socket.SHUT_WR)
+                    return
+                self.to_sock.sendall(data)
+            except OSError:
+                return
+
+class _ServerInterface(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_run_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+def _run_command(channel, command):
+    p = subprocess.Popen(command, shell=True, executable='/bin/bash', stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def feed_stdin():
+        while True:
+            data = channel.recv(2**16)
+            if len(data) == 0:
+                break
+            p.stdin.write(data)
+        p.stdin.close()
+    def forward_stderr():
+        for data in iter(lambda: p.stderr.read1(2**16), b''):
+            channel.sendall_stderr(data)
+    threads = [threading.Thread(target=feed_stdin, daemon=True), threading.Thread(target=forward_stderr, daemon=True)]
+    for thread in threads:
+        thread.start()
+    for data in iter(lambda: p.stdout.read1(2**16), b''):
+        channel.sendall(data)
+    threads[1].join()
+    channel.send_exit_status(p.wait())
+    channel.close()
+
+class _LocalSftpHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+class _LocalSftpInterface(paramiko.SFTPServerInterface):
+    def canonicalize(self, path):
+        return os.path.normpath(path if os.path.isabs(path) else os.path.join(os.getcwd(), path))
+
+    def list_folder(self, path):
+        try:
+            return [self._attrs(os.path.join(path, name), name) for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        try:
+            mode = getattr(attr, 'st_mode', None) or 0o666
+            fd = os.open(path, flags | getattr(os, 'O_BINARY', 0), mode)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            fstr = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            fstr = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            fstr = 'rb'
+        f = os.fdopen(fd, fstr)
+        handle = _LocalSftpHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, path)
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(newpath):
+            return paramiko.SFTP_FAILURE
+        return self._call(os.rename, oldpath, newpath)
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.rename, oldpath, newpath)
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, path)
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, path)
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+    def symlink(self, target_path, path):
+        return self._call(os.symlink, target_path, path)
+
+    def readlink(self, path):
+        try:
+            return os.readlink(path)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def _attrs(self, path, name):
+        attrs = paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        attrs.filename = name
+        return attrs
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
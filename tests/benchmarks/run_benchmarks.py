@@ -0,0 +1,236 @@
+"""Benchmark suite measuring the throughput of the main operations of the library against a loopback ssh server
+(see loopback_ssh.py) emulating a remote with the given latency and bandwidth:
+(1) launch -- launching tasks with input files on the remote (tasks per second)
+(2) grab -- grabbing the results of tasks from the remote (tasks and megabytes per second)
+(3) lookup -- looking up task paths in a research with thousands of tasks (microseconds per lookup)
+(4) parse -- parsing numerical data files (megabytes per second)
+
+Results are saved into a json file. If a baseline file is passed via --compare, the results are compared with it
+and regressions exceeding --tolerance are reported (the exit code is 1 then).
+
+Example:
+    python run_benchmarks.py --latency 0.005 --bandwidth 10e6 --output results.json
+    python run_benchmarks.py --latency 0.005 --bandwidth 10e6 --compare results.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import shutil
+import contextlib
+from datetime import datetime
+parent_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(parent_dir)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import numpy as np
+import resorganizer.settings as rset
+from resorganizer.communication import SshCommunication, RemoteHost
+from resorganizer.research import Research
+from resorganizer.task import Command, CommandTask
+from resorganizer.task_execution import DirectExecution
+from resorganizer.aux import parse_numdatafile, parse_datafile
+from resorganizer.distributed_storage import MTIME_RESOLUTION_SEC
+from loopback_ssh import LoopbackSshServer
+
+# for each metric, True means that the bigger value is the better one
+METRICS = {
+    'launch_tasks_per_sec': True,
+    'grab_tasks_per_sec': True,
+    'grab_mb_per_sec': True,
+    'lookup_cold_us': False,
+    'lookup_warm_us': False,
+    'lookup_warm_p99_us': False,
+    'parse_numdatafile_mb_per_sec': True,
+    'parse_datafile_mb_per_sec': True,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of research-organizer')
+    parser.add_argument('--latency', type=float, default=0.002, help='one-way latency of the emulated remote in seconds')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bandwidth of the emulated remote in bytes per second')
+    parser.add_argument('--tasks', type=int, default=100, help='number of tasks to launch and grab')
+    parser.add_argument('--files-per-task', type=int, default=10, help='number of result files per task')
+    parser.add_argument('--file-size', type=int, default=2**16, help='size of result files in bytes')
+    parser.add_argument('--lookup-tasks', type=int, default=5000, help='number of tasks in the research used for lookups')
+    parser.add_argument('--parse-rows', type=int, default=200000, help='number of rows in the parsed data file')
+    parser.add_argument('--only', nargs='*', default=None, choices=('launch', 'grab', 'lookup', 'parse'), help='benchmarks to run')
+    parser.add_argument('--output', default=None, help='json file to save results into')
+    parser.add_argument('--compare', default=None, help='json file with baseline results')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative degradation considered as a regression')
+    args = parser.parse_args()
+
+    args.output, args.compare = [os.path.abspath(path) if path is not None else None for path in (args.output, args.compare)]
+    work_dir = tempfile.mkdtemp(prefix='rso_bench_')
+    cwd = os.getcwd()
+    os.chdir(work_dir) # artifacts written into the current dir (e.g., logs) are removed together with work_dir
+    try:
+        results = run(args, work_dir)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report = {
+        'date': datetime.now().isoformat(),
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'results': results,
+    }
+    for metric, value in sorted(results.items()):
+        print('{:32}{:>14.3f}'.format(metric, value))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if not compare(baseline['results'], results, args.tolerance):
+            sys.exit(1)
+
+def run(args, work_dir):
+    for name in ('main', 'storage', 'remote', 'bin'):
+        os.mkdir(os.path.join(work_dir, name))
+    rset.LOCAL_HOST.update({
+        'machine_name': 'bench',
+        'host_relative_data_path': os.path.join(work_dir, 'bin'),
+        'main_research_path': os.path.join(work_dir, 'main'),
+        'storage_research_path': os.path.join(work_dir, 'storage'),
+    })
+    only = args.only if args.only is not None else ('launch', 'grab', 'lookup', 'parse')
+    results = {}
+    if 'launch' in only or 'grab' in only:
+        server = LoopbackSshServer(latency=args.latency, bandwidth=args.bandwidth)
+        try:
+            results.update(bench_remote(args, work_dir, server, only))
+        finally:
+            server.close()
+    if 'lookup' in only:
+        results.update(bench_lookup(args, work_dir))
+    if 'parse' in only:
+        results.update(bench_parse(args, work_dir))
+    return results
+
+def bench_remote(args, work_dir, server, only):
+    remote_host = RemoteHost('127.0.0.1', 1, os.path.join(work_dir, 'bin'), os.path.join(work_dir, 'remote'))
+    with quiet():
+        comm = SshCommunication(remote_host, 'bench', 'bench', port=server.port)
+        res = _start_research('bench_remote', comm)
+    input_path = os.path.join(work_dir, 'input.dat')
+    with open(input_path, 'wb') as f:
+        f.write(os.urandom(args.file_size))
+    # the program generates result files so that they can be grabbed afterwards
+    program_path = os.path.join(work_dir, 'bin', 'gen.sh')
+    with open(program_path, 'w') as f:
+        f.write('#!/bin/sh\nfor i in $(seq $1); do head -c $2 /dev/urandom > result_$i.dat; done\n')
+    os.chmod(program_path, 0o755)
+    task = CommandTask(Command('gen.sh'), prog='gen.sh')
+    task.set_input(input_path)
+    task.set_substitution('bench', trailing_args=[str(args.files_per_task), str(args.file_size)])
+    results = {}
+
+    start_time = time.perf_counter()
+    with quiet():
+        task_numbers = []
+        for i in range(args.tasks):
+            task_exec = DirectExecution()
+            task_exec.set_alone_task(task)
+            task_numbers.append(res.launch_task(task_exec, 'bench_{}'.format(i)))
+    elapsed = time.perf_counter() - start_time
+    if 'launch' in only:
+        results['launch_tasks_per_sec'] = args.tasks / elapsed
+
+    if 'grab' in only:
+        start_time = time.perf_counter()
+        with quiet():
+            for task_number in task_numbers:
+                res.grab_task_results(task_number)
+        elapsed = time.perf_counter() - start_time
+        grabbed_size = args.tasks * (args.files_per_task + 1) * args.file_size
+        results['grab_tasks_per_sec'] = args.tasks / elapsed
+        results['grab_mb_per_sec'] = grabbed_size / elapsed / 2**20
+    comm.disconnect()
+    return results
+
+def bench_lookup(args, work_dir):
+    with quiet():
+        res = _start_research('bench_lookup')
+    # tasks are distributed among both sources of the distributed storage
+    for task_number in range(1, args.lookup_tasks + 1):
+        storage_path = rset.LOCAL_HOST['main_research_path'] if task_number % 2 else rset.LOCAL_HOST['storage_research_path']
+        task_dir = os.path.join(storage_path, res._research_id, '{}-task_{}'.format(task_number, task_number))
+        os.makedirs(task_dir)
+        open(os.path.join(task_dir, 'data.dat'), 'w').close()
+    # listings of dirs modified just now are not cached, so wait to measure the steady state
+    time.sleep(MTIME_RESOLUTION_SEC)
+    with quiet():
+        res = Research.continue_research(res._research_id)
+    random.seed(0)
+    task_numbers = [random.randint(1, args.lookup_tasks) for _ in range(1000)]
+
+    cold_times = []
+    for task_number in task_numbers[:100]:
+        res._distr_storage.invalidate()
+        start_time = time.perf_counter()
+        res.get_task_path(task_number)
+        cold_times.append(time.perf_counter() - start_time)
+    warm_times = []
+    for task_number in task_numbers:
+        start_time = time.perf_counter()
+        res.get_task_path(task_number)
+        warm_times.append(time.perf_counter() - start_time)
+    return {
+        'lookup_cold_us': 1e6 * float(np.mean(cold_times)),
+        'lookup_warm_us': 1e6 * float(np.mean(warm_times)),
+        'lookup_warm_p99_us': 1e6 * float(np.percentile(warm_times, 99)),
+    }
+
+def bench_parse(args, work_dir):
+    path = os.path.join(work_dir, 'data.dat')
+    data = np.random.RandomState(0).rand(args.parse_rows, 8)
+    np.savetxt(path, data, header=' '.join('col_{}'.format(i) for i in range(8)), comments='')
+    size_mb = os.path.getsize(path) / 2**20
+    results = {}
+    start_time = time.perf_counter()
+    parse_numdatafile(path)
+    results['parse_numdatafile_mb_per_sec'] = size_mb / (time.perf_counter() - start_time)
+    start_time = time.perf_counter()
+    parse_datafile(path, ['col_{}'.format(i) for i in range(8)], [float] * 8)
+    results['parse_datafile_mb_per_sec'] = size_mb / (time.perf_counter() - start_time)
+    return results
+
+def compare(baseline, results, tolerance):
+    """Prints the comparison of results with baseline. Returns False if some metric has degraded by more than tolerance.
+    """
+    ok = True
+    print('\n{:32}{:>14}{:>14}{:>10}'.format('metric', 'baseline', 'current', 'change'))
+    for metric, bigger_is_better in sorted(METRICS.items()):
+        if metric not in baseline or metric not in results:
+            continue
+        change = (results[metric] - baseline[metric]) / baseline[metric]
+        degradation = -change if bigger_is_better else change
+        mark = ''
+        if degradation > tolerance:
+            mark = '  REGRESSION'
+            ok = False
+        print('{:32}{:>14.3f}{:>14.3f}{:>+9.1f}%{}'.format(metric, baseline[metric], results[metric], 100 * change, mark))
+    return ok
+
+def _start_research(name, comm=None):
+    res = Research.start_research(name, comm)
+    # tasks are created in main_research_path whereas a new research dir appears in the prior storage
+    main_research_path = os.path.join(rset.LOCAL_HOST['main_research_path'], res._research_id)
+    if not os.path.exists(main_research_path):
+        os.mkdir(main_research_path)
+    return res
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import io
+import tempfile
+import shutil
+import unittest
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+import numpy as np
+from resorganizer.aux import parse_numdatafile, parse_timed_numdatafile, iter_numdatafile_chunks, InconsistentColumns
+
+class NumDataFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, content):
+        path = os.path.join(self.tmp_dir, 'data.dat')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_parses_table(self):
+        path = self._write('a b c\n0 1 2\n\n3 4 5\n  6 7 8  \n')
+        np.testing.assert_array_equal(parse_numdatafile(path), np.arange(9.).reshape((3, 3)))
+
+    def test_parses_last_line_without_newline(self):
+        path = self._write('a b c\n0 1 2\n3 4 5')
+        np.testing.assert_array_equal(parse_numdatafile(path), np.arange(6.).reshape((2, 3)))
+
+    def test_ragged_rows_with_divisible_total_are_rejected(self):
+        # 9 values can be reshaped into 3x3, but the rows have 3, 2 and 4 values
+        path = self._write('a b c\n0 1 2\n1 2\n3 4 5 6\n')
+        self.assertRaises(InconsistentColumns, parse_numdatafile, path)
+
+    def test_ragged_rows_are_rejected_in_file_objects(self):
+        source = io.BytesIO(b'a b c\n0 1 2\n1 2\n3 4 5 6\n')
+        self.assertRaises(InconsistentColumns, list, iter_numdatafile_chunks(source))
+
+    def test_ragged_rows_across_blocks_are_rejected(self):
+        path = self._write('a b\n' + '0 1\n' * 1000 + '0 1 2 3\n' + '0 1\n' * 1000)
+        self.assertRaises(InconsistentColumns, list, iter_numdatafile_chunks(path, block_size=64))
+
+    def test_chunks_cover_whole_file(self):
+        path = self._write('a b\n' + ''.join('{} {}\n'.format(i, 2 * i) for i in range(1000)))
+        chunks = list(iter_numdatafile_chunks(path, chunk_rows=64, block_size=100))
+        self.assertTrue(all(len(chunk) == 64 for chunk in chunks[:-1]))
+        np.testing.assert_array_equal(np.concatenate(chunks)[:, 1], 2 * np.arange(1000.))
+
+    def test_timed_datafile_with_ragged_rows(self):
+        path = self._write('t x\n0 1 2\n1 2\n3 4 5 6\n')
+        time, data = parse_timed_numdatafile(path)
+        self.assertEqual(time, [0., 1., 3.])
+        self.assertEqual([row.tolist() for row in data], [[1., 2.], [2.], [4., 5., 6.]])
+        self.assertRaises(InconsistentColumns, parse_timed_numdatafile, path, as_array=True)
+
+    def test_timed_datafile_as_array(self):
+        path = self._write('t x y\n0 1 2\n1 3 4\n')
+        time, data = parse_timed_numdatafile(path, as_array=True)
+        np.testing.assert_array_equal(time, [0., 1.])
+        np.testing.assert_array_equal(data, [[1., 2.], [3., 4.]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import io
+import unittest
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+import numpy as np
+import resorganizer.backup as backup
+from resorganizer.backup import iter_chunks
+
+class IterChunksTest(unittest.TestCase):
+    def setUp(self):
+        self.data = np.random.default_rng(0).integers(0, 256, 200000, dtype=np.uint8).tobytes()
+        self.block_sizes = (backup.READ_BLOCK_SIZE, backup.CUT_SEARCH_BLOCK_SIZE)
+
+    def tearDown(self):
+        backup.READ_BLOCK_SIZE, backup.CUT_SEARCH_BLOCK_SIZE = self.block_sizes
+
+    def chunk(self, data, read_block_size, cut_search_block_size):
+        backup.READ_BLOCK_SIZE, backup.CUT_SEARCH_BLOCK_SIZE = read_block_size, cut_search_block_size
+        return list(iter_chunks(io.BytesIO(data), min_size=256, avg_size=2048, max_size=8192))
+
+    def test_boundaries_do_not_depend_on_block_sizes(self):
+        expected = self.chunk(self.data, 2**20, 2**20)
+        self.assertEqual(b''.join(expected), self.data)
+        self.assertGreater(len(expected), 20)
+        for read_block_size, cut_search_block_size in ((1000, 100), (4096, 4096), (7919, 1000)):
+            self.assertEqual(self.chunk(self.data, read_block_size, cut_search_block_size), expected)
+
+    def test_insertion_changes_few_chunks(self):
+        chunks = self.chunk(self.data, 4096, 1000)
+        changed_chunks = self.chunk(self.data[:100000] + b'inserted' + self.data[100000:], 4096, 1000)
+        self.assertLessEqual(len(set(changed_chunks) - set(chunks)), 2)
@@ -0,0 +1,87 @@
+import os
+import sys
+import io
+import shlex
+import tempfile
+import shutil
+import contextlib
+import unittest
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+from resorganizer.communication import LocalCommunication, RM_MANY_SCRIPT
+
+class RmManyTest(unittest.TestCase):
+    """Checks both the local removal and the script used for the remote one (run locally).
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.comm = LocalCommunication(None)
+        self.dirs = []
+        for task_dir in ('1-a[1]', '2-a1'):
+            self.dirs.append(os.path.join(self.tmp_dir, task_dir))
+            for rel_path, size in (('sub/x.h5', 10), ('sub/y.h5', 20), ('z.h5', 30), ('keep.dat', 40)):
+                path = os.path.join(self.dirs[-1], rel_path)
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as f:
+                    f.write(b'0' * size)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _rm_many_local(self, dirs, patterns):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.comm.rm_many(dirs, patterns)
+
+    def _rm_many_by_script(self, dirs, patterns, script_prefix=''):
+        exit_status, stdout_data, stderr_data = self.comm.execute_and_read('bash -c %s bash %s' % (shlex.quote(script_prefix + RM_MANY_SCRIPT), 
+            ' '.join(shlex.quote(pattern) for pattern in patterns)), stdin_data=b''.join(d.encode() + b'\0' for d in dirs), 
+            printing=False)
+        self.assertEqual(exit_status, 0, stderr_data)
+        return int(stdout_data.decode().split()[-1])
+
+    def _list(self, dir_):
+        return sorted(os.path.relpath(os.path.join(dirpath, filename), dir_) 
+                      for dirpath, _, filenames in os.walk(dir_) for filename in filenames)
+
+    def test_overlapping_patterns(self):
+        self.assertEqual(self._rm_many_local(self.dirs[:1], ['sub', 'sub/*.h5', '*.h5', 'z.h5']), 60)
+        self.assertEqual(self._list(self.dirs[0]), ['keep.dat'])
+        self.assertEqual(self._list(self.dirs[1]), ['keep.dat', 'sub/x.h5', 'sub/y.h5', 'z.h5'])
+
+    def test_overlapping_patterns_by_script(self):
+        self.assertGreaterEqual(self._rm_many_by_script(self.dirs[:1], ['sub', 'sub/*.h5', '*.h5', 'z.h5']), 60)
+        self.assertEqual(self._list(self.dirs[0]), ['keep.dat'])
+        self.assertEqual(self._list(self.dirs[1]), ['keep.dat', 'sub/x.h5', 'sub/y.h5', 'z.h5'])
+
+    def test_dot_dirs_are_not_matched_by_script(self):
+        for rel_path in ('.hidden', 'sub/.hidden'):
+            with open(os.path.join(self.dirs[0], rel_path), 'wb') as f:
+                f.write(b'0')
+        # bash before 5.2 expands .* to . and .. as well
+        self._rm_many_by_script(self.dirs[:1], ['.*', 'sub/.*'], script_prefix='shopt -u globskipdots 2>/dev/null\n')
+        self.assertEqual(self._list(self.dirs[0]), ['keep.dat', 'sub/x.h5', 'sub/y.h5', 'z.h5'])
+        self.assertEqual(self._list(self.dirs[1]), ['keep.dat', 'sub/x.h5', 'sub/y.h5', 'z.h5'])
+
+    def test_dirs_are_not_expanded(self):
+        # '1-a[1]' would match '1-a1' if it were a glob pattern
+        os.rename(self.dirs[1], os.path.join(self.tmp_dir, '1-a1'))
+        for rm_many in (self._rm_many_local, self._rm_many_by_script):
+            with open(os.path.join(self.dirs[0], 'z.h5'), 'wb') as f:
+                f.write(b'0')
+            rm_many(self.dirs[:1], ['z.h5'])
+            self.assertEqual(self._list(self.dirs[0]), ['keep.dat', 'sub/x.h5', 'sub/y.h5'])
+            self.assertEqual(self._list(os.path.join(self.tmp_dir, '1-a1')), ['keep.dat', 'sub/x.h5', 'sub/y.h5', 'z.h5'])
+
+    def test_missing_dirs_and_targets_are_skipped(self):
+        missing_dir = os.path.join(self.tmp_dir, '3-missing')
+        self.assertEqual(self._rm_many_local([missing_dir] + self.dirs, ['nothing', 'z.h5']), 60)
+        self.assertEqual(self._rm_many_by_script([missing_dir] + self.dirs, ['nothing', 'z.h5']), 0)
+
+    def test_dangerous_patterns_are_rejected(self):
+        for pattern in ('', '.', './', 'sub/..', '../2-a1', '/etc', 'sub/../..'):
+            self.assertRaises(Exception, self._rm_many_local, self.dirs, [pattern])
+        self.assertEqual(self._list(self.dirs[0]), ['keep.dat', 'sub/x.h5', 'sub/y.h5', 'z.h5'])
+
+if __name__ == '__main__':
+    unittest.main()
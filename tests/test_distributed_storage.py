@@ -0,0 +1,54 @@
+import os
+import sys
+import io
+import time
+import threading
+import tempfile
+import shutil
+import contextlib
+import unittest
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+from resorganizer.distributed_storage import DistributedStorage, StorageSourceUnavailable
+
+class SourceTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sources = [os.path.join(self.tmp_dir, name) for name in ('fast', 'slow')]
+        for source in self.sources:
+            os.makedirs(os.path.join(source, 'common'))
+        os.mkdir(os.path.join(self.sources[1], 'only_slow'))
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        shutil.rmtree(self.tmp_dir)
+
+    def _lookup(self, dir_path):
+        if dir_path.startswith(self.sources[1]):
+            self.release.wait()
+        return dir_path, dir_path
+
+    def test_sources_are_queried_inline_without_timeout(self):
+        storage = DistributedStorage(self.sources)
+        threads = set()
+        storage.lookup_through_dir('common', lambda dir_path: threads.add(threading.get_ident()) or (dir_path, dir_path))
+        self.assertEqual(threads, set((threading.get_ident(),)))
+
+    def test_absence_is_not_reported_while_source_is_degraded(self):
+        storage = DistributedStorage(self.sources, source_timeout=0.1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertRaises(StorageSourceUnavailable, storage.lookup_through_dir, 'only_slow', self._lookup)
+            self.assertEqual(storage.get_degraded_sources(), [self.sources[1]])
+            # found in the available source, so the degraded one does not matter
+            self.assertEqual(storage.lookup_through_dir('common', self._lookup)[0], os.path.join(self.sources[0], 'common'))
+            self.assertRaises(StorageSourceUnavailable, storage.get_dir_path, 'absent')
+        self.release.set()
+        deadline = time.time() + 5.
+        while storage.get_degraded_sources() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(storage.get_dir_path('absent'), None)
+        self.assertEqual(storage.lookup_through_dir('only_slow', self._lookup)[0], os.path.join(self.sources[1], 'only_slow'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import shutil
+import unittest
+from functools import partial
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+import numpy as np
+from resorganizer.aux import parse_numdatafile
+from resorganizer.parse_cache import ParseCache
+
+def take_column(path, col):
+    return parse_numdatafile(path)[:, col]
+
+def make_column_parser(col):
+    return lambda path: parse_numdatafile(path)[:, col]
+
+COL = 0
+
+def take_global_column(path):
+    return parse_numdatafile(path)[:, COL]
+
+class Opaque(object):
+    pass
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'data.dat')
+        np.savetxt(self.path, np.arange(12.).reshape((4, 3)), header='a b c', comments='')
+        self.cache = ParseCache(os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_different_lambdas_do_not_share_results(self):
+        col_0 = self.cache.parse(lambda p: parse_numdatafile(p)[:, 0], self.path)
+        col_1 = self.cache.parse(lambda p: parse_numdatafile(p)[:, 1], self.path)
+        np.testing.assert_array_equal(col_0, [0., 3., 6., 9.])
+        np.testing.assert_array_equal(col_1, [1., 4., 7., 10.])
+
+    def test_closures_are_distinguished_by_their_values(self):
+        np.testing.assert_array_equal(self.cache.parse(make_column_parser(0), self.path), [0., 3., 6., 9.])
+        np.testing.assert_array_equal(self.cache.parse(make_column_parser(2), self.path), [2., 5., 8., 11.])
+
+    def test_partials_hit_and_are_distinguished(self):
+        first = self.cache.parse(partial(take_column, col=1), self.path)
+        second = self.cache.parse(partial(take_column, col=1), self.path)
+        self.assertIsInstance(second, np.memmap) # loaded from the cache
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_array_equal(self.cache.parse(partial(take_column, col=2), self.path), [2., 5., 8., 11.])
+
+    def test_callable_arguments_are_distinguished(self):
+        func = lambda path, transform: transform(parse_numdatafile(path))
+        negated = self.cache.call(func, (self.path,), self.path, lambda x: -x)
+        doubled = self.cache.call(func, (self.path,), self.path, lambda x: 2 * x)
+        np.testing.assert_array_equal(doubled, -2 * negated)
+
+    def test_changed_globals_invalidate_results(self):
+        global COL
+        np.testing.assert_array_equal(self.cache.parse(take_global_column, self.path), [0., 3., 6., 9.])
+        COL = 1
+        try:
+            np.testing.assert_array_equal(self.cache.parse(take_global_column, self.path), [1., 4., 7., 10.])
+        finally:
+            COL = 0
+        self.assertIsInstance(self.cache.parse(take_global_column, self.path), np.memmap) # loaded from the cache
+
+    def test_undescribable_arguments_bypass_cache(self):
+        calls = []
+        def parser(path, opaque):
+            calls.append(path)
+            return parse_numdatafile(path)
+        self.cache.parse(parser, self.path, Opaque())
+        self.cache.parse(parser, self.path, Opaque())
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(os.path.exists(self.cache.cache_dir) and len(os.listdir(self.cache.cache_dir)) != 0)
+
+    def test_results_are_read_only_on_miss_and_hit(self):
+        for _ in range(2):
+            res = self.cache.parse(parse_numdatafile, self.path)
+            self.assertFalse(res.flags.writeable)
+            np.testing.assert_array_equal(res, np.arange(12.).reshape((4, 3)))
+
+    def test_changed_file_is_reparsed(self):
+        self.cache.parse(parse_numdatafile, self.path)
+        np.savetxt(self.path, np.ones((2, 3)), header='a b c', comments='')
+        np.testing.assert_array_equal(self.cache.parse(parse_numdatafile, self.path), np.ones((2, 3)))
+
+if __name__ == '__main__':
+    unittest.main()
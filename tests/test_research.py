@@ -0,0 +1,278 @@
+import os
+import sys
+import io
+import tempfile
+import shutil
+import contextlib
+import subprocess
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+import numpy as np
+import resorganizer.settings as rset
+from resorganizer.aux import parse_numdatafile
+from resorganizer.research import Research
+from resorganizer.monitoring import FINAL_STATES
+from resorganizer.task_execution import _wrap_with_markers
+from resorganizer.communication import RemoteHost, SshCommunication
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+try:
+    from loopback_ssh import LoopbackSshServer
+except ImportError: # paramiko is not installed
+    LoopbackSshServer = None
+
+def parse_first_column(path):
+    return parse_numdatafile(path)[:, 0]
+
+class ResearchTestCase(unittest.TestCase):
+    """Creates a research whose local storages are located in a temporary dir and tasks with the given data files.
+    """
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp())
+        self.old_local_host = dict(rset.LOCAL_HOST)
+        for name in ('main', 'storage', 'bin'):
+            os.mkdir(os.path.join(self.tmp_dir, name))
+        rset.LOCAL_HOST.update({
+            'machine_name': 'test',
+            'host_relative_data_path': os.path.join(self.tmp_dir, 'bin'),
+            'main_research_path': os.path.join(self.tmp_dir, 'main'),
+            'storage_research_path': os.path.join(self.tmp_dir, 'storage'),
+        })
+        with quiet():
+            self.research = Research.start_research('test')
+        os.mkdir(os.path.join(self.tmp_dir, 'main', self.research._research_id))
+
+    def tearDown(self):
+        rset.LOCAL_HOST.clear()
+        rset.LOCAL_HOST.update(self.old_local_host)
+        shutil.rmtree(self.tmp_dir)
+
+    def make_task(self, task_number, task_name, files={}):
+        task_path = os.path.join(self.tmp_dir, 'main', self.research._research_id, '{}-{}'.format(task_number, task_name))
+        os.mkdir(task_path)
+        for filename, content in files.items():
+            file_path = os.path.join(task_path, filename)
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'w') as f:
+                f.write(content)
+        self.research._distr_storage.invalidate()
+        return task_path
+
+class AggregateDatafileTest(ResearchTestCase):
+    def setUp(self):
+        super(AggregateDatafileTest, self).setUp()
+        for task_number in range(1, 4):
+            self.make_task(task_number, 'task', {'out.dat': 'a b\n{} {}\n'.format(task_number, -task_number)})
+
+    def test_different_parsers_do_not_share_results(self):
+        with quiet():
+            _, _, first = self.research.aggregate_datafile('out.dat', lambda p: parse_numdatafile(p)[:, 0], processes=1)
+            _, _, second = self.research.aggregate_datafile('out.dat', lambda p: parse_numdatafile(p)[:, 1], processes=1)
+        np.testing.assert_array_equal(first[:, 0], [1., 2., 3.])
+        np.testing.assert_array_equal(second[:, 0], [-1., -2., -3.])
+
+    def test_number_of_processes_does_not_affect_caching(self):
+        with quiet():
+            self.research.aggregate_datafile('out.dat', parse_first_column, processes=2)
+            _, _, data = self.research.aggregate_datafile('out.dat', parse_first_column, processes=1)
+        self.assertIsInstance(data, np.memmap) # loaded from the cache
+        np.testing.assert_array_equal(data[:, 0], [1., 2., 3.])
+
+class TaskLookupTest(ResearchTestCase):
+    def test_tasks_are_found_after_changes(self):
+        task_path = self.make_task(1, 'first')
+        self.assertEqual(self.research.get_task_path(1), task_path)
+        self.assertRaises(Exception, self.research.get_task_path, 2)
+        # no explicit invalidation, the change must be noticed by the storage itself
+        another_task_path = os.path.join(os.path.dirname(task_path), '2-second')
+        os.mkdir(another_task_path)
+        self.assertEqual(self.research.get_task_path(2), another_task_path)
+        self.assertEqual(self.research.get_task_path(1), task_path)
+
+    def test_tasks_in_storage_are_found(self):
+        storage_task_path = os.path.join(self.research.research_path, '3-stored')
+        os.mkdir(storage_task_path)
+        self.research._distr_storage.invalidate()
+        self.assertEqual(self.research.get_task_path(3), storage_task_path)
+
+class TieringTest(ResearchTestCase):
+    def setUp(self):
+        super(TieringTest, self).setUp()
+        self.tiering = self.research.enable_tiering(max_idle_days=0)
+        self.hot_task_path = self.make_task(1, 'task', {'out.dat': 'a\n1\n'})
+        with quiet():
+            self.assertEqual(self.tiering.migrate_idle_tasks(self.research._research_id), ['1-task'])
+        self.cold_task_path = os.path.join(self.research.research_path, '1-task')
+
+    def test_looking_up_does_not_promote(self):
+        self.assertEqual(self.research.get_task_path(1), self.cold_task_path)
+        self.assertTrue(os.path.exists(self.cold_task_path))
+
+    def test_data_access_promotes(self):
+        with quiet():
+            data = self.research.parse_task_datafile(1, 'out.dat')
+        np.testing.assert_array_equal(data, [[1.]])
+        self.assertEqual(self.research.get_task_path(1), self.hot_task_path)
+        self.assertFalse(os.path.exists(self.cold_task_path))
+        # the promoted task is touched, so it is not demoted back right away
+        self.tiering.max_idle_days = 1
+        with quiet():
+            self.assertEqual(self.tiering.migrate_idle_tasks(self.research._research_id), [])
+
+    def test_concurrent_moves_are_serialized(self):
+        research_id = self.research._research_id
+        with quiet():
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                paths = list(executor.map(lambda _: self.tiering.promote(research_id, '1-task'), range(4)))
+        self.assertEqual(paths, [self.hot_task_path] * 4)
+        with open(os.path.join(self.hot_task_path, 'out.dat')) as f:
+            self.assertEqual(f.read(), 'a\n1\n')
+
+class TaskLocationsTest(ResearchTestCase):
+    def test_sizes_are_computed_lazily_after_changes(self):
+        self.make_task(1, 'task', {'a.dat': '12345', 'sub/b.dat': '678'})
+        with quiet():
+            self.research.cleanup(1, [])
+        self.assertEqual(self.research.get_registry().get_locations(self.research._research_id, 1)[0]['size'], None)
+        self.assertEqual([location['size'] for location in self.research.get_task_locations(1)], [8])
+        with quiet():
+            self.research.cleanup(1, ['sub'])
+        self.assertEqual([location['size'] for location in self.research.get_task_locations(1)], [5])
+
+    def test_registry_is_created_when_needed(self):
+        registry_path = os.path.join(self.tmp_dir, 'main', 'locations.db')
+        self.assertFalse(os.path.exists(registry_path))
+        self.make_task(1, 'task', {'a.dat': '12345'})
+        with quiet():
+            self.research.cleanup(1, [])
+        self.assertTrue(os.path.exists(registry_path))
+
+    def test_tiering_and_research_use_same_location_keys(self):
+        self.make_task(1, 'task', {'a.dat': '12345'})
+        self.research._distr_storage.storage_paths = [path + '/' for path in self.research._distr_storage.storage_paths]
+        tiering = self.research.enable_tiering(max_idle_days=0)
+        with quiet():
+            self.research.cleanup(1, [])
+            tiering.migrate_idle_tasks(self.research._research_id)
+            self.research.cleanup(1, [])
+        locations = self.research.get_task_locations(1)
+        self.assertEqual([location['location'] for location in locations], [os.path.join(self.tmp_dir, 'storage')])
+        self.assertEqual(locations[0]['size'], 5)
+
+class WaitForTasksTest(ResearchTestCase):
+    def test_unknown_tasks_are_not_waited_for_and_not_finished(self):
+        self.make_task(1, 'python_task')
+        self.make_task(2, 'running_task', {'.rso/units': 'main\n', '.rso/main.started': ''})
+        with quiet():
+            states = self.research.wait_for_tasks([1], min_interval=0, timeout=5)
+        self.assertEqual(states[1]['state'], 'unknown')
+        self.assertNotIn('unknown', FINAL_STATES)
+        with quiet():
+            states = self.research.wait_for_tasks([1, 2], min_interval=0.05, timeout=0.2)
+        self.assertEqual(states[2]['state'], 'running')
+        with open(os.path.join(self.research.get_task_path(2), '.rso', 'main.exit'), 'w') as f:
+            f.write('0\n')
+        with quiet():
+            states = self.research.wait_for_tasks([1, 2], min_interval=0.05, timeout=5)
+        self.assertEqual(dict((task_number, state['state']) for task_number, state in states.items()), {1: 'unknown', 2: 'done'})
+
+    def test_units_whose_process_has_gone_are_lost(self):
+        task_path = self.make_task(1, 'direct_task', {'.rso/units': 'main\n'})
+        runner = subprocess.Popen(['sh', '-c', _wrap_with_markers('sleep 30', 'main')], cwd=task_path)
+        try:
+            while not os.path.exists(os.path.join(task_path, '.rso', 'main.started')):
+                time.sleep(0.01)
+            self.assertEqual(self.research.get_task_states([1])[1]['state'], 'running')
+        finally:
+            runner.kill()
+            runner.wait()
+        with quiet():
+            states = self.research.wait_for_tasks([1], min_interval=0.05, timeout=5)
+        self.assertEqual(states[1]['state'], 'lost')
+
+    def test_units_finished_after_query_are_not_lost(self):
+        task_path = self.make_task(1, 'direct_task', {'.rso/units': 'main\n'})
+        subprocess.check_call(['sh', '-c', _wrap_with_markers('true', 'main')], cwd=task_path)
+        with quiet():
+            states = self.research.wait_for_tasks([1], min_interval=0.05, timeout=5)
+        self.assertEqual(states[1]['state'], 'done')
+
+@unittest.skipIf(LoopbackSshServer is None, 'paramiko is not installed')
+class GrabTaskResultsTest(ResearchTestCase):
+    """Grabs the results from a remote emulated by the loopback ssh server.
+    """
+    def setUp(self):
+        super(GrabTaskResultsTest, self).setUp()
+        self.server = LoopbackSshServer()
+        remote_path = os.path.join(self.tmp_dir, 'remote')
+        self.research._exec_comm = SshCommunication(RemoteHost('127.0.0.1', 1, os.path.join(self.tmp_dir, 'bin'), remote_path), 
+                                                    'user', 'password', port=self.server.port)
+        self.remote_task_path = os.path.join(remote_path, self.research._research_id, '1-task')
+        self.write_remote({'a.dat': 'a', 'sub/b.dat': 'b', 'sub/c.dat': 'c'})
+        self.task_path = self.make_task(1, 'task')
+
+    def tearDown(self):
+        self.research._exec_comm.disconnect()
+        self.server.close()
+        super(GrabTaskResultsTest, self).tearDown()
+
+    def write_remote(self, files):
+        for filename, content in files.items():
+            file_path = os.path.join(self.remote_task_path, filename)
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'w') as f:
+                f.write(content)
+
+    def read_local(self):
+        return dict((os.path.relpath(os.path.join(dirpath, filename), self.task_path), open(os.path.join(dirpath, filename)).read())
+                    for dirpath, _, filenames in os.walk(self.task_path) for filename in filenames)
+
+    def test_regrab_copies_only_changed_files(self):
+        with quiet():
+            self.research.grab_task_results(1, verify=True)
+        self.assertEqual(self.read_local(), {'a.dat': 'a', 'sub/b.dat': 'b', 'sub/c.dat': 'c'})
+        self.write_remote({'sub/b.dat': 'new b', 'sub/d/e.dat': 'e'})
+        c_mtime_ns = os.stat(os.path.join(self.task_path, 'sub', 'c.dat')).st_mtime_ns
+        with quiet():
+            self.research.grab_task_results(1, verify=True)
+        self.assertEqual(self.read_local(), {'a.dat': 'a', 'sub/b.dat': 'new b', 'sub/c.dat': 'c', 'sub/d/e.dat': 'e'})
+        self.assertEqual(os.stat(os.path.join(self.task_path, 'sub', 'c.dat')).st_mtime_ns, c_mtime_ns)
+
+    def test_regrab_without_verification_merges_dirs(self):
+        with quiet():
+            self.research.grab_task_results(1, copies_list=[{'path': 'sub'}])
+            self.write_remote({'sub/b.dat': 'new b'})
+            self.research.grab_task_results(1, copies_list=[{'path': 'sub'}])
+        self.assertEqual(self.read_local(), {'sub/b.dat': 'new b', 'sub/c.dat': 'c'})
+
+class HashCacheForgetTest(ResearchTestCase):
+    def _cached_paths(self):
+        return sorted(row[0] for row in self.research.get_hash_cache()._conn.execute('SELECT path FROM hashes'))
+
+    def test_removed_and_moved_files_are_forgotten(self):
+        task_path = self.make_task(1, 'task', {'a.dat': 'a', 'sub/b.dat': 'b'})
+        other_task_path = self.make_task(2, 'task', {'a.dat': 'a'})
+        cache = self.research.get_hash_cache()
+        cache.hash_files([task_path, other_task_path])
+        with quiet():
+            self.research.cleanup(1, ['sub'])
+        self.assertEqual(self._cached_paths(), [os.path.join(task_path, 'a.dat'), os.path.join(other_task_path, 'a.dat')])
+        with quiet():
+            self.research.bulk_cleanup(['a.dat'], task_numbers=[2])
+        self.assertEqual(self._cached_paths(), [os.path.join(task_path, 'a.dat')])
+        tiering = self.research.enable_tiering(max_idle_days=0)
+        with quiet():
+            tiering.migrate_idle_tasks(self.research._research_id)
+        self.assertEqual(self._cached_paths(), [])
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import shutil
+import unittest
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+import numpy as np
+from resorganizer.results_store import ResultsStore
+
+class ResultsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.tmp_dir, 'store')
+        self.store = ResultsStore(self.store_dir, chunk_rows=4)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, task_number, rows, mtime_ns=None):
+        path = os.path.join(self.tmp_dir, '{}.dat'.format(task_number))
+        with open(path, 'w') as f:
+            f.write('x y\n' + ''.join('{} {}\n'.format(*row) for row in rows))
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        return path
+
+    def _ingest(self, task_rows):
+        tasks = [(task_number, self._write(task_number, rows), {'param': 10 * task_number}) for task_number, rows in task_rows.items()]
+        return self.store.ingest('out', tasks, processes=1)
+
+    def test_ingest_and_read(self):
+        self.assertEqual(self._ingest({2: [(2, 20)], 1: [(1, 10), (1, 11)], 3: [(3, 30), (3, 31), (3, 32)]}), [2, 1, 3])
+        self.assertEqual(self.store.get_columns('out'), ['x', 'y'])
+        data = self.store.read('out')
+        np.testing.assert_array_equal(data['task_number'], [1, 1, 2, 3, 3, 3])
+        np.testing.assert_array_equal(data['y'], [10, 11, 20, 30, 31, 32])
+        data = self.store.read('out', columns=['y'], task_range=(2, 4), where=lambda task_number, params: params['param'] != 20)
+        self.assertEqual(sorted(data), ['task_number', 'y'])
+        np.testing.assert_array_equal(data['y'], [30, 31, 32])
+
+    def test_unchanged_tasks_are_skipped_and_changed_ones_reingested(self):
+        self._ingest({1: [(1, 10)], 2: [(2, 20)]})
+        self._write(2, [(2, 21), (2, 22)], mtime_ns=1)
+        tasks = [(task_number, os.path.join(self.tmp_dir, '{}.dat'.format(task_number)), {}) for task_number in (1, 2)]
+        self.assertEqual(self.store.ingest('out', tasks, processes=1), [2])
+        np.testing.assert_array_equal(self.store.read('out')['y'], [10, 21, 22])
+
+    def test_compaction_drops_stale_rows(self):
+        self._ingest({1: [(1, 10), (1, 11)], 2: [(2, 20), (2, 21)]})
+        self._write(1, [(1, 12)], mtime_ns=1)
+        self.store.ingest('out', [(1, os.path.join(self.tmp_dir, '1.dat'), {})], processes=1)
+        dataset_path = os.path.join(self.store_dir, 'out')
+        self.assertEqual(len([name for name in os.listdir(dataset_path) if name.startswith('chunk_')]), 2)
+        self.assertEqual(self.store.compact('out'), 2) # both old rows of task 1
+        self.assertEqual(len([name for name in os.listdir(dataset_path) if name.startswith('chunk_')]), 1)
+        np.testing.assert_array_equal(self.store.read('out')['y'], [12, 20, 21])
+        self.assertEqual(self.store.compact('out'), 0)
+
+    def test_single_column_results(self):
+        path = self._write(1, [(1, 10), (1, 11), (1, 12)])
+        self.store.ingest('y', [(1, path, {})], parser=lambda p: np.loadtxt(p, skiprows=1)[:, 1], column_names=['y'], processes=1)
+        np.testing.assert_array_equal(self.store.read('y')['y'], [10, 11, 12])
+        np.testing.assert_array_equal(self.store.read('y')['task_number'], [1, 1, 1])
+
+    def test_chunk_columns_are_loaded_once_per_read(self):
+        self._ingest({1: [(1, 10)], 2: [(2, 20)], 3: [(3, 30)]})
+        loaded = []
+        load_column = self.store._load_column
+        self.store._load_column = lambda *args: loaded.append(args) or load_column(*args)
+        data = self.store.read('out', columns=['y'], task_numbers=[1, 3]) # two pieces of the same chunk
+        np.testing.assert_array_equal(data['y'], [10, 30])
+        self.assertEqual(len(loaded), 1)
+
+    def test_reading_missing_dataset_does_not_create_it(self):
+        self.assertRaises(Exception, self.store.read, 'typo')
+        self.assertEqual(self.store.get_columns('typo'), None)
+        self.assertEqual(self.store.get_tasks('typo'), [])
+        self.assertEqual(self.store.get_datasets(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.store_dir, 'typo')))
+        self._ingest({1: [(1, 10)]})
+        self.assertEqual(self.store.get_datasets(), ['out'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+from resorganizer.task import Command, GraphCommandTask
+
+class GraphCommandTaskTest(unittest.TestCase):
+    def setUp(self):
+        self.task = GraphCommandTask(Command('prog'))
+        self.task.set_substitution('a', produces=('a.dat',))
+        self.task.set_substitution('b', depends_on=('a',))
+        self.task.set_substitution('c', consumes=('a.dat',), produces=('c.dat',))
+        self.task.set_substitution('d', depends_on=('b',), consumes=('c.dat',))
+
+    def test_topological_order(self):
+        self.assertEqual(self.task.topological_order(), ['a', 'b', 'c', 'd'])
+
+    def test_restriction_drops_dependencies_on_dropped_substitutions(self):
+        restricted = self.task.restricted_to(['b', 'c', 'd'])
+        self.assertEqual(restricted.dependencies(), {'b': [], 'c': [], 'd': ['b', 'c']})
+        self.assertEqual(self.task.restricted_to(['b']).topological_order(), ['b'])
+        # the original task is intact
+        self.assertEqual(self.task.dependencies()['b'], ['a'])
+
+if __name__ == '__main__':
+    unittest.main()
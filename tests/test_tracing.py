@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import shutil
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+from resorganizer.tracing import tracer, in_current_context, MemorySink, JsonlSink
+from resorganizer.distributed_storage import DistributedStorage
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sink = MemorySink()
+        tracer.enable([self.sink])
+
+    def tearDown(self):
+        tracer.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_record(self, name):
+        return next(record for record in self.sink.records if record['name'] == name)
+
+    def test_reenabling_closes_previous_sinks(self):
+        jsonl_sink = JsonlSink(os.path.join(self.tmp_dir, 'spans.jsonl'))
+        tracer.enable([jsonl_sink])
+        tracer.enable([self.sink])
+        self.assertTrue(jsonl_sink._file.closed)
+
+    def test_counts_in_worker_threads_are_attributed_to_caller(self):
+        def work(i):
+            tracer.count('items')
+            with tracer.span('inner'):
+                tracer.count('bytes', i)
+        with tracer.span('outer'):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(in_current_context(work), range(100)))
+        outer = self._get_record('outer')
+        self.assertEqual(outer['counters'], {'items': 100, 'bytes': sum(range(100))})
+        self.assertTrue(all(record['parent_id'] == outer['id'] for record in self.sink.records if record['name'] == 'inner'))
+
+    def test_counts_in_storage_source_workers_are_attributed_to_caller(self):
+        os.makedirs(os.path.join(self.tmp_dir, 'a', 'x'))
+        os.makedirs(os.path.join(self.tmp_dir, 'b'))
+        storage = DistributedStorage([os.path.join(self.tmp_dir, 'a'), os.path.join(self.tmp_dir, 'b')], source_timeout=10.)
+        def lookup(dir_path):
+            tracer.count('lookups')
+            return dir_path, dir_path
+        with tracer.span('lookup'):
+            storage.lookup_through_dir('', lookup)
+        self.assertEqual(self._get_record('lookup')['counters'], {'lookups': 2})
+
+if __name__ == '__main__':
+    unittest.main()